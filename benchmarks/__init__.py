@@ -0,0 +1,4 @@
+"""
+Offline benchmarks for the PRoW analysis pipeline, run on synthetic data.
+Run each benchmark as a module from the repo root, e.g. `python -m benchmarks.bench_gpx_parser`.
+"""
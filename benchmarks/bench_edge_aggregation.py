@@ -0,0 +1,49 @@
+"""
+Benchmark per-edge aggregation of matched GPS points: groupby().apply(count_and_count_unique_tracks) in
+match_nearest_edges vs the single-pass aggregate_edge_matches, as the number of edges grows.
+
+Usage: python -m benchmarks.bench_edge_aggregation [--points 1000000] [--edges 1000 10000 100000]
+"""
+import time, argparse
+
+import numpy as np
+import pandas as pd
+
+from prow.utils.utils import match_nearest_edges, aggregate_edge_matches
+
+def synthetic_edges(n_edges: int, seed: int = 0) -> pd.DataFrame:
+    """Edge table indexed by (u, v, key) with OSM-sized node ids and a length column"""
+    rng = np.random.default_rng(seed)
+    u = rng.integers(1e9, 1e10, n_edges)
+    v = rng.integers(1e9, 1e10, n_edges)
+    index = pd.MultiIndex.from_arrays([u, v, np.zeros(n_edges, dtype=np.int64)], names=["u", "v", "key"])
+    return pd.DataFrame({"length": rng.uniform(5, 500, n_edges)}, index=index)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, default=1000000)
+    parser.add_argument("--edges", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    print(f"{'edges':>8} {'groupby (s)':>12} {'single-pass (s)':>16} {'equal':>6}")
+    for n_edges in args.edges:
+        edges = synthetic_edges(n_edges)
+        pos = rng.integers(0, n_edges, args.points)
+        trackids = rng.integers(0, args.points // 100, args.points)
+        gps_df = pd.DataFrame({"ne": edges.index[pos].to_numpy(), "trackid": trackids})
+
+        start = time.perf_counter()
+        expected = match_nearest_edges(edges, gps_df)
+        t_groupby = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = aggregate_edge_matches(edges, pos, trackids)
+        t_single = time.perf_counter() - start
+
+        expected = expected.set_index(["u", "v", "key"]) if "u" in expected.columns else expected
+        equal = actual[["count", "tracks"]].sort_index().equals(expected[["count", "tracks"]].sort_index())
+        print(f"{n_edges:>8} {t_groupby:>12.3f} {t_single:>16.3f} {str(equal):>6}")
+
+if __name__ == "__main__":
+    main()
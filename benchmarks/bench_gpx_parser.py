@@ -0,0 +1,49 @@
+"""
+Benchmark gpxpy vs streaming GPX parsing in gpx_converter.Converter: points/second and peak RSS.
+Each measurement runs in a fresh process so that peak RSS is not polluted by previous runs.
+
+Usage: python -m benchmarks.bench_gpx_parser [--points 10000 100000 1000000]
+"""
+import os, time, argparse, tempfile, resource
+import multiprocessing as mp
+
+from prow.utils.gpx_converter import Converter
+from .synthetic import write_synthetic_gpx
+
+def _measure(fn: str, engine: str, queue: mp.Queue) -> None:
+    start = time.perf_counter()
+    df = Converter(input_file=fn).gpx_to_dataframe(i=0, engine=engine)
+    elapsed = time.perf_counter() - start
+    queue.put((len(df), elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+def measure(fn: str, engine: str) -> tuple:
+    """Parse GPX file in a fresh process.
+
+    Returns:
+        tuple: (number of points, seconds, peak RSS in MB)
+    """
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    p = ctx.Process(target=_measure, args=(fn, engine, queue))
+    p.start()
+    out = queue.get()
+    p.join()
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--points-per-track", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'points':>10} {'engine':>8} {'points/s':>12} {'peak RSS MB':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.points:
+            fn = os.path.join(tmp, f"synthetic_{n}.gpx")
+            write_synthetic_gpx(fn, n_tracks=max(n // args.points_per_track, 1), points_per_track=min(n, args.points_per_track))
+            for engine in ["gpxpy", "stream"]:
+                n_points, elapsed, rss = measure(fn, engine)
+                print(f"{n_points:>10} {engine:>8} {n_points / elapsed:>12.0f} {rss:>12.1f}")
+
+if __name__ == "__main__":
+    main()
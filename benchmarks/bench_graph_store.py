@@ -0,0 +1,98 @@
+"""
+Benchmark of graph save/load times and sizes on disk, GraphML vs parquet graph store.
+Uses given authority .graphml files, or synthetic path networks of growing size.
+Loaded graphs are checked to have the same nodes, edges and edge attributes as the original, and loaded
+parquet stores, including partitioned stores finalised by GraphOutputWriter, to keep the types of graph
+attributes and edge attributes of mixed types.
+
+Usage: python -m benchmarks.bench_graph_store [--graphml data/graphs/E06000001_0.graphml ...] [--sizes 50 100 200]
+"""
+import os, sys, time, shutil, argparse, tempfile
+from pathlib import Path
+
+import osmnx as ox
+
+from prow.utils.graph_store import save_graph, load_graph, GraphOutputWriter, GRAPH_STORE_EXT
+from prow.utils.utils import ADDITIONAL_EDGE_DTYPES
+from .synthetic import synthetic_path_graph
+
+def disk_size(path: str) -> int:
+    path = Path(path)
+    return path.stat().st_size if path.is_file() else sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+def edge_set(G) -> set:
+    """Set of (u, v, key, osmid), with u <= v since undirected graphs may be loaded with edges reoriented"""
+    return set((min(u, v), max(u, v), k, d.get("osmid")) for u, v, k, d in G.edges(keys=True, data=True))
+
+def same_graph(G, H) -> bool:
+    return set(G.nodes) == set(H.nodes) and edge_set(G) == edge_set(H)
+
+def typed_attributes(G) -> None:
+    """Set boolean and integer graph attributes and edge attribute mixing booleans and strings"""
+    G.graph["simplified"] = False
+    G.graph["n"] = 3
+    for i, (u, v, k) in enumerate(G.edges(keys=True)):
+        G.edges[u, v, k]["bridge"] = [True, False, "viaduct"][i % 3]
+
+def same_types(G, H) -> bool:
+    """Return whether typed_attributes of G are loaded in H with the same values and types"""
+    def bridges(G):
+        return set((min(u, v), max(u, v), k, repr(d.get("bridge"))) for u, v, k, d in G.edges(keys=True, data=True))
+    return H.graph.get("simplified") is False and H.graph.get("n") == 3 and bridges(G) == bridges(H)
+
+def partitioned_types(G, fn: str) -> bool:
+    """Return whether typed_attributes of G are kept by a partitioned store of two parts, finalised with the
+    graph attributes of its first part and with given graph attributes"""
+    writer = GraphOutputWriter(fn)
+    writer.write(0, G)
+    writer.write(1, G)
+    writer.finalise()
+    same = same_types(G, load_graph(fn, edge_dtypes=ADDITIONAL_EDGE_DTYPES))
+    writer.finalise(graph_attrs=G.graph)
+    return same and same_types(G, load_graph(fn, edge_dtypes=ADDITIONAL_EDGE_DTYPES))
+
+def time_format(G, fn: str, graph_format: str) -> tuple:
+    start = time.perf_counter()
+    save_graph(G, fn, graph_format=graph_format)
+    t_save = time.perf_counter() - start
+    start = time.perf_counter()
+    H = load_graph(fn, edge_dtypes=ADDITIONAL_EDGE_DTYPES)
+    t_load = time.perf_counter() - start
+    return t_save, t_load, H
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--graphml", nargs="*", default=[], help="existing .graphml files to benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100, 200])
+    args = parser.parse_args()
+
+    if args.graphml:
+        graphs = [(os.path.basename(fn), ox.load_graphml(fn)) for fn in args.graphml]
+    else:
+        graphs = [(f"synthetic {size}x{size}", synthetic_path_graph(size, size)) for size in args.sizes]
+
+    ok = True
+    print(f"{'graph':>20} {'edges':>7} {'format':>8} {'save (s)':>9} {'load (s)':>9} {'MB':>7} {'equal':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, G in graphs:
+            for graph_format in ["graphml", "parquet"]:
+                fn = os.path.join(tmp, f"{graph_format}")
+                t_save, t_load, H = time_format(G, fn, graph_format)
+                path = fn + (".graphml" if graph_format == "graphml" else GRAPH_STORE_EXT)
+                equal = same_graph(G, H)
+                if graph_format == "parquet":
+                    typed = G.copy()
+                    typed_attributes(typed)
+                    save_graph(typed, fn, graph_format=graph_format)
+                    equal = equal and same_types(typed, load_graph(fn, edge_dtypes=ADDITIONAL_EDGE_DTYPES)) \
+                            and partitioned_types(typed, os.path.join(tmp, "partitioned"))
+                    shutil.rmtree(os.path.join(tmp, "partitioned") + GRAPH_STORE_EXT)
+                ok = ok and equal
+                print(f"{name:>20} {len(G.edges):>7} {graph_format:>8} {t_save:>9.3f} {t_load:>9.3f} {disk_size(path) / 1e6:>7.2f} {str(equal):>6}")
+                os.remove(path) if os.path.isfile(path) else shutil.rmtree(path)
+
+    if not ok:
+        sys.exit("graph store round trip differs from original graph")
+
+if __name__ == "__main__":
+    main()
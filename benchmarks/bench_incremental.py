@@ -0,0 +1,62 @@
+"""
+Benchmark of incremental updates with activity ledgers vs full reanalysis, when a small batch of new public
+tracks arrives after a large one. Full reanalysis interpolates and matches the points of both batches again;
+an incremental update (analysis.update_batch) only interpolates and matches the new batch, adds it to each
+subregion's ledger and derives outputs from the ledgers. Checks that both give the same output edges and
+activity. Exits with status 1 if they differ.
+
+Usage: python -m benchmarks.bench_incremental [--size 40] [--tracks 4000] [--new-tracks 100] [--workers 1]
+"""
+import os, sys, argparse, tempfile
+
+from prow import analysis
+from prow.utils import point_store, graph_store
+from prow.utils.utils import ADDITIONAL_EDGE_DTYPES
+from prow.utils.interpolate import batch_geo_interpolate_df
+from .synthetic import synthetic_path_graph, tracks_along_graph
+from .bench_region_fanout import authority_boundaries, run_quiet
+from .bench_national_tiles import build_graphs
+
+def edge_activity(out_fn: str) -> dict:
+    """Return activity of each edge of output graphs P, B and R, keyed by graph and undirected edge"""
+    activity = {}
+    for g in ["P", "B", "R"]:
+        G = graph_store.load_graph(f"{out_fn}_{g}", edge_dtypes=ADDITIONAL_EDGE_DTYPES)
+        activity.update({(g, min(u, v), max(u, v), k): round(float(d["activity"]), 6) for u, v, k, d in G.edges(keys=True, data=True)})
+    return activity
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=40, help="grid size of synthetic path network")
+    parser.add_argument("--tracks", type=int, default=4000, help="number of public tracks in first batch")
+    parser.add_argument("--new-tracks", type=int, default=100, help="number of public tracks in new batch")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    args = parser.parse_args()
+
+    G = synthetic_path_graph(args.size, args.size, drop_frac=0.3)
+    graph_boundary = authority_boundaries(G, 1)[0]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        point_store.write_point_store([tracks_along_graph(G, n_tracks=args.tracks, seed=1, gap_frac=0.05, off_network_frac=0.02)], os.path.join(tmp, "public_old"))
+        point_store.write_point_store([tracks_along_graph(G, n_tracks=args.new_tracks, seed=3, gap_frac=0.05, off_network_frac=0.02)], os.path.join(tmp, "public_new"))
+        row = batch_geo_interpolate_df(tracks_along_graph(G, n_tracks=args.tracks // 20, edges_per_track=10, seed=2, noise_m=0.5), dist_m=5, segmentation=False)
+        point_store.write_point_store([row], os.path.join(tmp, "row"))
+        build_graphs(G, graph_boundary, os.path.join(tmp, "graph"))
+        batches = [os.path.join(tmp, "public_old"), os.path.join(tmp, "public_new")]
+        kwargs = dict(row_data=os.path.join(tmp, "row"), graph_data=os.path.join(tmp, "graph"), graph_boundary=graph_boundary, workers=args.workers)
+
+        t_first = run_quiet(analysis.update_batch, public_data=batches[:1], out_fn=os.path.join(tmp, "incremental"), **kwargs)
+        t_full = run_quiet(analysis.analyse_batch, public_data=batches, out_fn=os.path.join(tmp, "full"), **kwargs)
+        t_update = run_quiet(analysis.update_batch, public_data=batches, out_fn=os.path.join(tmp, "incremental"), **kwargs)
+
+        print(f"{len(graph_boundary)} subregions, {args.tracks} tracks then {args.new_tracks} new tracks")
+        print(f"first batch into ledgers: {t_first:.2f}s")
+        print(f"full reanalysis: {t_full:.2f}s, incremental update: {t_update:.2f}s ({t_full / t_update:.1f}x)")
+        full, incremental = edge_activity(os.path.join(tmp, "full")), edge_activity(os.path.join(tmp, "incremental"))
+        if full != incremental:
+            print(f"FAIL outputs differ: {len(full)} vs {len(incremental)} edges, {len(set(full.items()) ^ set(incremental.items()))} differences")
+            sys.exit(1)
+        print(f"Outputs equal: {len(full)} edges")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark of per-authority squares vs shared national tiles, on a synthetic region split into overlapping
+vertical strips of authorities. Per-authority analysis cuts each authority into its own squares, so the
+overlaps along borders are built and map-matched once per authority; national tiles are built and analysed
+once, grouped by the authorities they intersect, and each authority is assembled from its tiles. Graphs are
+cut from one synthetic network in place of downloads. Reports graph nodes processed, timings, and the
+agreement of output edges with activity.
+
+Usage: python -m benchmarks.bench_national_tiles [--size 120] [--spacing 400] [--authorities 3] [--tracks 8000]
+"""
+import os, time, argparse, tempfile
+
+import osmnx as ox
+import networkx as nx
+from shapely.geometry import box
+
+from prow import analysis
+from prow.utils import point_store, graph_store
+from prow.utils.utils import metres_to_dist, boundary_items, SPLIT_POLYGON_BOX_LENGTH
+from prow.utils.national_grid import TileIndex, tile_polygon
+from prow.utils.spatial_index import GridBucketIndex
+from prow.utils.interpolate import batch_geo_interpolate_df
+from .synthetic import synthetic_path_graph, tracks_along_graph
+from .bench_region_fanout import activity_edges, run_quiet
+
+def authority_boundaries(G, n: int, overlap: float = 0.01) -> dict:
+    """Split bounds of graph into n vertical strips, each widened by overlap degrees, as buffered authority boundaries"""
+    west, south, east, north = ox.graph_to_gdfs(G, nodes=False).total_bounds
+    dx = (east - west) / n
+    return {f"A{k}": box(west + k * dx - overlap, south - overlap, west + (k + 1) * dx + overlap, north + overlap) for k in range(n)}
+
+def build_graphs(G, graph_boundary, fn: str) -> int:
+    """Cut graphs of subregions from network, in place of downloading them, returning total number of nodes"""
+    n_nodes = 0
+    for i, geom in boundary_items(graph_boundary):
+        try:
+            sub = ox.truncate.truncate_graph_polygon(G, geom).to_undirected()
+        except ValueError:
+            sub = nx.MultiGraph() # empty, as download_data.download_graphs saves
+        graph_store.save_graph(sub, f"{fn}_{i}")
+        n_nodes += sub.number_of_nodes()
+    return n_nodes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=120, help="grid size of synthetic path network")
+    parser.add_argument("--spacing", type=float, default=400, help="spacing of synthetic path network in metres")
+    parser.add_argument("--authorities", type=int, default=3, help="number of authorities")
+    parser.add_argument("--tracks", type=int, default=8000, help="number of public tracks")
+    args = parser.parse_args()
+
+    G = synthetic_path_graph(args.size, args.size, spacing_m=args.spacing, drop_frac=0.3)
+    boundaries = authority_boundaries(G, args.authorities)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        public = tracks_along_graph(G, n_tracks=args.tracks, seed=1)
+        point_store.write_point_store([public], os.path.join(tmp, "public"))
+        row = batch_geo_interpolate_df(tracks_along_graph(G, n_tracks=args.tracks // 10, edges_per_track=10, seed=2, noise_m=0.5), dist_m=5, segmentation=False)
+        row_index = GridBucketIndex.from_df(row, bounds=(row["longitude"].min(), row["latitude"].min(), row["longitude"].max(), row["latitude"].max()))
+        for a, geom in boundaries.items():
+            point_store.write_point_store([row.iloc[row_index.query(geom)]], os.path.join(tmp, "row", a))
+        public_data = os.path.join(tmp, "public")
+
+        # Per-authority squares
+        start = time.perf_counter()
+        n_authority = 0
+        for a, geom in boundaries.items():
+            graph_boundary = list(ox.utils_geo._quadrat_cut_geometry(geom, quadrat_width=metres_to_dist(SPLIT_POLYGON_BOX_LENGTH)).geoms)
+            n_authority += build_graphs(G, graph_boundary, os.path.join(tmp, "graphs", a))
+            run_quiet(analysis.analyse_batch, row_data=os.path.join(tmp, "row", a), public_data=public_data, graph_data=os.path.join(tmp, "graphs", a),
+                      graph_boundary=graph_boundary, out_fn=os.path.join(tmp, "authority", a))
+        t_authority = time.perf_counter() - start
+
+        # National tiles
+        start = time.perf_counter()
+        index = TileIndex.from_boundaries(boundaries)
+        tiles = {t: tile_polygon(t) for t in index.tile_authorities}
+        n_national, outputs = build_graphs(G, tiles, os.path.join(tmp, "graphs", "national")), {}
+        for group, group_tiles in index.groups().items():
+            out_fn = os.path.join(tmp, "national", "_".join(group))
+            run_quiet(analysis.analyse_batch, row_data=[os.path.join(tmp, "row", a) for a in group], public_data=public_data, graph_data=os.path.join(tmp, "graphs", "national"),
+                      graph_boundary={t: tiles[t] for t in group_tiles}, out_fn=out_fn)
+            outputs.update({t: (out_fn, tiles[t]) for t in group_tiles})
+        for a, geom in boundaries.items():
+            run_quiet(analysis.assemble_outputs, {t: outputs[t] for t in index.tiles(a)}, geom, out_fn=os.path.join(tmp, "assembled", a))
+        t_national = time.perf_counter() - start
+
+        print(f"{len(boundaries)} authorities, {len(tiles)} national tiles in {len(index.groups())} groups, {len(public)} public points")
+        print(f"{'partition':>10} {'graph nodes':>12} {'time (s)':>9}")
+        print(f"{'authority':>10} {n_authority:>12} {t_authority:>9.2f}")
+        print(f"{'national':>10} {n_national:>12} {t_national:>9.2f}")
+        for a in boundaries:
+            x, y = activity_edges(os.path.join(tmp, "authority", a)), activity_edges(os.path.join(tmp, "assembled", a))
+            print(f"authority {a}: {len(x)} vs {len(y)} edges with activity, jaccard {len(x & y) / max(len(x | y), 1):.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Equivalence check and benchmark of the offline path network builder against osmnx. The reference graph
+for each quadrat is built by osmnx from the same extract, filtered to path highways and truncated to
+the quadrat, which is what ox.graph_from_polygon returns from Overpass. Graphs are compared by nodes
+and undirected (u, v, osmid) edges, for each quadrat and a multipolygon of two opposite corner quadrats.
+The check uses the checked-in fixture, as XML and, if pyosmium is
+installed, converted to PBF. Timings use larger synthetic extracts.
+
+Usage: python -m benchmarks.bench_osm_extract [--sizes 50 100] [--quadrats 4]
+"""
+import os, re, sys, time, argparse, tempfile
+from pathlib import Path
+
+import osmnx as ox
+from shapely.geometry import box
+from shapely.ops import unary_union
+
+from prow.utils.osm_extract import PathNetwork
+from prow.utils.utils import PATH_HIGHWAY_FILTER
+from .synthetic import write_synthetic_osm
+
+FIXTURE = str(Path(__file__).parent / "fixtures" / "paths.osm")
+
+def quadrats(network: PathNetwork, n: int) -> list:
+    """Split padded bounds of network nodes into n x n boxes, so that no node lies on the outer boundary"""
+    west, south, east, north = network.lons.min() - 1e-5, network.lats.min() - 1e-5, network.lons.max() + 1e-5, network.lats.max() + 1e-5
+    dx, dy = (east - west) / n, (north - south) / n
+    return [box(west + i * dx, south + j * dy, west + (i + 1) * dx, south + (j + 1) * dy) for i in range(n) for j in range(n)]
+
+def reference_graphs(fn: str, polygons: list) -> list:
+    G = ox.graph_from_xml(fn, simplify=False, retain_all=True)
+    pattern = re.compile(PATH_HIGHWAY_FILTER)
+    G = G.edge_subgraph([(u, v, k) for u, v, k, d in G.edges(keys=True, data=True) if pattern.search(d.get("highway", ""))]).copy()
+    return [ox.truncate.truncate_graph_polygon(G, polygon).to_undirected() for polygon in polygons]
+
+def network_graphs(network: PathNetwork, polygons: list) -> list:
+    index = network.node_index(unary_union(polygons).bounds)
+    return [network.graph_in_polygon(polygon, index=index) for polygon in polygons]
+
+def same_graph(G, H) -> bool:
+    edges = lambda G: sorted((min(u, v), max(u, v), d["osmid"]) for u, v, d in G.edges(data=True))
+    return set(G.nodes) == set(H.nodes) and edges(G) == edges(H)
+
+def to_pbf(fn: str, pbf_fn: str) -> bool:
+    """Convert XML extract to PBF with pyosmium, returning False if pyosmium is not installed"""
+    try:
+        import osmium
+    except ImportError:
+        return False
+    writer = osmium.SimpleWriter(pbf_fn)
+    for obj in osmium.FileProcessor(fn):
+        writer.add(obj)
+    writer.close()
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100], help="grid sizes of synthetic extracts")
+    parser.add_argument("--quadrats", type=int, default=4, help="quadrats per side")
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        extracts = [FIXTURE] + ([os.path.join(tmp, "paths.osm.pbf")] if to_pbf(FIXTURE, os.path.join(tmp, "paths.osm.pbf")) else [])
+        for fn in extracts:
+            network = PathNetwork.from_extract(fn)
+            polygons = quadrats(network, args.quadrats)
+            polygons.append(unary_union([polygons[0], polygons[-1]]))
+            equal = all(same_graph(G, H) for G, H in zip(network_graphs(network, polygons), reference_graphs(FIXTURE, polygons)))
+            ok = ok and equal
+            print(f"{os.path.basename(fn)}: {len(network.u)} edges, {len(polygons) - 1} quadrats and a multipolygon, equal to osmnx: {equal}")
+
+        print(f"{'grid':>6} {'edges':>8} {'osmnx (s)':>10} {'build (s)':>10} {'cut (s)':>8} {'cached cut (s)':>15}")
+        for size in args.sizes:
+            fn = os.path.join(tmp, f"synthetic_{size}.osm")
+            write_synthetic_osm(fn, n_rows=size, n_cols=size)
+
+            start = time.perf_counter()
+            network = PathNetwork.load_or_build(fn)
+            t_build = time.perf_counter() - start
+            polygons = quadrats(network, args.quadrats)
+
+            start = time.perf_counter()
+            network_graphs(network, polygons)
+            t_cut = time.perf_counter() - start
+
+            start = time.perf_counter()
+            network_graphs(PathNetwork.load_or_build(fn), polygons)
+            t_cached = time.perf_counter() - start
+
+            start = time.perf_counter()
+            reference_graphs(fn, polygons)
+            t_osmnx = time.perf_counter() - start
+
+            print(f"{size:>6} {len(network.u):>8} {t_osmnx:>10.3f} {t_build:>10.3f} {t_cut:>8.3f} {t_cached:>15.3f}")
+
+    if not ok:
+        sys.exit("path network graphs differ from osmnx")
+
+if __name__ == "__main__":
+    main()
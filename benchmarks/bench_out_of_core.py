@@ -0,0 +1,86 @@
+"""
+Benchmark of peak memory of analysing regions of increasing size with the same density of public GPS tracks,
+reading points of the whole region at once against reading the points of each subregion separately with a
+memory budget (see analysis.analyse_batch). Each run is in a fresh process, reporting growth of its peak RSS
+from /proc (Linux only), as getrusage also counts the peak of the parent process before exec. Also checks
+that both give the same outputs. Exits with status 1 if they don't. Point store tiles are scaled down with the
+synthetic regions, which are much smaller than real regions, so that each subregion reads a few tiles.
+
+Usage: python -m benchmarks.bench_out_of_core [--sizes 30 60 90] [--tracks-per-km2 20] [--memory-mb 1] [--tile-size 0.01]
+"""
+import os, sys, argparse, tempfile, multiprocessing
+
+import osmnx as ox
+
+from prow import analysis
+from prow.utils import point_store
+from prow.utils.interpolate import batch_geo_interpolate_df
+from .synthetic import synthetic_path_graph, tracks_along_graph
+from .bench_region_fanout import authority_boundaries, activity_edges, run_quiet
+from .bench_national_tiles import build_graphs
+
+def proc_status_mb(field: str) -> float:
+    """Read memory field of this process, e.g. "VmRSS" or peak "VmHWM", from /proc in MB"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+
+def analyse(kwargs: dict, results) -> None:
+    """Analyse in this process, putting growth of peak RSS in MB and seconds taken in results queue"""
+    start_rss = proc_status_mb("VmRSS")
+    seconds = run_quiet(analysis.analyse_batch, **kwargs)
+    results.put((proc_status_mb("VmHWM") - start_rss, seconds))
+
+def run(kwargs: dict) -> tuple:
+    """Run analysis in a fresh process, so that peak RSS of earlier runs isn't counted"""
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=analyse, args=(kwargs, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"analysis process exited with status {process.exitcode}")
+    return results.get()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[30, 60, 90], help="grid sizes of synthetic path networks")
+    parser.add_argument("--tracks-per-km2", type=float, default=20, help="density of public tracks")
+    parser.add_argument("--memory-mb", type=float, default=1, help="memory budget of out-of-core runs, small enough to always apply")
+    parser.add_argument("--tile-size", type=float, default=0.01, help="side length of point store tiles in degrees")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'size':>5} {'km2':>6} {'points':>9} {'in memory (MB)':>15} {'out of core (MB)':>17} {'in memory (s)':>14} {'out of core (s)':>16}")
+    for size in args.sizes:
+        G = synthetic_path_graph(size, size, drop_frac=0.3)
+        west, south, east, north = ox.graph_to_gdfs(G, nodes=False).total_bounds
+        km2 = (east - west) * (north - south) * 111.2 ** 2 * 0.61 # cos of latitude of synthetic origin
+        graph_boundary = authority_boundaries(G, 1)[0]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            public = tracks_along_graph(G, n_tracks=int(args.tracks_per_km2 * km2), seed=1)
+            n_points = point_store.write_point_store([public], os.path.join(tmp, "public"), tile_size=args.tile_size)
+            row = batch_geo_interpolate_df(tracks_along_graph(G, n_tracks=max(int(km2), 1), edges_per_track=10, seed=2, noise_m=0.5), dist_m=5, segmentation=False)
+            point_store.write_point_store([row], os.path.join(tmp, "row"), tile_size=args.tile_size)
+            del public, row
+            build_graphs(G, graph_boundary, os.path.join(tmp, "graph"))
+
+            kwargs = dict(row_data=os.path.join(tmp, "row"), public_data=os.path.join(tmp, "public"), graph_data=os.path.join(tmp, "graph"), graph_boundary=graph_boundary)
+            rss_in, t_in = run({**kwargs, "out_fn": os.path.join(tmp, "in_memory", "out")})
+            rss_out, t_out = run({**kwargs, "out_fn": os.path.join(tmp, "out_of_core", "out"), "memory_mb": args.memory_mb})
+            print(f"{size:>5} {km2:>6.0f} {n_points:>9} {rss_in:>15.1f} {rss_out:>17.1f} {t_in:>14.2f} {t_out:>16.2f}")
+
+            a, b = activity_edges(os.path.join(tmp, "in_memory", "out")), activity_edges(os.path.join(tmp, "out_of_core", "out"))
+            if a != b:
+                failures.append(f"size {size}: {len(a)} vs {len(b)} edges with activity")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if len(failures) > 0:
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark of fixed grid vs density-adaptive quadtree partitioning of a region with a dense town and
+sparse countryside of synthetic GPS points. Reports the number of subregions and the balance of points
+per subregion, and checks that subregions cover the region exactly. Also partitions the region split in two
+by a narrow strip, so that quadtree squares across the strip are clipped to two parts, and checks that every
+subregion is a single polygon.
+
+Usage: python -m benchmarks.bench_partition [--town 2000000] [--rural 200000] [--max-points 200000]
+"""
+import sys, time, argparse
+
+import numpy as np
+import osmnx as ox
+from shapely.geometry import Point, box
+from shapely.ops import unary_union
+
+from prow.utils.partition import quadtree_partition
+from prow.utils.spatial_index import GridBucketIndex
+from prow.utils.utils import metres_to_dist, SPLIT_POLYGON_BOX_LENGTH
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--town", type=int, default=2000000, help="number of points in town")
+    parser.add_argument("--rural", type=int, default=200000, help="number of points spread over region")
+    parser.add_argument("--max-points", type=int, default=200000, help="quadtree max points per subregion")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centre = (52.1, -0.45)
+    region = Point(centre[1], centre[0]).buffer(0.4)
+    lats = np.concatenate([rng.normal(centre[0] + 0.1, 0.02, args.town), rng.uniform(centre[0] - 0.4, centre[0] + 0.4, args.rural)])
+    lons = np.concatenate([rng.normal(centre[1] - 0.1, 0.02, args.town), rng.uniform(centre[1] - 0.4, centre[1] + 0.4, args.rural)])
+    index = GridBucketIndex(lats, lons, region.bounds)
+
+    ok = True
+    print(f"{'partition':>10} {'time (s)':>9} {'subregions':>11} {'max points':>11} {'mean points':>12} {'max/mean':>9}")
+    for name in ["grid", "quadtree"]:
+        start = time.perf_counter()
+        if name == "grid":
+            polygons = list(ox.utils_geo._quadrat_cut_geometry(region, quadrat_width=metres_to_dist(SPLIT_POLYGON_BOX_LENGTH)).geoms)
+        else:
+            polygons = quadtree_partition(region, lats, lons, max_points=args.max_points)
+        elapsed = time.perf_counter() - start
+
+        counts = np.array([len(index.query(p)) for p in polygons])
+        ok = ok and abs(unary_union(polygons).area - region.area) < 1e-9
+        print(f"{name:>10} {elapsed:>9.3f} {len(polygons):>11} {counts.max():>11} {counts.mean():>12.0f} {counts.max() / counts.mean():>9.1f}")
+
+    split = region.difference(box(centre[1] + 0.05, centre[0] - 0.5, centre[1] + 0.06, centre[0] + 0.5))
+    polygons = quadtree_partition(split, lats, lons, max_points=args.max_points)
+    single = all(p.geom_type == "Polygon" for p in polygons)
+    counts = [len(index.query(p)) for p in polygons]
+    ok = ok and single and abs(unary_union(polygons).area - split.area) < 1e-9
+    print(f"split region: {len(polygons)} subregions, all single polygons: {single}, {sum(counts)} points")
+
+    if not ok:
+        sys.exit("subregions do not cover region, or are not single polygons")
+
+if __name__ == "__main__":
+    main()
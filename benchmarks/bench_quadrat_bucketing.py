@@ -0,0 +1,68 @@
+"""
+Benchmark finding points in each quadrat of a boundary: per-quadrat points_in_polygon vs GridBucketIndex,
+as the number of quadrats grows. Also checks both against shapely for subregions with several parts or holes,
+e.g. from clipping quadrats to concave authorities or merging subregions left after pruning.
+
+Usage: python -m benchmarks.bench_quadrat_bucketing [--points 1000000] [--widths 20000 10000 5000 2500]
+"""
+import sys, time, argparse
+
+import numpy as np
+import pandas as pd
+import osmnx as ox
+import shapely
+from shapely.geometry import Polygon
+from shapely.ops import unary_union
+
+from prow.utils.utils import points_in_polygon, metres_to_dist
+from prow.utils.spatial_index import GridBucketIndex
+
+def synthetic_boundary(radius_m: float = 30000, origin=(52.1, -0.45)):
+    """Irregular polygon around origin, roughly the size of a county"""
+    rng = np.random.default_rng(0)
+    angles = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+    radii = metres_to_dist(radius_m) * (1 + 0.3 * rng.random(64))
+    return Polygon(np.stack([origin[1] + radii * np.cos(angles), origin[0] + radii * np.sin(angles)], axis=1))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, default=1000000)
+    parser.add_argument("--widths", type=float, nargs="+", default=[20000, 10000, 5000, 2500])
+    args = parser.parse_args()
+
+    boundary = synthetic_boundary()
+    west, south, east, north = boundary.bounds
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({"latitude": rng.uniform(south, north, args.points), "longitude": rng.uniform(west, east, args.points)})
+
+    print(f"{'quadrats':>9} {'polygon (s)':>12} {'bucketed (s)':>13} {'equal':>6}")
+    for width in args.widths:
+        quadrats = list(ox.utils_geo._quadrat_cut_geometry(boundary, quadrat_width=metres_to_dist(width)).geoms)
+
+        start = time.perf_counter()
+        expected = [points_in_polygon(q, df) for q in quadrats]
+        t_polygon = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = GridBucketIndex.from_df(df, bounds=boundary.bounds)
+        actual = [index.points_in_polygon(q, df) for q in quadrats]
+        t_bucketed = time.perf_counter() - start
+
+        equal = all(a["index"].equals(e["index"]) for a, e in zip(actual, expected))
+        print(f"{len(quadrats):>9} {t_polygon:>12.3f} {t_bucketed:>13.3f} {str(equal):>6}")
+
+    quadrats = list(ox.utils_geo._quadrat_cut_geometry(boundary, quadrat_width=metres_to_dist(10000)).geoms)
+    geometries = {"multipolygon": unary_union([quadrats[0], quadrats[-1]]),
+                  "holes": boundary.difference(unary_union([q.buffer(-metres_to_dist(2000)) for q in quadrats[::3]]))}
+    index = GridBucketIndex.from_df(df, bounds=boundary.bounds)
+    failures = []
+    for name, geometry in geometries.items():
+        expected = np.flatnonzero(shapely.contains_xy(geometry, df["longitude"].to_numpy(), df["latitude"].to_numpy()))
+        if not (np.array_equal(index.query(geometry), expected) and np.array_equal(points_in_polygon(geometry, df)["index"], expected)):
+            failures.append(name)
+    print(f"multipolygon and holes: {'FAIL ' + ', '.join(failures) if failures else 'equal'}")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
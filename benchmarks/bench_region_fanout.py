@@ -0,0 +1,92 @@
+"""
+Benchmark of per-authority analysis vs region-level fan-out, on a synthetic region split into vertical strips
+of authorities, each cut into square subregions. Per-authority analysis reads and interpolates public points
+for each authority's subregions separately; fan-out interpolates the region once and routes the interpolated
+points to each authority. All subregions of the middle authority are skipped, as if pruned, so that the
+region interpolated, the union of subregions left as in batch.batch_prow_analyse_regions, is a multipolygon.
+Reports timings and the agreement of output edges with activity of the other authorities, which differ slightly
+because tracks are no longer cut at subregion borders before interpolation. Fan-out only shares reading and
+interpolating public points, while matching and joining each subregion, which dominate, are the same in both,
+so total runtime doesn't drop with the number of authorities.
+
+Usage: python -m benchmarks.bench_region_fanout [--size 40] [--authorities 3] [--tracks 1000] [--csv]
+"""
+import os, io, time, argparse, tempfile, contextlib
+
+import osmnx as ox
+from shapely.geometry import box
+from shapely.ops import unary_union
+
+from prow import analysis
+from prow.utils import point_store, graph_store
+from prow.utils.utils import metres_to_dist, ADDITIONAL_EDGE_DTYPES
+from prow.utils.interpolate import batch_geo_interpolate_df
+from .synthetic import synthetic_path_graph, tracks_along_graph
+
+def authority_boundaries(G, n: int, quadrat_length: float = 2500) -> list:
+    """Split padded bounds of graph into n vertical strips, each cut into squares"""
+    west, south, east, north = ox.graph_to_gdfs(G, nodes=False).total_bounds
+    west, south, east, north = west - 0.001, south - 0.001, east + 0.001, north + 0.001
+    dx = (east - west) / n
+    strips = [box(west + k * dx, south, west + (k + 1) * dx, north) for k in range(n)]
+    return [list(ox.utils_geo._quadrat_cut_geometry(strip, quadrat_width=metres_to_dist(quadrat_length)).geoms) for strip in strips]
+
+def activity_edges(out_fn: str) -> set:
+    edges = set()
+    for g in ["P", "B"]:
+        G = graph_store.load_graph(f"{out_fn}_{g}", edge_dtypes=ADDITIONAL_EDGE_DTYPES)
+        edges |= set((min(u, v), max(u, v)) for u, v in G.edges())
+    return edges
+
+def run_quiet(f, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        f(*args, **kwargs)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=40, help="grid size of synthetic path network")
+    parser.add_argument("--authorities", type=int, default=3, help="number of authorities in region")
+    parser.add_argument("--tracks", type=int, default=1000, help="number of public tracks")
+    parser.add_argument("--csv", action="store_true", help="store public data as legacy csv instead of point store")
+    args = parser.parse_args()
+
+    G = synthetic_path_graph(args.size, args.size, drop_frac=0.3)
+    nodes, edges = ox.graph_to_gdfs(G)
+    boundaries = authority_boundaries(G, args.authorities)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        public = tracks_along_graph(G, n_tracks=args.tracks, seed=1)
+        if args.csv:
+            public.to_csv(os.path.join(tmp, "public.csv"), index=False)
+        else:
+            point_store.write_point_store([public], os.path.join(tmp, "public"))
+        row = batch_geo_interpolate_df(tracks_along_graph(G, n_tracks=args.tracks // 10, edges_per_track=10, seed=2, noise_m=0.5), dist_m=5, segmentation=False)
+        point_store.write_point_store([row], os.path.join(tmp, "row"))
+        for k, boundary in enumerate(boundaries):
+            for i, geom in enumerate(boundary):
+                graph_store.save_graph(ox.truncate.truncate_graph_polygon(G, geom).to_undirected(), os.path.join(tmp, f"graph{k}_{i}"))
+
+        skip = [list(range(len(boundary))) if k == len(boundaries) // 2 else [] for k, boundary in enumerate(boundaries)]
+        def analyse(k, public_data, out, interpolated):
+            analysis.analyse_batch(row_data=os.path.join(tmp, "row"), public_data=public_data, graph_data=os.path.join(tmp, f"graph{k}"),
+                                   graph_boundary=boundaries[k], out_fn=os.path.join(tmp, out, str(k)), skip=skip[k], interpolated=interpolated)
+
+        t_authority = sum(run_quiet(analyse, k, os.path.join(tmp, "public"), "authority", False) for k in range(len(boundaries)))
+
+        region = unary_union([geom for k, boundary in enumerate(boundaries) for i, geom in enumerate(boundary) if i not in skip[k]])
+        t_interpolate = run_quiet(analysis.interpolate_public_data, public_data=os.path.join(tmp, "public"), geometry=region, fn=os.path.join(tmp, "interpolated"))
+        t_fanout = sum(run_quiet(analyse, k, os.path.join(tmp, "interpolated"), "region", True) for k in range(len(boundaries)))
+
+        print(f"{args.authorities} authorities, {sum(len(b) for b in boundaries)} subregions ({sum(len(s) for s in skip)} skipped), {len(public)} public points, region {region.geom_type}")
+        print(f"per authority: {t_authority:.2f}s, region fan-out: {t_interpolate + t_fanout:.2f}s ({t_interpolate:.2f}s interpolating region)")
+        for k in range(len(boundaries)):
+            if len(skip[k]) == len(boundaries[k]):
+                print(f"authority {k}: all subregions skipped")
+                continue
+            a, b = activity_edges(os.path.join(tmp, "authority", str(k))), activity_edges(os.path.join(tmp, "region", str(k)))
+            print(f"authority {k}: {len(a)} vs {len(b)} edges with activity, jaccard {len(a & b) / len(a | b) if len(a | b) > 0 else 1:.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Tolerance check and benchmark of deduplicated nearest-edge matching (EdgeMatcher.query with snap) against
+exact matching, on interpolated synthetic tracks along a synthetic path network. Reports deduplication ratio,
+speed-up, fraction of identical edge assignments within THRESH_EDGE_MATCH_DIST, and the largest change in
+per-edge point and track counts. Exits with an error if assignments agree less than --tolerance.
+
+Usage: python -m benchmarks.bench_snap_matching [--snaps 0.5 1 2 4] [--tolerance 0.99]
+"""
+import sys, time, argparse
+
+import numpy as np
+import osmnx as ox
+
+from prow.utils.utils import THRESH_EDGE_MATCH_DIST, INTERPOLATION_DIST_PUBLIC_GPS, match_nearest_edges
+from prow.utils.interpolate import batch_geo_interpolate_df
+from prow.utils.edge_index import EdgeMatcher
+from .synthetic import synthetic_path_graph, tracks_along_graph
+
+def edge_counts(graph_edges, df, ne, dists):
+    matched = df.assign(ne=list(ne), dist=dists)
+    matched = matched.loc[matched["dist"] < THRESH_EDGE_MATCH_DIST]
+    return match_nearest_edges(graph_edges, matched)[["count", "tracks"]]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--snaps", type=float, nargs="+", default=[0.5, 1, 2, 4])
+    parser.add_argument("--tracks", type=int, default=2000)
+    parser.add_argument("--tolerance", type=float, default=0.99)
+    args = parser.parse_args()
+
+    G = synthetic_path_graph(15, 15)
+    graph_edges = ox.graph_to_gdfs(G, nodes=False)
+    matcher = EdgeMatcher.from_edges(graph_edges)
+    public_df = batch_geo_interpolate_df(tracks_along_graph(G, n_tracks=args.tracks), dist_m=INTERPOLATION_DIST_PUBLIC_GPS)
+    print(f"{len(public_df)} interpolated points, {len(graph_edges)} edges")
+
+    start = time.perf_counter()
+    exact_pos, exact_dists = matcher.query(public_df["longitude"], public_df["latitude"])
+    t_exact = time.perf_counter() - start
+    exact_counts = edge_counts(graph_edges, public_df, matcher.edge_index[exact_pos], exact_dists)
+
+    ok = True
+    print(f"{'snap (m)':>8} {'dedup':>7} {'speed-up':>9} {'agree':>7} {'max d count':>12} {'max d tracks':>13}")
+    for snap in args.snaps:
+        start = time.perf_counter()
+        pos, dists = matcher.query(public_df["longitude"], public_df["latitude"], snap=snap)
+        t_snap = time.perf_counter() - start
+
+        close = exact_dists < THRESH_EDGE_MATCH_DIST
+        agree = np.mean(pos[close] == exact_pos[close])
+        counts = edge_counts(graph_edges, public_df, matcher.edge_index[pos], dists)
+        diff = counts.reindex(exact_counts.index.union(counts.index), fill_value=0) - exact_counts.reindex(exact_counts.index.union(counts.index), fill_value=0)
+        print(f"{snap:>8} {matcher.last_dedup_ratio:>7.2f} {t_exact / t_snap:>9.2f} {agree:>7.4f} {diff['count'].abs().max():>12} {diff['tracks'].abs().max():>13}")
+        ok = ok and agree >= args.tolerance
+
+    if not ok:
+        sys.exit(f"Edge assignments agree less than tolerance {args.tolerance}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Equivalence check and benchmark of graph-based filter_large_subgraphs vs array-based large_subgraphs_mask,
+on random edge subsets of synthetic path networks of growing size. Edges are compared as undirected
+(u, v, key) sets since filter_large_subgraphs may return edges reoriented. Each subset is also filtered with
+a threshold no subgraph exceeds, to check the fallback of keeping the subgraph of the first node.
+
+Usage: python -m benchmarks.bench_subgraph_filter [--sizes 20 50 100] [--keep 0.3]
+"""
+import sys, time, argparse
+
+import numpy as np
+import osmnx as ox
+
+from prow.utils.utils import filter_large_subgraphs, large_subgraphs_mask
+from .synthetic import synthetic_path_graph
+
+def undirected_edges(edges) -> set:
+    return set((min(u, v), max(u, v), k) for u, v, k in edges.index)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 50, 100])
+    parser.add_argument("--keep", type=float, default=0.3, help="fraction of edges in random subset")
+    args = parser.parse_args()
+
+    ok = True
+    print(f"{'edges':>8} {'graph (s)':>10} {'mask (s)':>9} {'equal':>6}")
+    for size in args.sizes:
+        nodes, edges = ox.graph_to_gdfs(synthetic_path_graph(size, size))
+        edges = edges.loc[np.random.default_rng(size).random(len(edges)) < args.keep]
+
+        start = time.perf_counter()
+        expected = filter_large_subgraphs(nodes, edges)
+        t_graph = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = edges.loc[large_subgraphs_mask(edges)]
+        t_mask = time.perf_counter() - start
+
+        equal = undirected_edges(actual) == undirected_edges(expected)
+        fallback = undirected_edges(edges.loc[large_subgraphs_mask(edges, thresh=np.inf)]) == \
+                   undirected_edges(filter_large_subgraphs(nodes, edges, thresh=np.inf))
+        equal = equal and fallback
+        ok = ok and equal
+        print(f"{len(edges):>8} {t_graph:>10.3f} {t_mask:>9.4f} {str(equal):>6}")
+
+    if not ok:
+        sys.exit("large_subgraphs_mask differs from filter_large_subgraphs")
+
+if __name__ == "__main__":
+    main()
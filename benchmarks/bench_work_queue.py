@@ -0,0 +1,106 @@
+"""
+Check and benchmark of the file-lease work queue, on a synthetic region split into vertical strips of
+authorities, each cut into square subregions. Each (authority, subregion) is a task writing its parts of the
+authority's outputs, and a reducer task per authority finalises its outputs once all its subregions are done.
+Worker processes share the queue in a temporary folder, and one of them crashes while holding a lease, so its
+task must be claimed again once the lease expires. Checks that every task is done once, that reducers ran after
+all their subregions, and that outputs agree with analysing each authority in one process. Exits with status 1
+if any check fails.
+
+Usage: python -m benchmarks.bench_work_queue [--size 40] [--authorities 3] [--tracks 1000] [--workers 4] [--lease-timeout 3]
+"""
+import os, sys, time, argparse, tempfile, multiprocessing
+
+from prow import analysis
+from prow.utils import point_store
+from prow.utils.work_queue import WorkQueue, run_worker
+from prow.utils.interpolate import batch_geo_interpolate_df
+from .synthetic import synthetic_path_graph, tracks_along_graph
+from .bench_region_fanout import authority_boundaries, activity_edges, run_quiet
+from .bench_national_tiles import build_graphs
+
+def analyse(tmp: str, boundaries: list, k: int, out: str, quadrat: int = None) -> None:
+    """Analyse authority k, or only write the parts of one of its subregions"""
+    graph_boundary = dict(enumerate(boundaries[k])) if quadrat is None else {quadrat: boundaries[k][quadrat]}
+    run_quiet(analysis.analyse_batch, row_data=os.path.join(tmp, "row"), public_data=os.path.join(tmp, "public"), graph_data=os.path.join(tmp, f"graph{k}"),
+              graph_boundary=graph_boundary, out_fn=os.path.join(tmp, out, str(k)), finalise=quadrat is None)
+
+def worker(tmp: str, boundaries: list, lease_timeout: float, crash: bool) -> None:
+    """Run worker on queue, exiting abruptly without releasing its lease on its first subregion task if crash"""
+    def handler(lease):
+        p = lease.payload
+        if crash and p["stage"] == "quadrat":
+            os._exit(1)
+        analyse(tmp, boundaries, p["authority"], "queue", quadrat=p.get("quadrat"))
+        return {"end": time.time()}
+
+    queue = WorkQueue(os.path.join(tmp, "queue_tasks"), lease_timeout=lease_timeout)
+    run_worker(queue, handler, heartbeat_interval=lease_timeout / 3, poll_interval=lease_timeout / 10)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=40, help="grid size of synthetic path network")
+    parser.add_argument("--authorities", type=int, default=3, help="number of authorities in region")
+    parser.add_argument("--tracks", type=int, default=1000, help="number of public tracks")
+    parser.add_argument("--workers", type=int, default=4, help="number of worker processes, one of which crashes")
+    parser.add_argument("--lease-timeout", type=float, default=3, help="seconds without heartbeat after which a lease expires")
+    args = parser.parse_args()
+
+    G = synthetic_path_graph(args.size, args.size, drop_frac=0.3)
+    boundaries = authority_boundaries(G, args.authorities)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        point_store.write_point_store([tracks_along_graph(G, n_tracks=args.tracks, seed=1)], os.path.join(tmp, "public"))
+        row = batch_geo_interpolate_df(tracks_along_graph(G, n_tracks=args.tracks // 10, edges_per_track=10, seed=2, noise_m=0.5), dist_m=5, segmentation=False)
+        point_store.write_point_store([row], os.path.join(tmp, "row"))
+        for k, boundary in enumerate(boundaries):
+            build_graphs(G, boundary, os.path.join(tmp, f"graph{k}"))
+
+        start = time.perf_counter()
+        for k in range(len(boundaries)):
+            analyse(tmp, boundaries, k, "single")
+        t_single = time.perf_counter() - start
+
+        queue = WorkQueue(os.path.join(tmp, "queue_tasks"), lease_timeout=args.lease_timeout)
+        for k, boundary in enumerate(boundaries):
+            quadrats = [f"quadrat_{k}_{i}" for i in range(len(boundary))]
+            for i, task_id in enumerate(quadrats):
+                queue.add(task_id, {"stage": "quadrat", "authority": k, "quadrat": i})
+            queue.add(f"reduce_{k}", {"stage": "reduce", "authority": k}, after=quadrats)
+
+        start = time.perf_counter()
+        processes = [multiprocessing.Process(target=worker, args=(tmp, boundaries, args.lease_timeout, w == 0)) for w in range(args.workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        t_queue = time.perf_counter() - start
+
+        failures = []
+        if len(queue.pending()) > 0:
+            failures.append(f"tasks not done: {queue.pending()}")
+        if processes[0].exitcode != 1 or any(process.exitcode != 0 for process in processes[1:]):
+            failures.append(f"unexpected worker exit codes {[process.exitcode for process in processes]}")
+        crashed = [t for t in queue.task_ids() if queue.generation(t) > 0]
+        if len(crashed) != 1:
+            failures.append(f"expected 1 task claimed again after crash, got {crashed}")
+        for k in range(len(boundaries)):
+            if not queue.is_done(f"reduce_{k}"):
+                continue
+            reduce_end = queue.result(f"reduce_{k}")["time"]
+            if any(queue.result(f"quadrat_{k}_{i}")["time"] > reduce_end for i in range(len(boundaries[k]))):
+                failures.append(f"reducer of authority {k} done before its subregions")
+            a, b = activity_edges(os.path.join(tmp, "single", str(k))), activity_edges(os.path.join(tmp, "queue", str(k)))
+            if a != b:
+                failures.append(f"authority {k}: {len(a)} vs {len(b)} edges with activity, jaccard {len(a & b) / max(len(a | b), 1):.3f}")
+
+        print(f"{args.authorities} authorities, {len(queue.task_ids())} tasks, {args.workers} workers, crashed task {crashed}")
+        print(f"single process: {t_single:.2f}s, work queue: {t_queue:.2f}s (including {args.lease_timeout:.0f}s lease timeout)")
+        for failure in failures:
+            print(f"FAIL {failure}")
+        if len(failures) > 0:
+            sys.exit(1)
+        print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Benchmark suite timing every stage of the pipeline on synthetic data, sweeping graph sizes and numbers of
+public tracks. Public tracks follow the synthetic path network with noise, gaps that split tracks and
+off-network points. Runs offline. Results are saved as JSON, and can be compared with a baseline saved at
+another commit, reporting the ratio of times of each stage and flagging regressions.
+
+Usage:
+    python -m benchmarks.run_suite [--sizes 10 20 40] [--tracks 50 200 800] [--repeat 3] [--out results.json]
+    python -m benchmarks.run_suite --baseline baseline.json [--threshold 1.25] [--fail-on-regression]
+    python -m benchmarks.run_suite --compare results.json baseline.json
+"""
+import os, sys, json, time, argparse, platform, tempfile, subprocess
+
+import osmnx as ox
+from shapely.geometry import box
+
+from prow.analysis import match_public_data_with_edges, match_row_data_with_edges, join_public_row_edges, save_undirected_graph
+from prow.utils.utils import points_in_polygon, filter_large_subgraphs, INTERPOLATION_DIST_PUBLIC_GPS, SNAP_DIST_NEAREST_EDGE
+from prow.utils.interpolate import batch_geo_interpolate_df
+from prow.utils.gpx_converter import Converter
+from prow.utils.edge_index import EdgeMatcher
+from prow.utils.custom_plot_graph_folium import plot_graph_folium
+from .synthetic import synthetic_path_graph, tracks_along_graph, write_tracks_gpx
+
+SUITE_VERSION = 1 # bump when cases change, so that results aren't compared with baselines of other cases
+
+def best_time(f, repeat: int) -> tuple:
+    """Return min wall time of repeated calls of f, and result of last call"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = f()
+        times.append(time.perf_counter() - start)
+    return min(times), out
+
+def run_case(size: int, n_tracks: int, repeat: int, folder: str) -> list:
+    """Time each stage on one synthetic graph and set of tracks, feeding each stage the outputs of the last
+
+    Args:
+        size (int): grid size of synthetic path network
+        n_tracks (int): number of public tracks
+        repeat (int): number of runs of each stage, of which the fastest is recorded
+        folder (str): folder for files written by stages
+
+    Returns:
+        list: dicts of stage, size, tracks, number of items in, and seconds
+    """
+    G = synthetic_path_graph(size, size, drop_frac=0.3)
+    nodes, edges = ox.graph_to_gdfs(G)
+    public = tracks_along_graph(G, n_tracks=n_tracks, seed=1, gap_frac=0.05, off_network_frac=0.02)
+    row = batch_geo_interpolate_df(tracks_along_graph(G, n_tracks=max(n_tracks // 10, 1), edges_per_track=10, seed=2, noise_m=0.5), dist_m=5, segmentation=False)
+    gpx_fn = os.path.join(folder, f"public_{size}_{n_tracks}.gpx")
+    write_tracks_gpx(public, gpx_fn)
+    west, south, east, north = edges.total_bounds
+    geometry = box(west, south, (west + east) / 2, (south + north) / 2)
+    matcher = EdgeMatcher.from_edges(edges)
+
+    results = []
+    def time_stage(stage: str, n_items: int, f):
+        seconds, out = best_time(f, repeat)
+        results.append({"stage": stage, "size": size, "tracks": n_tracks, "items": int(n_items), "seconds": seconds})
+        return out
+
+    time_stage("gpx_to_dataframe", len(public), lambda: Converter(gpx_fn).gpx_to_dataframe())
+    time_stage("gpx_to_dataframe_stream", len(public), lambda: Converter(gpx_fn).gpx_to_dataframe(engine="stream"))
+    time_stage("points_in_polygon", len(public), lambda: points_in_polygon(geometry, public))
+    interpolated = time_stage("batch_geo_interpolate_df", len(public), lambda: batch_geo_interpolate_df(public, dist_m=INTERPOLATION_DIST_PUBLIC_GPS, segmentation=True))
+    public_edges = time_stage("match_public_data_with_edges", len(interpolated),
+                              lambda: match_public_data_with_edges(interpolated, edges, nodes, G, matcher=matcher, snap=SNAP_DIST_NEAREST_EDGE))
+    row_edges = time_stage("match_row_data_with_edges", len(row), lambda: match_row_data_with_edges(row, edges, nodes, G, matcher=matcher))
+    joined = time_stage("join_public_row_edges", len(public_edges) + len(row_edges),
+                        lambda: join_public_row_edges(public_edges, row_edges, edge_dtypes=edges.dtypes.to_dict()))
+    time_stage("filter_large_subgraphs", len(public_edges), lambda: filter_large_subgraphs(nodes, public_edges))
+    time_stage("save_undirected_graph", len(joined), lambda: save_undirected_graph(nodes, joined, os.path.join(folder, f"joined_{size}_{n_tracks}")))
+    output = save_undirected_graph(nodes, joined, "", ret=True, save=False)
+    time_stage("plot_graph_folium", len(joined), lambda: plot_graph_folium(output, tiles="OpenStreetMap", activity_attribute="activity"))
+    return results
+
+def git_commit() -> str:
+    """Return current commit of repo, or None if not in a git repo"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(sizes: list, tracks: list, repeat: int = 3) -> dict:
+    """Run all stages for every graph size and number of tracks
+
+    Returns:
+        dict: "meta" with suite version, commit, platform and parameters, and "results" from run_case
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            for n_tracks in tracks:
+                print(f"Graph size {size}, {n_tracks} tracks")
+                results += run_case(size, n_tracks, repeat, folder)
+    meta = {"version": SUITE_VERSION, "commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(), "machine": platform.machine(), "sizes": sizes, "tracks": tracks, "repeat": repeat}
+    return {"meta": meta, "results": results}
+
+def compare(current: dict, baseline: dict, threshold: float = 1.25, min_seconds: float = 0.01) -> list:
+    """Print times of current results relative to baseline, for cases in both
+
+    Args:
+        current (dict): results from run_suite
+        baseline (dict): results from run_suite, e.g. at an earlier commit
+        threshold (float, optional): ratio of current to baseline time above which a stage is flagged as a regression.
+            Defaults to 1.25.
+        min_seconds (float, optional): baseline time below which stages aren't flagged, as timer noise dominates. Defaults to 0.01.
+
+    Returns:
+        list: (stage, size, tracks) of regressions
+    """
+    if current["meta"]["version"] != baseline["meta"]["version"]:
+        print(f"Warning: comparing suite version {current['meta']['version']} with baseline version {baseline['meta']['version']}")
+    base = {(r["stage"], r["size"], r["tracks"]): r for r in baseline["results"]}
+    print(f"Current {current['meta']['commit']} vs baseline {baseline['meta']['commit']}")
+    print(f"{'stage':>30} {'size':>5} {'tracks':>7} {'base (s)':>9} {'now (s)':>9} {'ratio':>6}")
+    regressions = []
+    for r in current["results"]:
+        key = (r["stage"], r["size"], r["tracks"])
+        if key not in base:
+            continue
+        ratio = r["seconds"] / max(base[key]["seconds"], 1e-9)
+        flag = ""
+        if base[key]["seconds"] < min_seconds:
+            pass
+        elif ratio > threshold:
+            regressions.append(key)
+            flag = " SLOWER"
+        elif ratio < 1 / threshold:
+            flag = " faster"
+        print(f"{r['stage']:>30} {r['size']:>5} {r['tracks']:>7} {base[key]['seconds']:>9.4f} {r['seconds']:>9.4f} {ratio:>6.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 20, 40], help="grid sizes of synthetic path networks")
+    parser.add_argument("--tracks", type=int, nargs="+", default=[50, 200, 800], help="numbers of public tracks")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each stage, of which the fastest is recorded")
+    parser.add_argument("--out", default="benchmark_results.json", help="filename to save results to")
+    parser.add_argument("--baseline", help="results of earlier run to compare with")
+    parser.add_argument("--compare", nargs=2, metavar=("RESULTS", "BASELINE"), help="compare saved results without running")
+    parser.add_argument("--threshold", type=float, default=1.25, help="ratio of times flagged as regression")
+    parser.add_argument("--min-seconds", type=float, default=0.01, help="baseline time below which stages aren't flagged")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if any stage regressed")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        current, baseline = [json.load(open(fn)) for fn in args.compare]
+    else:
+        current = run_suite(args.sizes, args.tracks, repeat=args.repeat)
+        with open(args.out + ".tmp", "w") as f:
+            json.dump(current, f, indent=1)
+        os.replace(args.out + ".tmp", args.out)
+        print(f"Results saved to {args.out}")
+        if args.baseline is None:
+            for r in current["results"]:
+                print(f"{r['stage']:>30} {r['size']:>5} {r['tracks']:>7} {r['items']:>9} {r['seconds']:>9.4f}s")
+            return
+        baseline = json.load(open(args.baseline))
+
+    regressions = compare(current, baseline, threshold=args.threshold, min_seconds=args.min_seconds)
+    print(f"{len(regressions)} regressions above {args.threshold:.2f}x")
+    if args.fail_on_regression and len(regressions) > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
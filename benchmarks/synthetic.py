@@ -0,0 +1,213 @@
+"""
+Generators of synthetic datasets for benchmarking
+"""
+import numpy as np
+
+GPX_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1" creator="prow-benchmarks" xmlns="http://www.topografix.com/GPX/1/1">\n'
+GPX_FOOTER = '</gpx>\n'
+
+def random_walk_tracks(n_tracks: int, points_per_track: int, origin=(52.1, -0.45), step_m: float = 5, seed: int = 0) -> list:
+    """Generate random-walk GPS tracks around an origin.
+
+    Args:
+        n_tracks (int): number of tracks
+        points_per_track (int): number of points in each track
+        origin (tuple, optional): (latitude, longitude) around which tracks start. Defaults to Bedford.
+        step_m (float, optional): mean distance between consecutive points in metres. Defaults to 5.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        list: list of (latitudes, longitudes) arrays, one per track
+    """
+    rng = np.random.default_rng(seed)
+    step = step_m / 111194.92664455873
+    tracks = []
+    for _ in range(n_tracks):
+        start = np.array(origin) + rng.normal(scale=0.05, size=2)
+        heading = np.cumsum(rng.normal(scale=0.3, size=points_per_track))
+        steps = np.stack([np.cos(heading), np.sin(heading)], axis=1) * step
+        coords = start + np.cumsum(steps, axis=0)
+        tracks.append((coords[:, 0], coords[:, 1]))
+    return tracks
+
+def write_synthetic_gpx(fn: str, n_tracks: int = 10, points_per_track: int = 1000, seed: int = 0) -> int:
+    """Write GPX file of random-walk tracks with timestamps and elevations, one segment per track.
+
+    Args:
+        fn (str): output filename
+        n_tracks (int, optional): number of tracks. Defaults to 10.
+        points_per_track (int, optional): number of points in each track. Defaults to 1000.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        int: total number of points written
+    """
+    start_time = np.datetime64("2013-04-09T00:00:00")
+    with open(fn, "w") as f:
+        f.write(GPX_HEADER)
+        for lats, lons in random_walk_tracks(n_tracks, points_per_track, seed=seed):
+            times = start_time + np.arange(len(lats)).astype("timedelta64[s]")
+            f.write("<trk><trkseg>\n")
+            f.writelines(f'<trkpt lat="{lat:.7f}" lon="{lon:.7f}"><ele>{10 + n % 50:.1f}</ele><time>{t}Z</time></trkpt>\n'
+                         for n, (lat, lon, t) in enumerate(zip(lats, lons, times)))
+            f.write("</trkseg></trk>\n")
+        f.write(GPX_FOOTER)
+    return n_tracks * points_per_track
+
+def synthetic_path_graph(n_rows: int = 20, n_cols: int = 20, spacing_m: float = 200, origin=(52.1, -0.45), drop_frac: float = 0.2, seed: int = 0):
+    """Generate OSM-like undirected path network: a jittered lattice of nodes with some edges removed,
+    in the same format as graphs from ox.graph_from_polygon(...).to_undirected().
+
+    Args:
+        n_rows (int, optional): number of node rows. Defaults to 20.
+        n_cols (int, optional): number of node columns. Defaults to 20.
+        spacing_m (float, optional): distance between lattice nodes in metres. Defaults to 200.
+        origin (tuple, optional): (latitude, longitude) of south-west corner. Defaults to Bedford.
+        drop_frac (float, optional): fraction of lattice edges removed. Defaults to 0.2.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        nx.MultiGraph: graph with node x/y and edge geometry/length/osmid/highway attributes
+    """
+    import networkx as nx
+    from shapely.geometry import LineString
+
+    rng = np.random.default_rng(seed)
+    step = spacing_m / 111194.92664455873
+    G = nx.MultiGraph(crs="epsg:4326")
+    jitter = rng.normal(scale=step / 10, size=(n_rows, n_cols, 2))
+    for r in range(n_rows):
+        for c in range(n_cols):
+            G.add_node(r * n_cols + c + 1, y=origin[0] + r * step + jitter[r, c, 0], x=origin[1] + c * step / np.cos(np.deg2rad(origin[0])) + jitter[r, c, 1], street_count=0)
+
+    highways = ["footway", "cycleway", "bridleway", "path", "track"]
+    for r in range(n_rows):
+        for c in range(n_cols):
+            for dr, dc in [(0, 1), (1, 0)]:
+                if r + dr >= n_rows or c + dc >= n_cols or rng.random() < drop_frac:
+                    continue
+                u, v = r * n_cols + c + 1, (r + dr) * n_cols + c + dc + 1
+                geom = LineString([(G.nodes[u]["x"], G.nodes[u]["y"]), (G.nodes[v]["x"], G.nodes[v]["y"])])
+                G.add_edge(u, v, osmid=int(rng.integers(1e6, 1e7)), highway=highways[rng.integers(len(highways))],
+                           length=geom.length * 111194.92664455873, geometry=geom)
+    return G
+
+def tracks_along_graph(G, n_tracks: int = 100, edges_per_track: int = 20, point_spacing_m: float = 10, noise_m: float = 3, seed: int = 0,
+                       gap_frac: float = 0, off_network_frac: float = 0, off_network_m: tuple = (30, 150)):
+    """Generate GPS tracks which follow random walks along graph edges, with gaussian noise. Optionally, tracks
+    have gaps where the signal is lost and picks up again at another node, so that consecutive points are far
+    apart and split_dirty_track splits the track, and some points are thrown off the network.
+
+    Args:
+        G (nx.MultiGraph): graph from synthetic_path_graph
+        n_tracks (int, optional): number of tracks. Defaults to 100.
+        edges_per_track (int, optional): number of edges walked per track. Defaults to 20.
+        point_spacing_m (float, optional): distance between consecutive points in metres. Defaults to 10.
+        noise_m (float, optional): standard deviation of position noise in metres. Defaults to 3.
+        seed (int, optional): random seed. Defaults to 0.
+        gap_frac (float, optional): probability of a gap after each edge walked. Defaults to 0.
+        off_network_frac (float, optional): fraction of points moved off the network. Defaults to 0.
+        off_network_m (tuple, optional): (min, max) distance in metres that off-network points are moved. Defaults to (30, 150).
+
+    Returns:
+        pd.DataFrame: points with latitude, longitude and trackid columns
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    deg = 1 / 111194.92664455873
+    nodes = [n for n in G.nodes if G.degree(n) > 0]
+    frames = []
+    for t in range(n_tracks):
+        node = nodes[rng.integers(len(nodes))]
+        coords = []
+        for _ in range(edges_per_track):
+            u, v, data = list(G.edges(node, data=True))[rng.integers(G.degree(node))]
+            geom = data["geometry"]
+            n_points = max(int(data["length"] / point_spacing_m), 1)
+            fracs = np.linspace(0, 1, n_points, endpoint=False)
+            if (geom.coords[0][0], geom.coords[0][1]) != (G.nodes[node]["x"], G.nodes[node]["y"]):
+                fracs = 1 - fracs
+            coords += [geom.interpolate(f, normalized=True).coords[0] for f in fracs]
+            node = v if u == node else u
+            if gap_frac > 0 and rng.random() < gap_frac:
+                node = nodes[rng.integers(len(nodes))]
+        coords = np.array(coords) + rng.normal(scale=noise_m * deg, size=(len(coords), 2))
+        if off_network_frac > 0:
+            off = rng.random(len(coords)) < off_network_frac
+            angle, dist = rng.uniform(0, 2 * np.pi, off.sum()), rng.uniform(*off_network_m, off.sum()) * deg
+            coords[off] += np.column_stack([np.cos(angle) * dist, np.sin(angle) * dist])
+        frames.append(pd.DataFrame({"latitude": coords[:, 1], "longitude": coords[:, 0], "trackid": t}))
+    return pd.concat(frames, ignore_index=True)
+
+def write_tracks_gpx(df, fn: str) -> int:
+    """Write GPX file of tracks in dataframe from tracks_along_graph, with timestamps, one segment per track.
+
+    Args:
+        df (pd.DataFrame): points with latitude, longitude and trackid columns
+        fn (str): output filename
+
+    Returns:
+        int: total number of points written
+    """
+    start_time = np.datetime64("2013-04-09T00:00:00")
+    with open(fn, "w") as f:
+        f.write(GPX_HEADER)
+        for _, track in df.groupby("trackid", sort=False):
+            times = start_time + np.arange(len(track)).astype("timedelta64[s]")
+            f.write("<trk><trkseg>\n")
+            f.writelines(f'<trkpt lat="{lat:.7f}" lon="{lon:.7f}"><time>{t}Z</time></trkpt>\n'
+                         for lat, lon, t in zip(track["latitude"], track["longitude"], times))
+            f.write("</trkseg></trk>\n")
+        f.write(GPX_FOOTER)
+    return len(df)
+
+OSM_HIGHWAYS = ["footway", "cycleway", "bridleway", "path", "track", "residential", "primary", "service"]
+
+def write_synthetic_osm(fn: str, n_rows: int = 12, n_cols: int = 12, spacing_m: float = 100, origin=(52.1, -0.45), seed: int = 0) -> tuple:
+    """Write OSM XML extract of a jittered grid of nodes joined by ways along rows and columns. Each row and
+    column is split into ways of random length, with random highway tags, so that some are roads which should
+    be filtered out of path networks. Some ways are oneway and some nodes are tagged.
+
+    Args:
+        fn (str): output filename
+        n_rows (int, optional): number of rows of nodes. Defaults to 12.
+        n_cols (int, optional): number of columns of nodes. Defaults to 12.
+        spacing_m (float, optional): distance between adjacent nodes in metres. Defaults to 100.
+        origin (tuple, optional): (latitude, longitude) of south-west node. Defaults to Bedford.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        tuple: (number of nodes, number of ways) written
+    """
+    rng = np.random.default_rng(seed)
+    spacing = spacing_m / 111194.92664455873
+    lat = origin[0] + (np.arange(n_rows)[:, None] + rng.uniform(-0.2, 0.2, (n_rows, n_cols))) * spacing
+    lon = origin[1] + (np.arange(n_cols)[None, :] + rng.uniform(-0.2, 0.2, (n_rows, n_cols))) * spacing / np.cos(np.deg2rad(origin[0]))
+    node_id = 1000 + np.arange(n_rows * n_cols).reshape(n_rows, n_cols)
+
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="prow-benchmarks">\n']
+    for n, y, x in zip(node_id.ravel(), lat.ravel(), lon.ravel()):
+        if rng.random() < 0.1:
+            lines.append(f'  <node id="{n}" lat="{y:.7f}" lon="{x:.7f}">\n    <tag k="barrier" v="gate"/>\n  </node>\n')
+        else:
+            lines.append(f'  <node id="{n}" lat="{y:.7f}" lon="{x:.7f}"/>\n')
+
+    way_id, n_ways = 1, 0
+    for line in [node_id[r, :] for r in range(n_rows)] + [node_id[:, c] for c in range(n_cols)]:
+        start = 0
+        while start < len(line) - 1:
+            end = min(start + int(rng.integers(2, 6)), len(line) - 1)
+            refs = "".join(f'    <nd ref="{n}"/>\n' for n in line[start:end + 1])
+            tags = f'    <tag k="highway" v="{rng.choice(OSM_HIGHWAYS)}"/>\n'
+            if rng.random() < 0.5:
+                tags += f'    <tag k="name" v="Way {way_id}"/>\n'
+            if rng.random() < 0.1:
+                tags += '    <tag k="oneway" v="yes"/>\n'
+            lines.append(f'  <way id="{way_id}">\n{refs}{tags}  </way>\n')
+            way_id, n_ways, start = way_id + 1, n_ways + 1, end
+    lines.append('</osm>\n')
+
+    with open(fn, "w") as f:
+        f.writelines(lines)
+    return n_rows * n_cols, n_ways
@@ -1,12 +1,15 @@
 """
 Module for performing PRoW vs public GPX data analysis.
 """
+import time
 
 from . import download_data, analysis
 from .vis import compose_graphs_plot_folium
 from .utils.authority_names import reverse_search
+from .utils import instrument
+from .batch import batch_prow_analyse_regions, batch_prow_analyse_national, batch_prow_analyse_queue
 
-def batch_prow_analyse_authorities(authorities: list, fn_data_prefix="data", fn_out_prefix="output") -> None:
+def batch_prow_analyse_authorities(authorities: list, fn_data_prefix="data", fn_out_prefix="output", workers: int = 1, osm_extract: str = None, partition: str = "grid", memory_mb: float = None) -> None:
     """Run full analysis pipeline of PRoW vs public GPX data, for given batch of authorities. For each authority,
     output 3 undiredcted networkx.MultiGraph graphs containing paths as edges and intersections as nodes.
     Eacb graph consists of...
@@ -21,6 +24,17 @@ def batch_prow_analyse_authorities(authorities: list, fn_data_prefix="data", fn_
             [here](http://zverik.openstreetmap.ru/gps/files/extracts/europe/great_britain).
         fn_data_prefix (str, optional): Folder for saving downloaded data to. Defaults to "data".
         fn_out_prefix (str, optional): Folder for saving output graphs. Defaults to "output".
+        workers (int, optional): Number of worker processes for parallel stages. Defaults to 1.
+        osm_extract (str, optional): Local .osm.pbf or .osm extract to build graphs from instead of Overpass. Defaults to None.
+        partition (str, optional): "grid" or "quadtree" partitioning of authorities into subregions, 
+            see download_data.get_graph_boundary. Graphs are saved separately for each. Defaults to "grid".
+        memory_mb (float, optional): Memory budget in MB for GPS points held at once during ingestion and analysis.
+            Subregions are analysed reading only their own points if those of a whole authority don't fit. Defaults to None.
+
+    See batch.batch_prow_analyse_regions to interpolate public data once for all authorities in a region,
+    batch.batch_prow_analyse_national to analyse areas shared by neighbouring authorities once, and
+    batch.batch_prow_analyse_queue to share the work between several machines. To record the time, CPU time,
+    memory and item counts of each stage of each authority and subregion, see utils.instrument.enable.
     """
     
     for authority, region in authorities:
@@ -29,25 +43,35 @@ def batch_prow_analyse_authorities(authorities: list, fn_data_prefix="data", fn_
 
         fn_row    = f"{fn_data_prefix}/row/{authority_code}"
         fn_public = f"{fn_data_prefix}/public/{region}"
-        fn_graph  = f"{fn_data_prefix}/osmnx/{authority_code}"
+        fn_graph  = f"{fn_data_prefix}/osmnx/{authority_code}" + ("" if partition == "grid" else f"_{partition}")
         fn_out    = f"{fn_out_prefix}/{authority_code}"
 
         print(f"Analysis for authority '{authority}' code '{authority_code}' in region '{region}'. Output to {fn_out}")
 
-        if analysis.check_analysis_exists(fn_out):
-            continue
-
         print("1. Download RoW data")
-        download_data.download_row_data(authority_code, fn=fn_row)
+        with instrument.stage("download_row", authority=authority_code):
+            download_data.download_row_data(authority_code, fn=fn_row)
 
         print("2. Download public GPS data")
-        download_data.download_public_gps_data(region, fn=fn_public)
+        with instrument.stage("download_public", authority=authority_code, region=region):
+            download_data.download_public_gps_data(region, fn=fn_public, workers=workers, memory_mb=memory_mb)
 
         print("3. Get graph boundaries")
-        graph_boundary = download_data.get_graph_boundary(authority)
+        with instrument.stage("graph_boundary", authority=authority_code) as counts:
+            graph_boundary = download_data.get_graph_boundary(authority, partition=partition, public_data=fn_public, osm_extract=osm_extract, fn=fn_graph)
+            counts["quadrats"] = len(graph_boundary)
+
+        print("4. Prune graph boundaries without public data")
+        with instrument.stage("prune", authority=authority_code) as counts:
+            skip = analysis.prune_quadrats(public_data=fn_public, graph_boundary=graph_boundary, fn=fn_graph, memory_mb=memory_mb)
+            counts["pruned"] = len(skip)
+        start = time.perf_counter()
 
-        print("4. Download graphs")
-        download_data.download_graphs(graph_boundary, fn=fn_graph)
+        print("5. Download graphs")
+        with instrument.stage("download_graphs", authority=authority_code):
+            download_data.download_graphs(graph_boundary, fn=fn_graph, osm_extract=osm_extract, skip=skip)
 
-        print("5. Perform analysis")
-        analysis.analyse_batch(row_data=fn_row, public_data=fn_public, graph_data=fn_graph, graph_boundary=graph_boundary, out_fn=fn_out)
\ No newline at end of file
+        print("6. Perform analysis")
+        with instrument.stage("analysis", authority=authority_code):
+            analysis.analyse_batch(row_data=fn_row, public_data=fn_public, graph_data=fn_graph, graph_boundary=graph_boundary, out_fn=fn_out, workers=workers, skip=skip, memory_mb=memory_mb)
+        analysis.report_pruning(len(skip), len(graph_boundary), time.perf_counter() - start)
\ No newline at end of file
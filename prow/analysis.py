@@ -1,16 +1,26 @@
 """
 Module for performing map-matching, joining and cleaning of geospatial datasets
 """
-import os
+import os, shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+import numpy as np
 import pandas as pd
+import shapely
 import geopandas as gpd
 import osmnx as ox
 import networkx as nx
 from tqdm import tqdm
+from shapely.ops import unary_union
 
 from .utils.utils import *
 from .utils.interpolate import batch_geo_interpolate_df
+from .utils import point_store
+from .utils.spatial_index import GridBucketIndex
+from .utils.edge_index import EdgeMatcher
+from .utils.ledger import ActivityLedger
+from .utils.graph_store import graph_exists, save_graph, load_graph, GraphOutputWriter, GRAPH_STORE_EXT
+from .utils import cache, instrument
 
 def check_analysis_exists(fn: str) -> bool:
     """Return whether analysis exists for given output folder prefix + authority code
@@ -21,15 +31,16 @@ def check_analysis_exists(fn: str) -> bool:
     Returns:
         bool: whether all 3 output graphs exist
     """
-    return os.path.isfile(f"{fn}_P.graphml") and os.path.isfile(f"{fn}_B.graphml") and os.path.isfile(f"{fn}_R.graphml")
+    return graph_exists(f"{fn}_P") and graph_exists(f"{fn}_B") and graph_exists(f"{fn}_R")
                                                             
 def save_undirected_graph(nodes: gpd.GeoDataFrame, edges: gpd.GeoDataFrame, fn: str, ret=False, save=True):
-    """Save undirected graph from geodataframes of nodes and edges
+    """Save undirected graph from geodataframes of nodes and edges, with graph_store.save_graph. Graph is 
+    written to a temporary file and renamed, so that the graph at fn is always complete.
 
     Args:
         nodes (gpd.GeoDataFrame): GeoDataFrame of graph nodes
         edges (gpd.GeoDataFrame): GeoDataFrame of graph edges
-        fn (str): filename to save graph
+        fn (str): filename prefix to save graph, without extension
         ret (bool, optional): whether to return graph. Defaults to False.
         save (bool, optional): whether to save graph. Defaults to True.
 
@@ -38,10 +49,34 @@ def save_undirected_graph(nodes: gpd.GeoDataFrame, edges: gpd.GeoDataFrame, fn:
         else: None
     """
     G = ox.graph_from_gdfs(nodes, edges).to_undirected()
-    if save: ox.save_graphml(G, fn)
+    if save: save_graph(G, fn)
     if ret: return G
 
-def match_public_data_with_edges(public_df: pd.DataFrame, graph_edges: gpd.GeoDataFrame, graph_nodes: gpd.GeoDataFrame, G: nx.MultiGraph) -> gpd.GeoDataFrame:
+def nearest_edge_positions(df: pd.DataFrame, graph_edges: gpd.GeoDataFrame, G: nx.MultiGraph, matcher: EdgeMatcher = None, snap: float = None) -> tuple:
+    """Find nearest graph edge of each point, as position in graph_edges, and distance to it in metres.
+
+    Args:
+        df (pd.DataFrame): df of points with latitude and longitude columns
+        graph_edges (gpd.GeoDataFrame): gdf of graph edges of base OSM path network graph
+        G (nx.MultiGraph): graph composed of graph_edges, used if matcher is None
+        matcher (EdgeMatcher, optional): prebuilt nearest-edge index of graph_edges. If None, use ox.nearest_edges.
+            Defaults to None.
+        snap (float, optional): grid size in metres to deduplicate points before nearest-edge search with matcher.
+            If None, search every point. Defaults to None.
+
+    Returns:
+        tuple: (positions of nearest edges in graph_edges, distances)
+    """
+    if matcher is None:
+        ne, dists = ox.nearest_edges(G, df["longitude"], df["latitude"], return_dist=True, interpolate=metres_to_dist(INTERPOLATION_DIST_NEAREST_EDGE))
+        return graph_edges.index.get_indexer(pd.MultiIndex.from_tuples(ne)), np.asarray(dists)
+
+    pos, dists = matcher.query(df["longitude"], df["latitude"], snap=snap)
+    if snap is not None:
+        print(f"Deduplicated nearest-edge queries by {matcher.last_dedup_ratio:.1f}x")
+    return pos, dists
+
+def match_public_data_with_edges(public_df: pd.DataFrame, graph_edges: gpd.GeoDataFrame, graph_nodes: gpd.GeoDataFrame, G: nx.MultiGraph, matcher: EdgeMatcher = None, snap: float = None, nearest: tuple = None) -> gpd.GeoDataFrame:
     """Perform map-matching of public GPS data points with base graph edges. 
     Additionally threshold distance between GPS points to edges, assign activity attribute,
     and remove small graphs (noise).
@@ -51,26 +86,46 @@ def match_public_data_with_edges(public_df: pd.DataFrame, graph_edges: gpd.GeoDa
         graph_edges (gpd.GeoDataFrame): gdf of graph edges of base OSM path network graph
         graph_nodes (gpd.GeoDataFrame): gdf of graph nodes of base OSM path network graph
         G (nx.MultiGraph): graph composed of graph_edges and graph_nodes to save computation of conversion
+        matcher (EdgeMatcher, optional): prebuilt nearest-edge index of graph_edges. If None, use ox.nearest_edges.
+            Defaults to None.
+        snap (float, optional): grid size in metres to deduplicate points before nearest-edge search with matcher.
+            If None, search every point. Defaults to None.
+        nearest (tuple, optional): precomputed (positions, distances) from nearest_edge_positions. Defaults to None.
 
     Returns:
         gpd.GeoDataFrame: gdf of graph edges of OSM network that have public data matched to them
     """
-    ne, dists = ox.nearest_edges(G, public_df["longitude"], public_df["latitude"], return_dist=True, interpolate=metres_to_dist(INTERPOLATION_DIST_NEAREST_EDGE))
-    public_df["ne"] = ne
-    public_df["dist"] = dists
-    
-    matched_public_df = threshold_on_col(public_df)
+    pos, dists = nearest_edge_positions(public_df, graph_edges, G, matcher=matcher, snap=snap) if nearest is None else nearest
+    matched = dists < THRESH_EDGE_MATCH_DIST
     
-    matched_graph_edges_public = match_nearest_edges(graph_edges, matched_public_df)
+    matched_graph_edges_public = aggregate_edge_matches(graph_edges, pos[matched], public_df["trackid"].to_numpy()[matched],
+                                                        public_df["tracksegid"].to_numpy()[matched] if "tracksegid" in public_df else None)
+    return threshold_public_edges(matched_graph_edges_public, graph_nodes)
+
+def threshold_public_edges(matched_graph_edges_public: gpd.GeoDataFrame, graph_nodes: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Assign activity attribute to graph edges with public data matched to them, and remove edges with too few
+    points for their length and small graphs (noise)
+
+    Args:
+        matched_graph_edges_public (gpd.GeoDataFrame): matched graph edges with "count", "tracks" and "segments" 
+            columns, from aggregate_edge_matches
+        graph_nodes (gpd.GeoDataFrame): gdf of graph nodes of base OSM path network graph
+
+    Returns:
+        gpd.GeoDataFrame: gdf of graph edges of OSM network that have public data matched to them
+    """
     matched_graph_edges_public = matched_graph_edges_public.assign(activity=matched_graph_edges_public["tracks"])
     matched_graph_edges_public = matched_graph_edges_public \
                                     .loc[matched_graph_edges_public["count"] > matched_graph_edges_public["length"] / THRESH_EDGE_MAX_POINT_SEPARATION_PUBLIC_GPS] \
-                                    .drop(columns=["count", "tracks"])
-    matched_graph_edges_public = filter_large_subgraphs(graph_nodes, matched_graph_edges_public)
+                                    .drop(columns=["count", "tracks", "segments"])
+    with instrument.stage("filter_subgraphs") as counts:
+        counts["edges_in"] = len(matched_graph_edges_public)
+        matched_graph_edges_public = matched_graph_edges_public.loc[large_subgraphs_mask(matched_graph_edges_public)]
+        counts["edges_out"] = len(matched_graph_edges_public)
     
     return matched_graph_edges_public   
 
-def match_row_data_with_edges(row_df: pd.DataFrame, graph_edges: gpd.GeoDataFrame, graph_nodes: gpd.GeoDataFrame, G: nx.MultiGraph) -> gpd.GeoDataFrame:
+def match_row_data_with_edges(row_df: pd.DataFrame, graph_edges: gpd.GeoDataFrame, graph_nodes: gpd.GeoDataFrame, G: nx.MultiGraph, matcher: EdgeMatcher = None, snap: float = None, nearest: tuple = None) -> gpd.GeoDataFrame:
     """Perform map-matching of data points representing rights of way with base graph edges. 
     Additionally threshold distance between GPS points to edges, assign "row" attribute,
     and remove small graphs (noise).
@@ -80,28 +135,33 @@ def match_row_data_with_edges(row_df: pd.DataFrame, graph_edges: gpd.GeoDataFram
         graph_edges (gpd.GeoDataFrame): gdf of graph edges of base OSM path network graph
         graph_nodes (gpd.GeoDataFrame): gdf of graph nodes of base OSM path network graph
         G (nx.MultiGraph): graph composed of graph_edges and graph_nodes to save computation of conversion
+        matcher (EdgeMatcher, optional): prebuilt nearest-edge index of graph_edges. If None, use ox.nearest_edges.
+            Defaults to None.
+        snap (float, optional): grid size in metres to deduplicate points before nearest-edge search with matcher.
+            If None, search every point. Defaults to None.
+        nearest (tuple, optional): precomputed (positions, distances) from nearest_edge_positions. Defaults to None.
 
     Returns:
         gpd.GeoDataFrame: gdf of graph edges of OSM network that are rights of way
     """
-    ne, dists = ox.nearest_edges(G, row_df["longitude"], row_df["latitude"], return_dist=True, interpolate=metres_to_dist(INTERPOLATION_DIST_NEAREST_EDGE))
-    row_df["ne"] = ne
-    row_df["dist"] = dists
+    pos, dists = nearest_edge_positions(row_df, graph_edges, G, matcher=matcher, snap=snap) if nearest is None else nearest
+    matched = dists < THRESH_EDGE_MATCH_DIST
     
-    matched_row_df = threshold_on_col(row_df)
-    
-    matched_graph_edges_row = match_nearest_edges(graph_edges, matched_row_df)
+    matched_graph_edges_row = aggregate_edge_matches(graph_edges, pos[matched], row_df["trackid"].to_numpy()[matched],
+                                                        row_df["tracksegid"].to_numpy()[matched] if "tracksegid" in row_df else None)
     matched_graph_edges_row = matched_graph_edges_row \
                                 .assign(row=matched_graph_edges_row["count"] > matched_graph_edges_row["length"] / THRESH_EDGE_MAX_POINT_SEPARATION_ROW_GPS) \
-                                .drop(columns=["count", "tracks"])
+                                .drop(columns=["count", "tracks", "segments"])
     matched_graph_edges_row = matched_graph_edges_row.loc[matched_graph_edges_row["row"]]
-    matched_graph_edges_row = filter_large_subgraphs(graph_nodes, matched_graph_edges_row)
+    matched_graph_edges_row = matched_graph_edges_row.loc[large_subgraphs_mask(matched_graph_edges_row)]
     
     return matched_graph_edges_row
 
 def join_public_row_edges(public_edges: gpd.GeoDataFrame, row_edges: gpd.GeoDataFrame, edge_dtypes: dict = None) -> gpd.GeoDataFrame:
     """Join geodataframes representing public-activity graph edges and RoW graph edges. Assign attributes for
     activity and RoW. Additionally normalise activity attribute to percentage activity.
+    Edges are joined on single int64 edge ids: the inner, public-only and RoW-only partitions are found with
+    sorted-array set operations and taken by position, so each edge's geometry is only copied once.
 
     Args:
         public_edges (gpd.GeoDataFrame): Graph edges of matched public activity data
@@ -111,14 +171,19 @@ def join_public_row_edges(public_edges: gpd.GeoDataFrame, row_edges: gpd.GeoData
     Returns:
         gpd.GeoDataFrame: single geodataframe containing all edges, labelled with public activity and RoW
     """
-    df1, df2, df3 = merge_on_edges(public_edges, row_edges, hows=["inner", "left_only", "right_only"], del_cols=["count, tracks"])
+    public_ids, row_ids = encode_edge_ids(public_edges.index, row_edges.index)
+    _, inner_public, inner_row = np.intersect1d(public_ids, row_ids, assume_unique=True, return_indices=True)
+    public_only = np.ones(len(public_ids), dtype=bool)
+    public_only[inner_public] = False
+    row_only = np.ones(len(row_ids), dtype=bool)
+    row_only[inner_row] = False
 
-    df1["row"] = df1["row"] == 1
-    df2["row"] = df2["row"] == 1
-    df3["row"] = df3["row"] == 1
-    df3["activity"] = 0
+    row = row_edges["row"].to_numpy()
+    df1 = public_edges.iloc[np.sort(inner_public)].assign(row=row[inner_row[np.argsort(inner_public)]] == 1)
+    df2 = public_edges.loc[public_only].assign(row=False)
+    df3 = row_edges.loc[row_only].assign(row=row[row_only] == 1, activity=0)
     
-    dtypes = dict([(i, edge_dtypes[i]) for i in edge_dtypes.keys() if i in df1.columns])
+    dtypes = dict([(i, edge_dtypes[i]) for i in edge_dtypes.keys() if i in df1.columns]) if edge_dtypes is not None else {}
     
     public_row_df = pd.concat([df1, df2, df3], axis=0).astype(dtypes)
     public_row_df["activity"] = raw_activity_to_percentage(public_row_df["activity"])
@@ -126,94 +191,764 @@ def join_public_row_edges(public_edges: gpd.GeoDataFrame, row_edges: gpd.GeoData
     return public_row_df
 
 
-def analyse_batch(row_data="", public_data="", graph_data="", graph_boundary: list = None, out_fn="") -> None:
+def output_writers(out_fn: str) -> dict:
+    """Return writers of the 3 output graphs P, B, R for output filename prefix"""
+    return {g: GraphOutputWriter(f"{out_fn}_{g}") for g in ["P", "B", "R"]}
+
+def quadrat_analysis_exists(out_fn: str, i: int) -> bool:
+    """Return whether all 3 output graph parts exist for ith subregion of output filename prefix"""
+    return all(writer.has_part(i) for writer in output_writers(out_fn).values())
+
+def data_key(data) -> str:
+    """Cache key of point data with filename prefix, or of list of filename prefixes loaded together"""
+    if isinstance(data, (list, tuple)):
+        return cache.hash_key([data_key(d) for d in data])
+    return cache.output_key(data, data + point_store.POINT_STORE_EXT, data + ".csv")
+
+def stage_params(stage: str) -> dict:
+    """Parameters of analysis stages, for cache keys"""
+    return {"interpolate": {"dist": INTERPOLATION_DIST_PUBLIC_GPS, "jump": THRESH_INTERPOLATION_JUMP_DIST, "min_points": THRESH_SPURIOUS_GPS_POINT_COUNT},
+            "match": {"interpolate": INTERPOLATION_DIST_NEAREST_EDGE, "snap": SNAP_DIST_NEAREST_EDGE},
+            "join": {"match_dist": THRESH_EDGE_MATCH_DIST, "public_separation": THRESH_EDGE_MAX_POINT_SEPARATION_PUBLIC_GPS,
+                     "row_separation": THRESH_EDGE_MAX_POINT_SEPARATION_ROW_GPS, "subgraph_length": THRESH_LARGE_SUBGRAPH_LENGTH,
+                     "max_activity": MAX_ACTIVITY}}[stage]
+
+def graph_key(graph_data: str, i: int) -> str:
+    """Cache key of graph of ith subregion, from the key in its manifest and the files it is stored in, so that
+    a graph downloaded again with the same geometry and filter but changed OSM content has a different key"""
+    fn = f"{graph_data}_{i}"
+    return cache.hash_key(cache.output_key(fn), cache.file_key(fn + GRAPH_STORE_EXT), cache.file_key(fn + ".graphml"))
+
+def quadrat_keys(i: int, geometry, public_key: str, row_key: str, graph_data="", interpolated: bool = False) -> dict:
+    """Cache keys of interpolation, matching and join stages of ith subregion, chained from keys of its inputs
+
+    Args:
+        i (int): index of subregion in graph boundary
+        geometry (shapely.geometry.MultiPolygon): subregion
+        public_key (str): key of public GPS data
+        row_key (str): key of RoW data
+        graph_data (str, optional): Filename prefix of graph of OSM path network. Defaults to "".
+        interpolated (bool, optional): whether public data is already interpolated, so that the interpolation
+            stage only routes points to the subregion. Defaults to False.
+
+    Returns:
+        dict: stage names to keys
+    """
+    geometry_key = cache.hash_key(geometry.wkb_hex)
+    if interpolated:
+        keys = {"interpolate": cache.stage_key("route", inputs={"interpolated": public_key, "geometry": geometry_key})}
+    else:
+        keys = {"interpolate": cache.stage_key("interpolate", stage_params("interpolate"), {"public": public_key, "geometry": geometry_key})}
+    keys["match"] = cache.stage_key("match", stage_params("match"), {"interpolate": keys["interpolate"], "row": row_key, "geometry": geometry_key, "graph": graph_key(graph_data, i)})
+    keys["join"] = cache.stage_key("join", stage_params("join"), {"match": keys["match"]})
+    return keys
+
+def quadrat_cache_fn(out_fn: str, i: int, stage: str) -> str:
+    """Filename prefix of cached stage output of ith subregion"""
+    return os.path.join(f"{out_fn}_cache", f"{i}_{stage}")
+
+def quadrat_analysis_fresh(out_fn: str, i: int, keys: dict) -> bool:
+    """Return whether ith subregion was analysed with the same keys, and its outputs (if any) exist"""
+    manifest = cache.read_manifest(quadrat_cache_fn(out_fn, i, "join"))
+    return manifest is not None and manifest["key"] == keys["join"] and (not manifest["written"] or quadrat_analysis_exists(out_fn, i))
+
+def share_points(df: pd.DataFrame, folder: str) -> dict:
+    """Save dataframe columns as .npy files, to be memory-mapped read-only by worker processes
+
+    Args:
+        df (pd.DataFrame): points dataframe
+        folder (str): folder to save columns to
+
+    Returns:
+        dict: column names to .npy filenames
+    """
+    os.makedirs(folder, exist_ok=True)
+    columns = {}
+    for c in df.columns:
+        columns[c] = os.path.join(folder, f"{c}.npy")
+        np.save(columns[c], df[c].to_numpy())
+    return columns
+
+def take_points(columns: dict, idx: np.ndarray) -> pd.DataFrame:
+    """Take points at given indices from columns, as utils.points_in_polygon would return them
+
+    Args:
+        columns (dict): column names to arrays, or to .npy filenames to memory-map
+        idx (np.ndarray): indices of points to take
+
+    Returns:
+        pd.DataFrame: points with original index in "index" column
+    """
+    columns = {c: np.load(a, mmap_mode="r") if isinstance(a, str) else a for c, a in columns.items()}
+    return pd.DataFrame({"index": idx, **{c: np.asarray(a[idx]) for c, a in columns.items()}})
+
+def points_fit_in_memory(data: list, geometry, memory_mb: float = None) -> bool:
+    """Return whether points of all data in tiles intersecting geometry fit in memory budget, estimated from
+    point store metadata without reading the points (see POINT_MEMORY_BYTES). Legacy csv data can't be read
+    by tile, so is always read at once.
+
+    Args:
+        data (list): filename prefixes of point stores, or lists of prefixes
+        geometry (shapely.geometry.MultiPolygon): area to read points of
+        memory_mb (float, optional): memory budget in MB. If None, points always fit. Defaults to None.
+
+    Returns:
+        bool: whether points fit in memory budget
+    """
+    if memory_mb is None:
+        return True
+    n_points = point_store.count_points(list(data), geometry=geometry)
+    return n_points is None or n_points * POINT_MEMORY_BYTES <= memory_mb * 1e6
+
+def read_quadrat_points(data, geometry, columns: list = None) -> tuple:
+    """Read points of data in tiles intersecting one subregion, instead of the whole analysis area, and find 
+    those inside it
+
+    Args:
+        data (str): filename prefix of point store, or list of prefixes
+        geometry (shapely.geometry.MultiPolygon): subregion
+        columns (list, optional): columns to read, in addition to coordinates. If None, read all. Defaults to None.
+
+    Returns:
+        tuple: (column names to arrays, indices of points in subregion), as used by analyse_quadrat
+    """
+    df = point_store.load_points(data, geometry=geometry, columns=columns)
+    idx = GridBucketIndex.from_df(df, bounds=geometry.bounds).query(geometry)
+    return {c: df[c].to_numpy() for c in df.columns}, idx
+
+def interpolate_public_data(public_data="", geometry=None, fn="") -> int:
+    """Interpolate all public GPS tracks within a region once, and save to a point store, so that the
+    interpolated points can be routed to the subregions of several authorities with analyse_batch(interpolated=True).
+    Tracks are clipped to the region, not to each subregion, so tracks crossing subregion or authority borders
+    are interpolated once along their whole length within the region. Reused until parameters or inputs change.
+
+    Args:
+        public_data (str, optional): Filename prefix of public GPS data point store (or legacy csv). Defaults to "".
+        geometry (shapely.geometry.MultiPolygon, optional): region to interpolate tracks in, e.g. union of
+            graph boundaries of all authorities in the region. Defaults to None.
+        fn (str, optional): Filename prefix of output point store. Defaults to "".
+
+    Returns:
+        int: number of interpolated points
+    """
+    params = stage_params("interpolate")
+    inputs = {"public": data_key(public_data),
+              "geometry": cache.hash_key(geometry.wkb_hex)}
+    key = cache.stage_key("interpolate", params, inputs)
+    if cache.is_fresh(fn, key, point_store.store_exists(fn)):
+        print(f"Interpolated public data found at {fn}")
+        return cache.read_manifest(fn)["n_points"]
+
+    print("Reading public data")
+    df = point_store.load_points(public_data, geometry=geometry)
+    df = df.iloc[GridBucketIndex.from_df(df, bounds=geometry.bounds).query(geometry)]
+
+    print("Interpolating public data...")
+    public_df = batch_geo_interpolate_df(df, dist_m=INTERPOLATION_DIST_PUBLIC_GPS, segmentation=True)
+    if public_df is None:
+        public_df = pd.DataFrame({"latitude": [], "longitude": [], "tracksegid": [], "trackid": []})
+    n_points = point_store.write_point_store([public_df], fn)
+
+    cache.write_manifest(fn, "interpolate", key, params, inputs, n_points=n_points)
+    return n_points
+
+def analyse_quadrat(i: int, public_columns: dict, public_idx: np.ndarray, row_columns: dict, row_idx: np.ndarray, graph_data="", out_fn="", keys: dict = None, interpolated: bool = False) -> bool:
+    """Perform analysis for one subregion: interpolate public data, match public and RoW data to the
+    subregion's graph, join and append outputs as parts of the output graphs. Parts are written to temporary
+    files and renamed, so that outputs on disk are always complete. Interpolated points and nearest edges are
+    cached with keys, so that only stages after a changed parameter or input are rerun.
+
+    Args:
+        i (int): index of subregion in graph boundary
+        public_columns (dict): public point column names to arrays, or to .npy filenames to memory-map
+        public_idx (np.ndarray): indices of public points in subregion
+        row_columns (dict): RoW point column names to arrays, or to .npy filenames to memory-map
+        row_idx (np.ndarray): indices of RoW points in subregion
+        graph_data (str, optional): Filename prefix of graph of OSM path network. Defaults to "".
+        out_fn (str, optional): Filename prefix of output data. Defaults to "".
+        keys (dict, optional): stage keys from quadrat_keys. If None, don't cache. Defaults to None.
+        interpolated (bool, optional): whether public points are already interpolated, e.g. by 
+            interpolate_public_data, so they are used as they are. Defaults to False.
+
+    Returns:
+        bool: whether outputs were written
+    """
+    print("Starting analysis for geometry", i)
+    with instrument.stage("quadrat", output=out_fn, quadrat=i) as counts:
+        counts["written"] = written = _analyse_quadrat(i, public_columns, public_idx, row_columns, row_idx, graph_data, out_fn, keys, interpolated)
+    return written
+
+def analyse_quadrat_out_of_core(i: int, public_data, row_data, geometry, graph_data="", out_fn="", keys: dict = None, interpolated: bool = False) -> bool:
+    """Perform analysis for one subregion as analyse_quadrat, but reading its points from the point stores,
+    only from tiles intersecting it, so that memory doesn't grow with the size of the analysis area. Public
+    data isn't read if its interpolation in the subregion is cached.
+
+    Args:
+        i (int): index of subregion in graph boundary
+        public_data (str): Filename prefix of public GPS data point store, or list of prefixes
+        row_data (str): Filename prefix of RoW data point store, or list of prefixes
+        geometry (shapely.geometry.MultiPolygon): subregion
+        graph_data (str, optional): Filename prefix of graph of OSM path network. Defaults to "".
+        out_fn (str, optional): Filename prefix of output data. Defaults to "".
+        keys (dict, optional): stage keys from quadrat_keys. If None, don't cache. Defaults to None.
+        interpolated (bool, optional): whether public points are already interpolated. Defaults to False.
+
+    Returns:
+        bool: whether outputs were written
+    """
+    needs_public = interpolated or keys is None or not cache.is_fresh(quadrat_cache_fn(out_fn, i, "interpolate"), keys["interpolate"])
+    with instrument.stage("read_points", output=out_fn, quadrat=i) as counts:
+        if needs_public:
+            public_columns, public_idx = read_quadrat_points(public_data, geometry)
+        else:
+            public_columns, public_idx = {"latitude": np.zeros(0), "longitude": np.zeros(0)}, np.zeros(0, dtype=np.int64)
+        row_columns, row_idx = read_quadrat_points(row_data, geometry)
+        counts.update(public_points=len(public_idx), row_points=len(row_idx))
+    return analyse_quadrat(i, public_columns, public_idx, row_columns, row_idx, graph_data=graph_data, out_fn=out_fn, keys=keys, interpolated=interpolated)
+
+def _analyse_quadrat(i: int, public_columns: dict, public_idx: np.ndarray, row_columns: dict, row_idx: np.ndarray, graph_data: str, out_fn: str, keys: dict, interpolated: bool) -> bool:
+    """Steps of analyse_quadrat, recorded as stages of its "quadrat" stage"""
+
+    # Check analysis for subregion is up to date
+    join_fn = quadrat_cache_fn(out_fn, i, "join")
+    if keys is not None and quadrat_analysis_fresh(out_fn, i, keys):
+        return cache.read_manifest(join_fn)["written"]
+
+    def finish(written: bool) -> bool:
+        if not written:
+            for writer in output_writers(out_fn).values():
+                writer.remove_part(i)
+        if keys is not None:
+            cache.write_manifest(join_fn, "join", keys["join"], stage_params("join"), {"match": keys["match"]}, written=written)
+        return written
+
+    # Retrieve graph data
+    with instrument.stage("load_graph") as counts:
+        G = load_graph(f"{graph_data}_{i}")
+        counts.update(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+    if nx.is_empty(G):
+        print(f"{i}th geometry is empty, skipping")
+        return finish(False)
+    graph_nodes, graph_edges = ox.graph_to_gdfs(G, nodes=True, edges=True)
+    
+    # Interpolate public data in geometry, or read cached interpolation
+    interpolate_fn = quadrat_cache_fn(out_fn, i, "interpolate")
+    if interpolated:
+        public_df = take_points(public_columns, public_idx) if len(public_idx) > 0 else None
+    elif keys is not None and cache.is_fresh(interpolate_fn, keys["interpolate"]):
+        public_df = pd.read_parquet(interpolate_fn + ".parquet") if os.path.isfile(interpolate_fn + ".parquet") else None
+    else:
+        print("Interpolating public data...")
+        public_df = batch_geo_interpolate_df(take_points(public_columns, public_idx), dist_m=INTERPOLATION_DIST_PUBLIC_GPS, segmentation=True)
+        if keys is not None:
+            os.makedirs(os.path.dirname(interpolate_fn), exist_ok=True)
+            if public_df is not None:
+                public_df.to_parquet(interpolate_fn + ".tmp.parquet", index=False)
+                os.replace(interpolate_fn + ".tmp.parquet", interpolate_fn + ".parquet")
+            elif os.path.isfile(interpolate_fn + ".parquet"):
+                os.remove(interpolate_fn + ".parquet")
+            cache.write_manifest(interpolate_fn, "interpolate", keys["interpolate"], stage_params("interpolate"))
+    if public_df is None:
+        print("No good public data found, abort...")
+        return finish(False)
+    row_df = take_points(row_columns, row_idx)
+    
+    # Find nearest edges of public and RoW data, or read cached nearest edges
+    match_fn = quadrat_cache_fn(out_fn, i, "match")
+    public_nearest = row_nearest = None
+    if keys is not None and cache.is_fresh(match_fn, keys["match"]):
+        with np.load(match_fn + ".npz") as nearest:
+            # Positions index into graph edges and points, so are stale if their number changed
+            if "n_edges" in nearest and int(nearest["n_edges"]) == len(graph_edges) and len(nearest["public_pos"]) == len(public_df) and len(nearest["row_pos"]) == len(row_df):
+                public_nearest = (nearest["public_pos"], nearest["public_dists"])
+                row_nearest = (nearest["row_pos"], nearest["row_dists"])
+    if public_nearest is None:
+        print("Matching data to graph...")
+        with instrument.stage("nearest_edges") as counts:
+            matcher = EdgeMatcher.load_or_build(graph_edges, f"{graph_data}_{i}")
+            public_nearest = nearest_edge_positions(public_df, graph_edges, G, matcher=matcher, snap=SNAP_DIST_NEAREST_EDGE)
+            row_nearest = nearest_edge_positions(row_df, graph_edges, G, matcher=matcher)
+            counts.update(public_points=len(public_df), row_points=len(row_df), edges=len(graph_edges))
+        if keys is not None:
+            os.makedirs(os.path.dirname(match_fn), exist_ok=True)
+            np.savez(match_fn + ".tmp.npz", public_pos=public_nearest[0], public_dists=public_nearest[1], row_pos=row_nearest[0], row_dists=row_nearest[1], n_edges=len(graph_edges))
+            os.replace(match_fn + ".tmp.npz", match_fn + ".npz")
+            cache.write_manifest(match_fn, "match", keys["match"], stage_params("match"))
+
+    # Threshold matches to graph
+    with instrument.stage("match") as counts:
+        matched_graph_edges_public = match_public_data_with_edges(public_df, graph_edges, graph_nodes, G, nearest=public_nearest)
+        matched_graph_edges_row = match_row_data_with_edges(row_df, graph_edges, graph_nodes, G, nearest=row_nearest)
+        counts.update(public_points=len(public_df), public_points_matched=int((public_nearest[1] < THRESH_EDGE_MATCH_DIST).sum()),
+                      public_edges=len(matched_graph_edges_public), row_edges=len(matched_graph_edges_row))
+    
+    # Save temp analysis
+    #save_undirected_graph(graph_nodes, matched_graph_edges_public, f"{out_fn}_public_{i}.graphml")
+    #save_undirected_graph(graph_nodes, matched_graph_edges_row,    f"{out_fn}_row_{i}.graphml")
+    
+    # Join these two graph edge dataframes
+    print("Joining public and RoW data")
+    with instrument.stage("join") as counts:
+        public_row_df = join_public_row_edges(matched_graph_edges_public, matched_graph_edges_row, edge_dtypes=graph_edges.dtypes.to_dict())
+        counts["edges"] = len(public_row_df)
+    
+    write_quadrat_outputs(i, graph_nodes, public_row_df, out_fn)
+    
+    print("Done")
+    return finish(True)
+
+def write_quadrat_outputs(i: int, graph_nodes: gpd.GeoDataFrame, public_row_df: gpd.GeoDataFrame, out_fn="") -> None:
+    """Split joined edges of ith subregion into the 3 output graphs P, B, R and write them as its parts"""
+    R = public_row_df["row"] == True
+    P = public_row_df["activity"] > 0
+    
+    masks = {"P": P & ~R, "B": P & R, "R": ~P & R}
+    with instrument.stage("write_outputs") as counts:
+        for g, writer in output_writers(out_fn).items():
+            writer.write(i, ox.graph_from_gdfs(graph_nodes, public_row_df[masks[g]]).to_undirected())
+            counts[f"edges_{g}"] = int(masks[g].sum())
+
+def assemble_outputs(subregion_outputs: dict, geometry, out_fn="") -> None:
+    """Assemble output graphs of an area (e.g. an authority) from output parts of subregions analysed in other
+    outputs (e.g. national tiles shared between authorities, see batch.batch_prow_analyse_national). Parts of
+    subregions within the area are linked as they are, and parts of subregions on its border are clipped to
+    edges intersecting it. Reused until the source outputs or the area change.
+
+    Args:
+        subregion_outputs (dict): subregion indices to tuples of (filename prefix of output the subregion was 
+            analysed in, subregion geometry)
+        geometry (shapely.geometry.MultiPolygon): area to assemble outputs for
+        out_fn (str, optional): Filename prefix of output data. Defaults to "".
+    """
+    inputs = {str(i): cache.output_key(src) for i, (src, _) in subregion_outputs.items()}
+    inputs["geometry"] = cache.hash_key(geometry.wkb_hex)
+    key = cache.stage_key("assemble", inputs=inputs)
+    if cache.is_fresh(out_fn, key, check_analysis_exists(out_fn)):
+        print(f"Analysis found at {out_fn}")
+        return
+
+    shapely.prepare(geometry)
+    for g, writer in output_writers(out_fn).items():
+        for i in writer.part_indices():
+            if i not in subregion_outputs:
+                writer.remove_part(i)
+        for i, (src, subregion) in subregion_outputs.items():
+            source = GraphOutputWriter(f"{src}_{g}")
+            if not source.has_part(i):
+                writer.remove_part(i)
+            elif geometry.contains(subregion):
+                writer.link_part(i, source.part_fn(i))
+            else:
+                G = load_graph(source.part_fn(i), edge_dtypes=ADDITIONAL_EDGE_DTYPES)
+                edges = list(G.edges(keys=True, data="geometry"))
+                geoms = np.array([e[3] for e in edges], dtype=object)
+                outside = ~(shapely.intersects(geometry, geoms) | shapely.is_missing(geoms))
+                G.remove_edges_from([e[:3] for e, o in zip(edges, outside) if o])
+                writer.write(i, G)
+        writer.finalise()
+    cache.write_manifest(out_fn, "assemble", key, inputs=inputs)
+
+def prune_quadrats(public_data="", graph_boundary=None, min_points: int = MIN_QUADRAT_POINTS, min_tracks: int = MIN_QUADRAT_TRACKS, fn="", memory_mb: float = None) -> list:
+    """Find subregions with too little public GPS data to analyse, from counts of points and tracks in each subregion,
+    reading only coordinates and track ids. Skipping these avoids downloading their graphs and analysing them, 
+    which would otherwise only find that there is no good public data after interpolation.
+
+    Args:
+        public_data (str, optional): Filename prefix of public GPS data point store (or legacy csv), or list of
+            prefixes. Defaults to "".
+        graph_boundary (list, optional): list of shapely.geometry.MultiPolygon representing subregions, or dict of
+            indices to geometries. Defaults to None.
+        min_points (int, optional): min number of points in subregion. Defaults to MIN_QUADRAT_POINTS.
+        min_tracks (int, optional): min number of tracks in subregion. Defaults to MIN_QUADRAT_TRACKS.
+        fn (str, optional): Filename prefix to cache result at, reused until parameters or inputs change. 
+        If "", don't cache. Defaults to "".
+        memory_mb (float, optional): memory budget in MB for points read at once. If points of all subregions
+            don't fit, read those of each subregion separately. Defaults to None.
+
+    Returns:
+        list: indices of subregions to skip
+    """
+    params = {"min_points": min_points, "min_tracks": min_tracks}
+    inputs = {"public": data_key(public_data),
+              "boundary": cache.hash_key([(i, geom.wkb_hex) for i, geom in boundary_items(graph_boundary)])}
+    key = cache.stage_key("prune", params, inputs)
+    if fn != "" and cache.is_fresh(f"{fn}_prune", key):
+        return cache.read_manifest(f"{fn}_prune")["skip"]
+
+    boundary = unary_union([geom for _, geom in boundary_items(graph_boundary)])
+    out_of_core = not points_fit_in_memory([public_data], boundary, memory_mb)
+    if not out_of_core:
+        df = point_store.load_points(public_data, geometry=boundary, columns=["trackid"])
+        index = GridBucketIndex.from_df(df, bounds=boundary.bounds)
+        trackids = df["trackid"].to_numpy()
+
+    skip = []
+    for i, geom in boundary_items(graph_boundary):
+        if out_of_core:
+            columns, idx = read_quadrat_points(public_data, geom, columns=["trackid"])
+            trackids = columns["trackid"]
+        else:
+            idx = index.query(geom)
+        if len(idx) < min_points or len(np.unique(trackids[idx])) < min_tracks:
+            skip.append(i)
+
+    print(f"Pruned {len(skip)} of {len(graph_boundary)} subregions with fewer than {min_points} points or {min_tracks} tracks")
+    if fn != "":
+        cache.write_manifest(f"{fn}_prune", "prune", key, params, inputs, skip=skip)
+    return skip
+
+def report_pruning(n_pruned: int, n_total: int, elapsed: float) -> float:
+    """Print number of pruned subregions and estimate of time saved, from mean time of subregions that were processed
+
+    Args:
+        n_pruned (int): number of subregions pruned
+        n_total (int): total number of subregions
+        elapsed (float): time taken to download graphs and analyse remaining subregions in seconds
+
+    Returns:
+        float: estimated time saved in seconds
+    """
+    saved = elapsed / max(n_total - n_pruned, 1) * n_pruned
+    print(f"Pruned {n_pruned} of {n_total} subregions, saving an estimated {saved:.0f}s ({elapsed:.0f}s taken)")
+    return saved
+
+def analyse_batch(row_data="", public_data="", graph_data="", graph_boundary=None, out_fn="", workers: int = 1, skip: list = None, interpolated: bool = False, finalise: bool = True, memory_mb: float = None) -> None:
     """Perform full analysis for given rights of way data, given public activity data, given base map graph,
     and polygons representing smaller graph areas of interest. Each polygon will produce one set of graph analysis outputs.
+    Subregions are independent, so can be analysed in parallel worker processes, which memory-map the region's
+    points read-only instead of receiving copies. Outputs of each subregion are appended to the output graphs
+    as soon as it finishes, and the output graphs are finalised once all have finished. Each stage of each
+    subregion is cached with a manifest, and only rerun if its parameters or inputs changed (see quadrat_keys).
+    If the points of the analysis area don't fit in a memory budget, each subregion reads its own points from 
+    the point stores instead (see analyse_quadrat_out_of_core), so that memory stays flat whatever the area.
     See inline comments for algorithn steps.
 
     Args:
-        row_data (str, optional): Filename prefix of RoW data. Defaults to "".
-        public_data (str, optional): Filename prefix of public GPS data. Defaults to "".
+        row_data (str, optional): Filename prefix of RoW data point store (or legacy csv), or list of prefixes, 
+            e.g. of all authorities intersecting national tiles. Defaults to "".
+        public_data (str, optional): Filename prefix of public GPS data point store (or legacy csv), or list of
+            prefixes. Defaults to "".
         graph_data (str, optional): Filename prefix of graph of OSM path network . Defaults to "".
         graph_boundary (list, optional): list of shapely.geometry.MultiPolygon representing regions for which
         an analysis should be produced (i.e. smaller subregions of total input data to speed up map-matching
-        computations). Defaults to None.
+        computations), or dict of indices to geometries (e.g. national tiles). Defaults to None.
         out_fn (str, optional): Filename prefix of output data. Defaults to "".
+        workers (int, optional): Number of processes to analyse subregions. If 1, analyse in this process. Defaults to 1.
+        skip (list, optional): indices of subregions not to analyse, e.g. from prune_quadrats. Defaults to None.
+        interpolated (bool, optional): whether public_data is already interpolated, e.g. by interpolate_public_data
+            for all authorities in a region, so that its points are only routed to subregions. Defaults to False.
+        finalise (bool, optional): whether to finalise the output graphs. If False, only write the parts of the given
+            subregions, e.g. for one task of a work queue shared with other workers, and finalise later by calling again
+            with all subregions once all are analysed. Defaults to True.
+        memory_mb (float, optional): memory budget in MB for points read at once, estimated from point store
+            metadata (see points_fit_in_memory). If None, read points of the whole analysis area at once. Defaults to None.
     """
 
-    # Retrieve whole region's public and RoW data
-    print("Reading public and row data")
-    all_public_df = pd.read_csv(public_data+".csv")
-    all_row_df = pd.read_csv(row_data+".csv")
-    
-    all_G_P = []
-    all_G_B = []
-    all_G_R = []
-    
-    for i, geom in tqdm(enumerate(graph_boundary)):
-        print("Starting analysis for geometry", i)
-        
-        # Check analysis for subregion already exists
-        if os.path.isfile(f"{out_fn}_P_{i}.graphml") and os.path.isfile(f"{out_fn}_B_{i}.graphml") and os.path.isfile(f"{out_fn}_R_{i}.graphml"):
-            G_P = ox.load_graphml(f"{out_fn}_P_{i}.graphml")
-            G_B = ox.load_graphml(f"{out_fn}_B_{i}.graphml")
-            G_R = ox.load_graphml(f"{out_fn}_R_{i}.graphml")
-            all_G_P += [G_P]
-            all_G_B += [G_B]
-            all_G_R += [G_R]
-            continue
-        
-        # Retrieve graph data
-        G = ox.load_graphml(f"{graph_data}_{i}.graphml")
+    # Chain cache keys of each subregion's stages from keys of inputs, and skip if outputs are up to date
+    public_key = data_key(public_data)
+    row_key = data_key(row_data)
+    skip = set() if skip is None else set(skip)
+    keys = {i: quadrat_keys(i, geom, public_key, row_key, graph_data, interpolated) for i, geom in boundary_items(graph_boundary) if i not in skip}
+    analysis_key = cache.stage_key("analysis", inputs={str(i): k["join"] for i, k in keys.items()})
+    if cache.is_fresh(out_fn, analysis_key, check_analysis_exists(out_fn)):
+        print(f"Analysis found at {out_fn}")
+        return
+
+    todo = [i for i in keys if not quadrat_analysis_fresh(out_fn, i, keys[i])]
+    needs_public = any(interpolated or not cache.is_fresh(quadrat_cache_fn(out_fn, i, "interpolate"), keys[i]["interpolate"]) for i in todo)
+
+    # Retrieve public and RoW data in tiles intersecting the analysis area. Public data is only needed to interpolate,
+    # or to route to subregions if already interpolated. If they don't fit in memory, each subregion reads its own.
+    boundary = unary_union([geom for _, geom in boundary_items(graph_boundary)])
+    if len(todo) == 0:
+        print("All subregions analysed, finalising")
+    elif not points_fit_in_memory([public_data, row_data] if needs_public else [row_data], boundary, memory_mb):
+        print(f"Points exceed memory budget of {memory_mb}MB, reading points of each subregion separately")
+        if workers == 1:
+            for i in tqdm(todo):
+                analyse_quadrat_out_of_core(i, public_data, row_data, graph_boundary[i], graph_data=graph_data, out_fn=out_fn, keys=keys[i], interpolated=interpolated)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(analyse_quadrat_out_of_core, i, public_data, row_data, graph_boundary[i], graph_data, out_fn, keys[i], interpolated) for i in todo]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    future.result()
+    else:
+        print("Reading public and row data")
+        with instrument.stage("read_points", output=out_fn) as counts:
+            all_public_df = point_store.load_points(public_data, geometry=boundary) if needs_public else pd.DataFrame({"latitude": [], "longitude": []})
+            all_row_df = point_store.load_points(row_data, geometry=boundary)
+            counts.update(public_points=len(all_public_df), row_points=len(all_row_df), quadrats=len(todo))
+
+        # Bucket points into grid cells once, so that finding points in each geometry only tests cells on its boundary
+        public_index = GridBucketIndex.from_df(all_public_df, bounds=boundary.bounds)
+        row_index = GridBucketIndex.from_df(all_row_df, bounds=boundary.bounds)
+
+        tasks = [(i, public_index.query(graph_boundary[i]), row_index.query(graph_boundary[i])) for i in todo]
+
+        if workers == 1:
+            public_columns = {c: all_public_df[c].to_numpy() for c in all_public_df.columns}
+            row_columns = {c: all_row_df[c].to_numpy() for c in all_row_df.columns}
+            for i, public_idx, row_idx in tqdm(tasks):
+                analyse_quadrat(i, public_columns, public_idx, row_columns, row_idx, graph_data=graph_data, out_fn=out_fn, keys=keys[i], interpolated=interpolated)
+        else:
+            # Share region points with workers through memory-mapped files
+            shared_folder = f"{out_fn}_shared"
+            public_columns = share_points(all_public_df, os.path.join(shared_folder, "public"))
+            row_columns = share_points(all_row_df, os.path.join(shared_folder, "row"))
+            del all_public_df, all_row_df, public_index, row_index
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(analyse_quadrat, i, public_columns, public_idx, row_columns, row_idx, graph_data, out_fn, keys[i], interpolated) for i, public_idx, row_idx in tasks]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    future.result()
+            shutil.rmtree(shared_folder)
+
+    if not finalise:
+        return
+
+    # Finalise output graphs from parts of all subregions, without parts left by earlier runs for other subregions
+    for writer in output_writers(out_fn).values():
+        for i in writer.part_indices():
+            if i not in keys:
+                writer.remove_part(i)
+        writer.finalise()
+    cache.write_manifest(out_fn, "analysis", analysis_key, inputs={str(i): k["join"] for i, k in keys.items()})
+
+    print("All done.")
+
+def ledger_keys(i: int, geometry, row_key: str, graph_data="", interpolated: bool = False) -> dict:
+    """Cache keys of activity ledger of ith subregion, and of its RoW edges, from keys of its inputs other than
+    public data, which is added to the ledger in batches (see update_quadrat)
+
+    Args:
+        i (int): index of subregion in graph boundary
+        geometry (shapely.geometry.MultiPolygon): subregion
+        row_key (str): key of RoW data
+        graph_data (str, optional): Filename prefix of graph of OSM path network. Defaults to "".
+        interpolated (bool, optional): whether public data batches are already interpolated. Defaults to False.
+
+    Returns:
+        dict: "ledger" and "row" keys
+    """
+    geometry_key = cache.hash_key(geometry.wkb_hex)
+    params = {"interpolate": None if interpolated else stage_params("interpolate"), "match": stage_params("match"), "match_dist": THRESH_EDGE_MATCH_DIST}
+    keys = {"ledger": cache.stage_key("ledger", params, {"geometry": geometry_key, "graph": graph_key(graph_data, i)})}
+    keys["row"] = cache.stage_key("row", stage_params("join"), {"row": row_key, "ledger": keys["ledger"]})
+    return keys
+
+def quadrat_update_key(keys: dict, batch_keys: dict) -> str:
+    """Key of outputs of ith subregion derived from its ledger with given batches"""
+    return cache.stage_key("update", stage_params("join"), {**keys, "batches": batch_keys})
+
+def record_unchanged_quadrat(i: int, new_points: dict, out_fn="", keys: dict = None, batch_keys: dict = None) -> bool:
+    """If the batches not in the activity ledger of one subregion have no points in it, and its outputs were derived
+    from the batches in its ledger, add them to the ledger as empty batches and record the update, without loading
+    the subregion's graph or points, as its ledger activity and outputs don't change.
+
+    Args:
+        i (int): index of subregion in graph boundary
+        new_points (dict): batch names to number of points in subregion, or None if unknown, for batches not in ledger
+        out_fn (str, optional): Filename prefix of output data. Defaults to "".
+        keys (dict, optional): keys from ledger_keys. Defaults to None.
+        batch_keys (dict, optional): batch names to keys of their data, for all batches the ledger should have. Defaults to None.
+
+    Returns:
+        bool: whether outputs were written, or None if subregion needs updating
+    """
+    update_fn = quadrat_cache_fn(out_fn, i, "update")
+    ledger = ActivityLedger(quadrat_cache_fn(out_fn, i, "ledger"), keys["ledger"])
+    previous = cache.read_manifest(update_fn)
+    new = [name for name in batch_keys if not ledger.has_batch(name, batch_keys[name])]
+    if previous is None or previous["inputs"] != {**keys, "batches": {name: b["key"] for name, b in ledger.batches.items()}} \
+            or (previous["written"] and not quadrat_analysis_exists(out_fn, i)) \
+            or any(name not in batch_keys for name in ledger.batches) or any(name in ledger.batches or new_points.get(name) != 0 for name in new):
+        return None
+    for name in new:
+        ledger.add_batch(name, batch_keys[name], pd.MultiIndex.from_arrays([[], [], []]), np.zeros(0, dtype=np.int64), n_points=0)
+    cache.write_manifest(update_fn, "update", quadrat_update_key(keys, batch_keys), inputs={**keys, "batches": batch_keys}, written=previous["written"])
+    return previous["written"]
+
+def update_quadrat(i: int, batches: list, row_columns: dict, row_idx: np.ndarray, graph_data="", out_fn="", keys: dict = None, batch_keys: dict = None, interpolated: bool = False) -> bool:
+    """Update analysis of one subregion with new batches of public data: interpolate and match only points of
+    batches not in its activity ledger yet (see utils.ledger), add their point counts per edge and track to the
+    ledger, and derive activity, P/B/R classification and subgraph filtering of all batches from the ledger.
+    RoW edges are matched once and kept in the ledger until RoW data changes.
+
+    Args:
+        i (int): index of subregion in graph boundary
+        batches (list): tuples of (batch name, columns, indices of points in subregion) of public data batches
+            to add, with columns as in analyse_quadrat
+        row_columns (dict): RoW point column names to arrays, or to .npy filenames to memory-map
+        row_idx (np.ndarray): indices of RoW points in subregion
+        graph_data (str, optional): Filename prefix of graph of OSM path network. Defaults to "".
+        out_fn (str, optional): Filename prefix of output data. Defaults to "".
+        keys (dict, optional): keys from ledger_keys. Defaults to None.
+        batch_keys (dict, optional): batch names to keys of their data, for all batches the ledger should have. Defaults to None.
+        interpolated (bool, optional): whether public points are already interpolated. Defaults to False.
+
+    Returns:
+        bool: whether outputs were written
+    """
+    print("Updating analysis for geometry", i)
+    update_fn = quadrat_cache_fn(out_fn, i, "update")
+    update_key = quadrat_update_key(keys, batch_keys)
+    with instrument.stage("update_quadrat", output=out_fn, quadrat=i) as counts:
+        # If new batches have no points in subregion, its ledger activity and outputs don't change
+        written = record_unchanged_quadrat(i, {name: len(idx) for name, _, idx in batches}, out_fn, keys, batch_keys)
+        if written is not None:
+            counts["written"] = written
+            return written
+
+        ledger = ActivityLedger(quadrat_cache_fn(out_fn, i, "ledger"), keys["ledger"])
+        for name in [name for name in ledger.batches if name not in batch_keys]:
+            ledger.remove_batch(name)
+
+        def finish(written: bool) -> bool:
+            if not written:
+                for writer in output_writers(out_fn).values():
+                    writer.remove_part(i)
+            cache.write_manifest(update_fn, "update", update_key, inputs={**keys, "batches": batch_keys}, written=written)
+            counts["written"] = written
+            return written
+
+        G = load_graph(f"{graph_data}_{i}")
         if nx.is_empty(G):
             print(f"{i}th geometry is empty, skipping")
-            continue
+            return finish(False)
         graph_nodes, graph_edges = ox.graph_to_gdfs(G, nodes=True, edges=True)
-        
-        # Bound public and row data
-        print("Finding data in geometry...")
-        public_df_raw = points_in_polygon(geom, all_public_df)
-        row_df        = points_in_polygon(geom, all_row_df)
-        
-        # Interpolate public data
-        print("Interpolating public data...")
-        public_df = batch_geo_interpolate_df(public_df_raw, dist_m=INTERPOLATION_DIST_PUBLIC_GPS, segmentation=True)
-        if public_df is None:
+        matcher = None
+
+        # Interpolate and match only batches not in ledger
+        for name, columns, idx in batches:
+            if ledger.has_batch(name, batch_keys[name]):
+                continue
+            public_df = take_points(columns, idx) if len(idx) > 0 else None
+            if public_df is not None and not interpolated:
+                public_df = batch_geo_interpolate_df(public_df, dist_m=INTERPOLATION_DIST_PUBLIC_GPS, segmentation=True)
+            if public_df is None or len(public_df) == 0:
+                ledger.add_batch(name, batch_keys[name], pd.MultiIndex.from_arrays([[], [], []]), np.zeros(0, dtype=np.int64), n_points=0)
+                continue
+            matcher = EdgeMatcher.load_or_build(graph_edges, f"{graph_data}_{i}") if matcher is None else matcher
+            with instrument.stage("nearest_edges") as stage_counts:
+                pos, dists = nearest_edge_positions(public_df, graph_edges, G, matcher=matcher, snap=SNAP_DIST_NEAREST_EDGE)
+                stage_counts["public_points"] = len(public_df)
+            matched = dists < THRESH_EDGE_MATCH_DIST
+            ledger.add_batch(name, batch_keys[name], graph_edges.index[pos[matched]], public_df["trackid"].to_numpy()[matched], n_points=len(public_df))
+            counts["batches_added"] = counts.get("batches_added", 0) + 1
+        if ledger.n_points() == 0:
             print("No good public data found, abort...")
-            continue
-        
-        # Match public and RoW data to graph
-        print("Matching data to graph...")
-        matched_graph_edges_public = match_public_data_with_edges(public_df, graph_edges, graph_nodes, G)
-        matched_graph_edges_row = match_row_data_with_edges(row_df, graph_edges, graph_nodes, G)
-        
-        # Save temp analysis
-        #save_undirected_graph(graph_nodes, matched_graph_edges_public, f"{out_fn}_public_{i}.graphml")
-        #save_undirected_graph(graph_nodes, matched_graph_edges_row,    f"{out_fn}_row_{i}.graphml")
-        
-        # Join these two graph edge dataframes
-        print("Joining public and RoW data")
-        public_row_df = join_public_row_edges(matched_graph_edges_public, matched_graph_edges_row, graph_nodes, edge_dtypes=graph_edges.dtypes.to_dict())
-        
-        R = public_row_df["row"] == True
-        P = public_row_df["activity"] > 0
-        
-        G_P = save_undirected_graph(graph_nodes, public_row_df[P & ~R], f"{out_fn}_P_{i}.graphml", ret=True, save=True)
-        G_B = save_undirected_graph(graph_nodes, public_row_df[P &  R], f"{out_fn}_B_{i}.graphml", ret=True, save=True)
-        G_R = save_undirected_graph(graph_nodes, public_row_df[~P & R], f"{out_fn}_R_{i}.graphml", ret=True, save=True)
-        
-        all_G_P += [G_P]
-        all_G_B += [G_B]
-        all_G_R += [G_R]
-        
-        print("Done")
-    
-    ox.save_graphml(nx.compose_all(all_G_P), f"{out_fn}_P.graphml")
-    ox.save_graphml(nx.compose_all(all_G_B), f"{out_fn}_B.graphml")
-    ox.save_graphml(nx.compose_all(all_G_R), f"{out_fn}_R.graphml")
+            return finish(False)
 
-    print("All done.")
+        # Match RoW data unless its edges are in ledger
+        row_edges = ledger.row_edges(keys["row"])
+        if row_edges is None:
+            matcher = EdgeMatcher.load_or_build(graph_edges, f"{graph_data}_{i}") if matcher is None else matcher
+            row_edges = match_row_data_with_edges(take_points(row_columns, row_idx), graph_edges, graph_nodes, G, matcher=matcher).index
+            ledger.set_row_edges(keys["row"], row_edges)
+        matched_graph_edges_row = graph_edges.loc[graph_edges.index.isin(row_edges)].assign(row=True)
+
+        # Derive public edges from ledger, as match_public_data_with_edges from all batches' points
+        edge_counts, edge_tracks = ledger.edge_activity(graph_edges)
+        has = edge_counts > 0
+        matched_graph_edges_public = threshold_public_edges(graph_edges.loc[has].assign(count=edge_counts[has], tracks=edge_tracks[has], segments=edge_tracks[has]), graph_nodes)
+
+        public_row_df = join_public_row_edges(matched_graph_edges_public, matched_graph_edges_row, edge_dtypes=graph_edges.dtypes.to_dict())
+        write_quadrat_outputs(i, graph_nodes, public_row_df, out_fn)
+        return finish(True)
+
+def update_batch(row_data="", public_data="", graph_data="", graph_boundary=None, out_fn="", workers: int = 1, skip: list = None, interpolated: bool = False) -> None:
+    """Perform analysis as analyse_batch, but incrementally over batches of public data, e.g. successive dumps or
+    other sources. Each subregion keeps an activity ledger of the batches added to it (see update_quadrat), so when
+    a new batch is given, only its points are read, interpolated and matched, and outputs are derived from the
+    updated ledgers. A batch whose data changed is replaced, and a batch no longer given is removed. Outputs are
+    the same as analyse_batch with all batches loaded together. Use a different output filename prefix than for
+    analyse_batch, as their caches of subregion outputs are separate.
+
+    Args:
+        row_data (str, optional): Filename prefix of RoW data point store (or legacy csv), or list of prefixes. Defaults to "".
+        public_data (str, optional): Filename prefix of public GPS data point store (or legacy csv), or list of
+            prefixes of batches. Defaults to "".
+        graph_data (str, optional): Filename prefix of graph of OSM path network. Defaults to "".
+        graph_boundary (list, optional): list of subregion geometries, or dict of indices to geometries, as analyse_batch. Defaults to None.
+        out_fn (str, optional): Filename prefix of output data. Defaults to "".
+        workers (int, optional): Number of processes to update subregions. If 1, update in this process. Defaults to 1.
+        skip (list, optional): indices of subregions not to analyse, e.g. from prune_quadrats. Defaults to None.
+        interpolated (bool, optional): whether public data batches are already interpolated. Defaults to False.
+    """
 
-        
-        
-        
\ No newline at end of file
+    # Key ledgers of subregions, and skip subregions whose outputs were derived from the same batches
+    batch_keys = {name: data_key(name) for name in (public_data if isinstance(public_data, (list, tuple)) else [public_data])}
+    row_key = data_key(row_data)
+    skip = set() if skip is None else set(skip)
+    keys = {i: ledger_keys(i, geom, row_key, graph_data, interpolated) for i, geom in boundary_items(graph_boundary) if i not in skip}
+    update_key = cache.stage_key("update", inputs={str(i): quadrat_update_key(k, batch_keys) for i, k in keys.items()})
+    if cache.is_fresh(out_fn, update_key, check_analysis_exists(out_fn)):
+        print(f"Analysis found at {out_fn}")
+        return
+
+    def fresh(i):
+        manifest = cache.read_manifest(quadrat_cache_fn(out_fn, i, "update"))
+        return manifest is not None and manifest["key"] == quadrat_update_key(keys[i], batch_keys) and (not manifest["written"] or quadrat_analysis_exists(out_fn, i))
+    todo = [i for i in keys if not fresh(i)]
+
+    # Record subregions where new batches have no points from tile counts of point stores, before reading any points
+    todo = [i for i in todo if record_unchanged_quadrat(i, {name: point_store.count_points(name, graph_boundary[i]) for name in batch_keys}, out_fn, keys[i], batch_keys) is None]
+
+    # Read only batches missing from the ledgers of subregions to update, and RoW data of subregions whose ledger
+    # has no RoW edges matched from it, in tiles intersecting those subregions
+    print("Reading new public data and row data")
+    ledgers = {i: ActivityLedger(quadrat_cache_fn(out_fn, i, "ledger"), keys[i]["ledger"]) for i in todo}
+    missing = {name: [i for i in todo if not ledgers[i].has_batch(name, batch_keys[name])] for name in batch_keys}
+    missing = {name: quadrats for name, quadrats in missing.items() if len(quadrats) > 0}
+    row_todo = [i for i in todo if ledgers[i].row != keys[i]["row"]]
+    del ledgers
+
+    def read_points(data, quadrats: list) -> tuple:
+        """Read points of data in tiles intersecting subregions, and index points inside each subregion"""
+        if len(quadrats) == 0:
+            return pd.DataFrame({"latitude": [], "longitude": []}), {}
+        boundary = unary_union([graph_boundary[i] for i in quadrats])
+        df = point_store.load_points(data, geometry=boundary)
+        index = GridBucketIndex.from_df(df, bounds=boundary.bounds)
+        return df, {i: index.query(graph_boundary[i]) for i in quadrats}
+
+    with instrument.stage("read_points", output=out_fn) as counts:
+        public_dfs, public_idx = {}, {}
+        for name, quadrats in missing.items():
+            public_dfs[name], public_idx[name] = read_points(name, quadrats)
+        all_row_df, row_idx = read_points(row_data, row_todo)
+        counts.update(public_points=sum(len(df) for df in public_dfs.values()), row_points=len(all_row_df), quadrats=len(todo), batches=len(missing))
+    empty = np.zeros(0, dtype=np.int64)
+    tasks = [(i, {name: idx[i] for name, idx in public_idx.items() if i in idx}, row_idx.get(i, empty)) for i in todo]
+
+    if workers == 1:
+        public_columns = {name: {c: df[c].to_numpy() for c in df.columns} for name, df in public_dfs.items()}
+        row_columns = {c: all_row_df[c].to_numpy() for c in all_row_df.columns}
+    else:
+        # Share points with workers through memory-mapped files
+        shared_folder = f"{out_fn}_shared"
+        public_columns = {name: share_points(df, os.path.join(shared_folder, f"public{k}")) for k, (name, df) in enumerate(public_dfs.items())}
+        row_columns = share_points(all_row_df, os.path.join(shared_folder, "row"))
+        del public_dfs, all_row_df
+
+    args = [(i, [(name, public_columns[name], idx) for name, idx in public_idx.items()], row_columns, row_idx, graph_data, out_fn, keys[i], batch_keys, interpolated)
+            for i, public_idx, row_idx in tasks]
+    if workers == 1:
+        for a in tqdm(args):
+            update_quadrat(*a)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(update_quadrat, *a) for a in args]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                future.result()
+        shutil.rmtree(shared_folder)
+
+    # Finalise output graphs from parts of all subregions, without parts left by earlier runs for other subregions
+    for writer in output_writers(out_fn).values():
+        for i in writer.part_indices():
+            if i not in keys:
+                writer.remove_part(i)
+        writer.finalise()
+    cache.write_manifest(out_fn, "update", update_key, inputs={str(i): quadrat_update_key(k, batch_keys) for i, k in keys.items()})
+
+    print("All done.")
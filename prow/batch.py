@@ -0,0 +1,269 @@
+"""
+Module for running the analysis pipeline for batches of authorities with work shared between them. Authorities
+in the same region share one public GPS dataset, so it is downloaded, read and interpolated once for the region,
+and the interpolated points are then routed to the subregions of each authority. Alternatively, neighbouring 
+authorities share national tiles, which are downloaded and analysed once for all authorities intersecting them.
+Or work can be shared between several worker processes or machines through a work queue on a shared filesystem.
+"""
+import time
+
+from shapely.ops import unary_union
+
+from . import download_data, analysis
+from .utils.authority_names import reverse_search
+from .utils.utils import boundary_items
+from .utils.national_grid import TileIndex, tile_polygon
+from .utils.work_queue import WorkQueue, run_worker, QUEUE_LEASE_TIMEOUT
+
+def group_by_region(authorities: list) -> dict:
+    """Group authorities by region, keeping the order in which regions and authorities first appear
+
+    Args:
+        authorities (list): List of lists of format [authority_name, region]
+
+    Returns:
+        dict: region names to lists of authority names
+    """
+    regions = {}
+    for authority, region in authorities:
+        regions.setdefault(region, []).append(authority)
+    return regions
+
+def batch_prow_analyse_regions(authorities: list, fn_data_prefix="data", fn_out_prefix="output", workers: int = 1, osm_extract: str = None, partition: str = "grid", memory_mb: float = None) -> None:
+    """Run full analysis pipeline of PRoW vs public GPX data for given batch of authorities, as
+    batch_prow_analyse_authorities, but grouping authorities by region. For each region, public GPS data
+    is read and interpolated once within the subregions of all its authorities (see analysis.interpolate_public_data),
+    instead of once per authority, so tracks crossing authority borders are not interpolated again for each.
+    Outputs are the same 3 graphs per authority.
+
+    Args:
+        authorities (list): List of lists of format [authority_name, region], where authority names are from
+            those listed [here](https://www.rowmaps.com/datasets/) and regions from
+            [here](http://zverik.openstreetmap.ru/gps/files/extracts/europe/great_britain).
+        fn_data_prefix (str, optional): Folder for saving downloaded data to. Defaults to "data".
+        fn_out_prefix (str, optional): Folder for saving output graphs. Defaults to "output".
+        workers (int, optional): Number of worker processes for parallel stages. Defaults to 1.
+        osm_extract (str, optional): Local .osm.pbf or .osm extract to build graphs from instead of Overpass. Defaults to None.
+        partition (str, optional): "grid" or "quadtree" partitioning of authorities into subregions,
+            see download_data.get_graph_boundary. Defaults to "grid".
+        memory_mb (float, optional): Memory budget in MB for GPS points held at once during ingestion and analysis.
+            Subregions are analysed reading only their own points if those of a whole authority don't fit. Public data
+            of the region is still interpolated at once. Defaults to None.
+    """
+
+    for region, region_authorities in group_by_region(authorities).items():
+
+        fn_public = f"{fn_data_prefix}/public/{region}"
+        fn_interpolated = f"{fn_data_prefix}/public/{region}_interpolated"
+
+        print(f"Analysis for region '{region}' with {len(region_authorities)} authorities")
+
+        print("1. Download public GPS data")
+        download_data.download_public_gps_data(region, fn=fn_public, workers=workers, memory_mb=memory_mb)
+
+        # Prepare each authority's data, graph boundaries and graphs
+        jobs = []
+        for authority in region_authorities:
+
+            authority_code = reverse_search(authority.split(", ")[0])
+
+            fn_row    = f"{fn_data_prefix}/row/{authority_code}"
+            fn_graph  = f"{fn_data_prefix}/osmnx/{authority_code}" + ("" if partition == "grid" else f"_{partition}")
+            fn_out    = f"{fn_out_prefix}/{authority_code}"
+
+            print(f"Preparing authority '{authority}' code '{authority_code}'. Output to {fn_out}")
+
+            print("2. Download RoW data")
+            download_data.download_row_data(authority_code, fn=fn_row)
+
+            print("3. Get graph boundaries")
+            graph_boundary = download_data.get_graph_boundary(authority, partition=partition, public_data=fn_public, osm_extract=osm_extract, fn=fn_graph)
+
+            print("4. Prune graph boundaries without public data")
+            skip = analysis.prune_quadrats(public_data=fn_public, graph_boundary=graph_boundary, fn=fn_graph, memory_mb=memory_mb)
+            start = time.perf_counter()
+
+            print("5. Download graphs")
+            download_data.download_graphs(graph_boundary, fn=fn_graph, osm_extract=osm_extract, skip=skip)
+
+            jobs.append((fn_row, fn_graph, fn_out, graph_boundary, skip, time.perf_counter() - start))
+
+        print("6. Interpolate public data for all authorities in region")
+        region_boundary = unary_union([geom for _, _, _, graph_boundary, skip, _ in jobs for i, geom in boundary_items(graph_boundary) if i not in skip])
+        analysis.interpolate_public_data(public_data=fn_public, geometry=region_boundary, fn=fn_interpolated)
+
+        print("7. Perform analysis")
+        for fn_row, fn_graph, fn_out, graph_boundary, skip, elapsed in jobs:
+            print(f"Analysis output to {fn_out}")
+            start = time.perf_counter()
+            analysis.analyse_batch(row_data=fn_row, public_data=fn_interpolated, graph_data=fn_graph, graph_boundary=graph_boundary, out_fn=fn_out, workers=workers, skip=skip, interpolated=True, memory_mb=memory_mb)
+            analysis.report_pruning(len(skip), len(graph_boundary), elapsed + time.perf_counter() - start)
+
+def batch_prow_analyse_national(authorities: list, fn_data_prefix="data", fn_out_prefix="output", workers: int = 1, osm_extract: str = None, memory_mb: float = None) -> None:
+    """Run full analysis pipeline of PRoW vs public GPX data for given batch of authorities, as
+    batch_prow_analyse_authorities, but with fixed national tiles (see utils.national_grid) as the unit of work 
+    instead of squares cut from each authority's polygon. Each tile's graph is downloaded once, and tiles 
+    intersecting the same authorities are analysed together once, with the RoW data of all of those authorities
+    and the public data of their regions. So running neighbouring authorities together costs about the same as
+    running the union of their areas. Each authority's 3 output graphs are then assembled from its tiles,
+    clipped to its boundary (see analysis.assemble_outputs).
+
+    Args:
+        authorities (list): List of lists of format [authority_name, region], where authority names are from
+            those listed [here](https://www.rowmaps.com/datasets/) and regions from
+            [here](http://zverik.openstreetmap.ru/gps/files/extracts/europe/great_britain).
+        fn_data_prefix (str, optional): Folder for saving downloaded data to. Defaults to "data".
+        fn_out_prefix (str, optional): Folder for saving output graphs. Tile outputs are saved in its "national"
+            subfolder. Defaults to "output".
+        workers (int, optional): Number of worker processes for parallel stages. Defaults to 1.
+        osm_extract (str, optional): Local .osm.pbf or .osm extract to build graphs from instead of Overpass. Defaults to None.
+        memory_mb (float, optional): Memory budget in MB for GPS points held at once during ingestion and analysis.
+            Tiles are analysed reading only their own points if those of a whole group of tiles don't fit. Defaults to None.
+    """
+    fn_tiles = f"{fn_data_prefix}/osmnx/national"
+    names, regions, boundaries = {}, {}, {}
+
+    print("1. Download RoW and public GPS data")
+    for authority, region in authorities:
+        authority_code = reverse_search(authority.split(", ")[0])
+        names[authority_code], regions[authority_code] = authority, region
+        download_data.download_row_data(authority_code, fn=f"{fn_data_prefix}/row/{authority_code}")
+    for region in group_by_region(authorities):
+        download_data.download_public_gps_data(region, fn=f"{fn_data_prefix}/public/{region}", workers=workers, memory_mb=memory_mb)
+
+    print("2. Index national tiles of authorities")
+    for authority_code, authority in names.items():
+        boundaries[authority_code] = download_data.get_authority_boundary(authority, fn=f"{fn_data_prefix}/osmnx/{authority_code}")
+    index = TileIndex.from_boundaries(boundaries)
+    index.save(fn_tiles)
+    tiles = {t: tile_polygon(t, length=index.length) for t in index.tile_authorities}
+    groups = index.groups()
+    print(f"{len(tiles)} tiles in {len(groups)} groups of tiles intersecting the same authorities")
+
+    outputs = {}
+    for group, group_tiles in groups.items():
+
+        fn_out = f"{fn_out_prefix}/national/{'_'.join(group)}"
+        row_data = [f"{fn_data_prefix}/row/{authority_code}" for authority_code in group]
+        public_data = [f"{fn_data_prefix}/public/{region}" for region in dict.fromkeys(regions[authority_code] for authority_code in group)]
+        graph_boundary = {t: tiles[t] for t in group_tiles}
+
+        print(f"Analysis for {len(group_tiles)} tiles of authorities {', '.join(group)}. Output to {fn_out}")
+
+        print("3. Prune tiles without public data")
+        skip = analysis.prune_quadrats(public_data=public_data, graph_boundary=graph_boundary, fn=fn_out, memory_mb=memory_mb)
+        start = time.perf_counter()
+
+        print("4. Download graphs")
+        download_data.download_graphs(graph_boundary, fn=fn_tiles, osm_extract=osm_extract, skip=skip)
+
+        print("5. Perform analysis")
+        analysis.analyse_batch(row_data=row_data, public_data=public_data, graph_data=fn_tiles, graph_boundary=graph_boundary, out_fn=fn_out, workers=workers, skip=skip, memory_mb=memory_mb)
+        analysis.report_pruning(len(skip), len(graph_boundary), time.perf_counter() - start)
+        outputs.update({t: (fn_out, tiles[t]) for t in group_tiles})
+
+    print("6. Assemble outputs of authorities from tiles")
+    for authority_code in names:
+        fn_out = f"{fn_out_prefix}/{authority_code}"
+        print(f"Output for authority '{names[authority_code]}' code '{authority_code}' to {fn_out}")
+        analysis.assemble_outputs({t: outputs[t] for t in index.tiles(authority_code)}, boundaries[authority_code], out_fn=fn_out)
+
+def enqueue_authorities(queue: WorkQueue, authorities: list, fn_data_prefix="data", fn_out_prefix="output", osm_extract: str = None, partition: str = "grid", memory_mb: float = None) -> None:
+    """Add tasks to prepare given authorities to work queue, after downloading public GPS data of their regions.
+    Preparing an authority adds a task for each of its subregions and a reducer task after all of them
+    (see queue_handler). Tasks already in the queue are not added again, so any worker can call this.
+
+    Args:
+        queue (WorkQueue): work queue
+        authorities (list): List of lists of format [authority_name, region], as batch_prow_analyse_authorities.
+        fn_data_prefix (str, optional): Folder for saving downloaded data to. Defaults to "data".
+        fn_out_prefix (str, optional): Folder for saving output graphs. Defaults to "output".
+        osm_extract (str, optional): Local .osm.pbf or .osm extract to build graphs from instead of Overpass. Defaults to None.
+        partition (str, optional): "grid" or "quadtree" partitioning of authorities into subregions. Defaults to "grid".
+        memory_mb (float, optional): Memory budget in MB for GPS points held at once by a task. Defaults to None.
+    """
+    params = {"fn_data_prefix": fn_data_prefix, "fn_out_prefix": fn_out_prefix, "osm_extract": osm_extract, "partition": partition, "memory_mb": memory_mb}
+    for region, region_authorities in group_by_region(authorities).items():
+        queue.add(f"public_{region}", {"stage": "public", "region": region, **params})
+        for authority in region_authorities:
+            authority_code = reverse_search(authority.split(", ")[0])
+            queue.add(f"prepare_{authority_code}", {"stage": "prepare", "authority": authority, "authority_code": authority_code, "region": region, **params}, 
+                      after=[f"public_{region}"])
+
+def queue_handler(lease) -> dict:
+    """Run one task of work queue filled by enqueue_authorities, depending on its stage:
+    1. "public": download public GPS data of region.
+    2. "prepare": download RoW data of authority, get and prune its graph boundaries, and add a "quadrat" task
+       for each subregion left and a "reduce" task after all of them.
+    3. "quadrat": download graph of one subregion and analyse it, writing its parts of the authority's outputs.
+    4. "reduce": finalise the authority's output graphs from the parts of all its subregions.
+    All stages are cached, so a task rerun after its worker crashed picks up where it stopped.
+
+    Args:
+        lease (Lease): lease of claimed task
+
+    Returns:
+        dict: json-serialisable result of task
+    """
+    p = lease.payload
+    fn_public = f"{p['fn_data_prefix']}/public/{p['region']}"
+    if p["stage"] == "public":
+        download_data.download_public_gps_data(p["region"], fn=fn_public, memory_mb=p.get("memory_mb"))
+        return {}
+
+    fn_row   = f"{p['fn_data_prefix']}/row/{p['authority_code']}"
+    fn_graph = f"{p['fn_data_prefix']}/osmnx/{p['authority_code']}" + ("" if p["partition"] == "grid" else f"_{p['partition']}")
+    fn_out   = f"{p['fn_out_prefix']}/{p['authority_code']}"
+    graph_boundary = download_data.get_graph_boundary(p["authority"], partition=p["partition"], public_data=fn_public, osm_extract=p["osm_extract"], fn=fn_graph)
+    skip = analysis.prune_quadrats(public_data=fn_public, graph_boundary=graph_boundary, fn=fn_graph, memory_mb=p.get("memory_mb"))
+
+    if p["stage"] == "prepare":
+        download_data.download_row_data(p["authority_code"], fn=fn_row)
+        quadrats = [i for i in range(len(graph_boundary)) if i not in skip]
+        for i in quadrats:
+            lease.queue.add(f"quadrat_{p['authority_code']}_{i}", {**p, "stage": "quadrat", "quadrat": i}, after=[lease.task_id])
+        lease.queue.add(f"reduce_{p['authority_code']}", {**p, "stage": "reduce"}, after=[f"quadrat_{p['authority_code']}_{i}" for i in quadrats])
+        return {"quadrats": len(quadrats), "pruned": len(skip)}
+
+    elif p["stage"] == "quadrat":
+        i = p["quadrat"]
+        download_data.download_graphs({i: graph_boundary[i]}, fn=fn_graph, osm_extract=p["osm_extract"])
+        analysis.analyse_batch(row_data=fn_row, public_data=fn_public, graph_data=fn_graph, graph_boundary={i: graph_boundary[i]}, out_fn=fn_out, finalise=False, memory_mb=p.get("memory_mb"))
+        return {}
+
+    elif p["stage"] == "reduce":
+        analysis.analyse_batch(row_data=fn_row, public_data=fn_public, graph_data=fn_graph, graph_boundary=graph_boundary, out_fn=fn_out, skip=skip, memory_mb=p.get("memory_mb"))
+        return {"out_fn": fn_out}
+
+    raise ValueError(f"Unknown stage {p['stage']} of task {lease.task_id}.")
+
+def batch_prow_analyse_queue(authorities: list, queue_dir: str, fn_data_prefix="data", fn_out_prefix="output", osm_extract: str = None, partition: str = "grid", lease_timeout: float = QUEUE_LEASE_TIMEOUT, memory_mb: float = None) -> int:
+    """Run full analysis pipeline of PRoW vs public GPX data for given batch of authorities, as 
+    batch_prow_analyse_authorities, as one of any number of workers sharing a work queue (see utils.work_queue).
+    Each (authority, subregion) is a task claimed by one worker at a time with a lease, renewed by heartbeats
+    while it runs, so tasks of workers that crash are claimed again by others once their leases expire. Each 
+    authority's outputs are finalised by a reducer task once all its subregions are done. Start the same call
+    on each machine, with queue, data and output folders on a filesystem shared by all of them. Outputs are the
+    same 3 graphs per authority.
+
+    Args:
+        authorities (list): List of lists of format [authority_name, region], where authority names are from
+            those listed [here](https://www.rowmaps.com/datasets/) and regions from
+            [here](http://zverik.openstreetmap.ru/gps/files/extracts/europe/great_britain).
+        queue_dir (str): Folder of work queue shared by all workers.
+        fn_data_prefix (str, optional): Folder for saving downloaded data to. Defaults to "data".
+        fn_out_prefix (str, optional): Folder for saving output graphs. Defaults to "output".
+        osm_extract (str, optional): Local .osm.pbf or .osm extract to build graphs from instead of Overpass. Defaults to None.
+        partition (str, optional): "grid" or "quadtree" partitioning of authorities into subregions, 
+            see download_data.get_graph_boundary. Defaults to "grid".
+        lease_timeout (float, optional): seconds without heartbeat after which a task is claimed again. Defaults to QUEUE_LEASE_TIMEOUT.
+        memory_mb (float, optional): Memory budget in MB for GPS points held at once by a task. Defaults to None.
+
+    Returns:
+        int: number of tasks done by this worker
+    """
+    queue = WorkQueue(queue_dir, lease_timeout=lease_timeout)
+    enqueue_authorities(queue, authorities, fn_data_prefix=fn_data_prefix, fn_out_prefix=fn_out_prefix, osm_extract=osm_extract, partition=partition, memory_mb=memory_mb)
+    n_done = run_worker(queue, queue_handler)
+    print(f"Worker done {n_done} tasks. Queue status: {queue.status()}")
+    return n_done
@@ -1,7 +1,7 @@
 """
 Module for functionality to download various datasets and save to local folder.
 """
-import os, requests
+import os, shutil, requests
 from pathlib import Path
 from tqdm import tqdm
 
@@ -10,61 +10,96 @@ import pandas as pd
 import osmnx as ox
 import networkx as nx
 import geopandas as gpd
+from shapely.ops import unary_union
 
 from .utils.utils import *
-from .utils import gpx_converter
+from .utils import gpx_converter, ingest, point_store, graph_store, cache, instrument
+from .utils.osm_extract import PathNetwork
+from .utils.partition import quadtree_partition
+from .utils.edge_index import EDGE_INDEX_EXT
 from .utils.interpolate import batch_geo_interpolate_df
 
-def download_public_gps_data(region: str, fn="") -> None:
-    """Download dataset of public GPS traces from an OSM planet dump. Convert to csv.
+def check_data_fresh(fn: str, stage: str, key: str, params: dict = None, inputs: dict = None) -> bool:
+    """Return whether downloaded data for filename prefix is up to date with key. Data downloaded before
+    manifests were recorded is assumed up to date and its manifest is recorded, to avoid downloading it again.
+    """
+    exists = point_store.store_exists(fn) or os.path.isfile(fn+".csv")
+    if exists and cache.read_manifest(fn) is None:
+        cache.write_manifest(fn, stage, key, params, inputs, adopted=True)
+    return cache.is_fresh(fn, key, exists)
+
+def download_public_gps_data(region: str, fn="", workers: int = 1, batch_size: int = ingest.GPX_BATCH_SIZE, archive_fn: str = None, extract: bool = False, memory_mb: float = None) -> None:
+    """Download dataset of public GPS traces from an OSM planet dump. Convert to point store.
     Do not perform interpolation here, save that for each smaller subregion.
-    TODO: delete unzipped folder after csv conversion to save space
+    By default, GPX files are streamed straight out of the .tar.xz archive so the dump is never
+    expanded on disk, and track ids follow archive order. Conversion runs in batches of GPX files, 
+    each written to its own parquet shard, optionally in parallel over several processes. 
+    Shards are then merged into the spatially partitioned point store one at a time, so peak memory
+    depends on the size of a batch, not of the region, and can be bounded with memory_mb.
     
     Args:
         region (str): Region name from [here](http://zverik.openstreetmap.ru/gps/files/extracts/europe/great_britain)
         fn (str, optional): Prefix for output data. Defaults to "".
+        workers (int, optional): Number of processes for GPX conversion. Defaults to 1.
+        batch_size (int, optional): Number of GPX files converted per batch. Defaults to ingest.GPX_BATCH_SIZE.
+        archive_fn (str, optional): Already-downloaded archive to convert offline. This archive is not deleted.
+            If None, download archive to fn+".tar.xz". Defaults to None.
+        extract (bool, optional): Extract archive to disk and convert from extracted files instead of streaming.
+            Defaults to False.
+        memory_mb (float, optional): Memory budget in MB for conversion, which cuts batches by size of their GPX
+            files as well as by number (see ingest.convert_gpx_to_shards). Doesn't change the output. Defaults to None.
     """
-    csv_fn = fn+".csv"
-    if os.path.isfile(csv_fn):
-        print(f"Public GPS data found at {csv_fn}")
+    store_fn = fn+point_store.POINT_STORE_EXT
+    params = {"region": region}
+    inputs = {"archive": cache.file_key(archive_fn) if archive_fn is not None else None}
+    key = cache.stage_key("public", params, inputs)
+    if check_data_fresh(fn, "public", key, params, inputs):
+        print(f"Public GPS data found at {fn}")
         return
     
-    print(f"Downloading to {csv_fn}...")
-    os.system("echo Starting download...")
-    os.system(f"curl -o {fn}.tar.xz http://zverik.openstreetmap.ru/gps/files/extracts/europe/great_britain/{region}.tar.xz")
-    os.system("echo Unzipping...")
-    os.system(f"tar -xvf {fn}.tar.xz -C {os.path.dirname(fn)}") #TODO: unzip to given folder name so that we can list paths of correct folder
-    os.system("echo Deleting archive")
-    os.system(f"rm {fn}.tar.xz")
+    print(f"Downloading to {store_fn}...")
+    if archive_fn is None:
+        archive_fn = fn+".tar.xz"
+        delete_archive = True
+        os.system("echo Starting download...")
+        os.system(f"curl -o {archive_fn} http://zverik.openstreetmap.ru/gps/files/extracts/europe/great_britain/{region}.tar.xz")
+    else:
+        delete_archive = False
+
+    if extract:
+        os.system("echo Unzipping...")
+        os.system(f"tar -xvf {archive_fn} -C {os.path.dirname(fn)}") #TODO: unzip to given folder name so that we can list paths of correct folder
+        gps_sources = list(Path("data/public/gpx-planet-2013-04-09").rglob("*.gpx")) #TODO: see above TODO
+    else:
+        gps_sources = ingest.iter_gpx_archive(archive_fn)
     
     print("Converting...")
-    all_gps_paths = list(Path("data/public/gpx-planet-2013-04-09").rglob("*.gpx")) #TODO: see above TODO
-    
-    frames = []
-    for idx,gps_path in tqdm(enumerate(all_gps_paths)):
-        df = gpx_converter.Converter(input_file=gps_path).gpx_to_dataframe(i=idx)
-        df = df[["latitude", "longitude", "trackid"]]
-        df = df.loc[(df[["latitude", "longitude"]] != 0).all(axis=1), :]
-        frames.append(df)
-        
-    all_gps_raw_df = pd.concat(frames, ignore_index=True)
-    all_gps_raw_df.to_csv(csv_fn, index=False)
+    shards = ingest.convert_gpx_to_shards(gps_sources, fn+"_shards", workers=workers, batch_size=batch_size, memory_mb=memory_mb)
+    point_store.write_point_store((pd.read_parquet(shard) for shard in shards), fn)
+    shutil.rmtree(fn+"_shards")
+
+    if delete_archive:
+        os.system("echo Deleting archive")
+        os.remove(archive_fn)
 
+    cache.write_manifest(fn, "public", key, params, inputs)
     print("Done")
 
 def download_row_data(authority_code: str, fn="") -> None:
-    """Download RoW dataset to local folder. Convert to CSV. Interpolate spatially along the edges.
+    """Download RoW dataset to local folder. Convert to point store. Interpolate spatially along the edges.
 
     Args:
         authority_code (str): two letter authority code for authorities supported [here](https://www.rowmaps.com/datasets) 
         fn (str, optional): Prefix for output data. Defaults to "".
     """
-    csv_fn = fn+".csv"
-    if os.path.isfile(csv_fn):
-        print(f"RoW data found at {csv_fn}")
+    store_fn = fn+point_store.POINT_STORE_EXT
+    params = {"authority_code": authority_code, "dist": INTERPOLATION_DIST_ROW_GPS, "min_points": THRESH_SPURIOUS_GPS_POINT_COUNT}
+    key = cache.stage_key("row", params)
+    if check_data_fresh(fn, "row", key, params):
+        print(f"RoW data found at {fn}")
         return
     
-    print(f"Downloading to {csv_fn}...")
+    print(f"Downloading to {store_fn}...")
     headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.12; rv:55.0) Gecko/20100101 Firefox/55.0',}
     #final_interpolated_row_dfs = []
     
@@ -88,23 +123,28 @@ def download_row_data(authority_code: str, fn="") -> None:
     print("Done")
     
     #pd.concat(final_interpolated_row_dfs, ignore_index=True).to_csv(csv_fn)
-    row_df.to_csv(csv_fn)
+    point_store.write_point_store([row_df], fn)
+    cache.write_manifest(fn, "row", key, params)
     
 
-def get_graph_boundary(authority: str) -> list:
-    """Get boundary of given authority name and split up into small square chunks.
-    Chunk size set by constant SPLIT_POLYGON_BOX_LENGTH. Setting smaller means 
-    map-matching will be quicker as there are less point to search per region.
+def get_authority_boundary(authority: str, fn: str = ""):
+    """Get boundary polygon of given authority name, buffered slightly.
 
     Args:
         authority (str): authority full name or list of authorities 
         from list [here](https://www.rowmaps.com/datasets)
+        fn (str, optional): Filename prefix to cache boundary at, reused until the authority changes. 
+        If "", don't cache. Defaults to "".
 
     Returns:
-        list: list of shapely.geometry.MultiPolygon geometries representing
-        smaller regions to analyse in authority
+        shapely.geometry.MultiPolygon: authority boundary
     """
-    
+    params = {"authority": authority}
+    key = cache.stage_key("authority", params)
+    authority_fn = f"{fn}_authority"
+    if fn != "" and cache.is_fresh(authority_fn, key, os.path.isfile(authority_fn+".parquet")):
+        return gpd.read_parquet(authority_fn+".parquet")["geometry"][0]
+
     authority = [authority]
     gdf = ox.geocode_to_gdf(authority, buffer_dist=10)#500
     
@@ -112,37 +152,121 @@ def get_graph_boundary(authority: str) -> list:
         geom = gdf["geometry"].unary_union
     else:
         geom = gdf["geometry"][0]
+
+    if fn != "":
+        os.makedirs(os.path.dirname(authority_fn) or ".", exist_ok=True)
+        gpd.GeoDataFrame({"geometry": [geom]}, crs=gdf.crs).to_parquet(authority_fn+".tmp.parquet")
+        os.replace(authority_fn+".tmp.parquet", authority_fn+".parquet")
+        cache.write_manifest(authority_fn, "authority", key, params)
+    return geom
+
+def get_graph_boundary(authority: str, partition: str = "grid", public_data: str = "", osm_extract: str = None, fn: str = "") -> list:
+    """Get boundary of given authority name and split up into small chunks. By default, chunks are squares
+    with size set by constant SPLIT_POLYGON_BOX_LENGTH. Setting smaller means map-matching will be quicker
+    as there are less point to search per region. Alternatively, split with a quadtree until each chunk
+    has at most QUADTREE_MAX_POINTS public GPS points (and QUADTREE_MAX_NODES path network nodes if 
+    an OSM extract is given), so that chunks take similar time and memory to analyse.
+
+    Args:
+        authority (str): authority full name or list of authorities 
+        from list [here](https://www.rowmaps.com/datasets)
+        partition (str, optional): "grid" for fixed squares or "quadtree" for density-adaptive squares. Defaults to "grid".
+        public_data (str, optional): Filename prefix of public GPS data, required for quadtree. Defaults to "".
+        osm_extract (str, optional): Filename of local OSM extract to balance path network size for quadtree. Defaults to None.
+        fn (str, optional): Filename prefix to cache boundary at, reused until parameters or inputs change. 
+        If "", don't cache. Defaults to "".
+
+    Returns:
+        list: list of shapely.geometry.MultiPolygon geometries representing
+        smaller regions to analyse in authority
+    """
+    if partition not in ["grid", "quadtree"]:
+        raise ValueError("partition must be 'grid' or 'quadtree'.")
+
+    params = {"authority": authority, "partition": partition, "length": SPLIT_POLYGON_BOX_LENGTH}
+    inputs = {}
+    if partition == "quadtree":
+        params.update(max_points=QUADTREE_MAX_POINTS, max_nodes=QUADTREE_MAX_NODES, min_length=QUADTREE_MIN_BOX_LENGTH, max_length=QUADTREE_MAX_BOX_LENGTH)
+        inputs = {"public": cache.output_key(public_data, public_data+point_store.POINT_STORE_EXT, public_data+".csv"),
+                  "extract": cache.file_key(osm_extract) if osm_extract is not None else None}
+    key = cache.stage_key("boundary", params, inputs)
+    boundary_fn = f"{fn}_boundary"
+    if fn != "" and cache.is_fresh(boundary_fn, key, os.path.isfile(boundary_fn+".parquet")):
+        return gpd.read_parquet(boundary_fn+".parquet")["geometry"].to_list()
     
-    split_geom = ox.utils_geo._quadrat_cut_geometry(geom, quadrat_width=metres_to_dist(SPLIT_POLYGON_BOX_LENGTH))
-    split_geom_gdf = gpd.GeoDataFrame({"geometry": split_geom}, crs=gdf.crs)
+    geom = get_authority_boundary(authority)
     
-    polygons = split_geom_gdf["geometry"].to_list()
+    if partition == "quadtree":
+        points = point_store.load_points(public_data, geometry=geom, columns=[])
+        network = PathNetwork.load_or_build(osm_extract) if osm_extract is not None else None
+        polygons = quadtree_partition(geom, points["latitude"].to_numpy(), points["longitude"].to_numpy(),
+                                      node_lats=network.lats if network is not None else None,
+                                      node_lons=network.lons if network is not None else None)
+    else:
+        split_geom = ox.utils_geo._quadrat_cut_geometry(geom, quadrat_width=metres_to_dist(SPLIT_POLYGON_BOX_LENGTH))
+        split_geom_gdf = gpd.GeoDataFrame({"geometry": list(split_geom.geoms)}, crs="EPSG:4326")
+        polygons = split_geom_gdf["geometry"].to_list()
+
+    if fn != "":
+        os.makedirs(os.path.dirname(boundary_fn) or ".", exist_ok=True)
+        gpd.GeoDataFrame({"geometry": polygons}, crs="EPSG:4326").to_parquet(boundary_fn+".tmp.parquet")
+        os.replace(boundary_fn+".tmp.parquet", boundary_fn+".parquet")
+        cache.write_manifest(boundary_fn, "boundary", key, params, inputs)
     return polygons
 
-def download_graphs(graph_boundary: list, fn="") -> None:
+def download_graphs(graph_boundary, fn="", osm_extract: str = None, skip: list = None) -> None:
     """Download all graphs from OSM for each region geometry in list of boundaries.
     Each graph contains the OSM way network with all OSM attributes within boundary.
     OSM highways included are footways, cycleways, bridleways, paths and tracks.
+    If a local OSM extract is given, graphs are cut from its path network instead of querying Overpass.
 
     Args:
         graph_boundary (list): List of shapely.geometry.MultiPolygon geometries
-        representing boundaries for graphs to download
+        representing boundaries for graphs to download, or dict of indices to geometries (e.g. national tiles)
         fn (str, optional): File prefix for graphs to download. Defaults to "".
+        osm_extract (str, optional): Filename of local .osm.pbf or .osm extract covering boundaries. 
+        Its path network is built once and saved next to it. Defaults to None.
+        skip (list, optional): indices of geometries not to download, e.g. from analysis.prune_quadrats. Defaults to None.
     """
     print("Downloading...")
 
-    for i,geom in tqdm(enumerate(graph_boundary)):
-        if os.path.isfile(f"{fn}_{i}.graphml"):
+    # Key each graph by its geometry and source, recording manifests for graphs downloaded before manifests were
+    params = {"filter": PATH_HIGHWAY_FILTER, "source": "overpass" if osm_extract is None else "extract"}
+    extract_key = cache.file_key(osm_extract) if osm_extract is not None else None
+    items = boundary_items(graph_boundary)
+    keys = {i: cache.stage_key("graph", params, {"geometry": cache.hash_key(geom.wkb_hex), "extract": extract_key}) for i, geom in items}
+    for i in keys:
+        if graph_store.graph_exists(f"{fn}_{i}") and cache.read_manifest(f"{fn}_{i}") is None:
+            cache.write_manifest(f"{fn}_{i}", "graph", keys[i], params, adopted=True)
+
+    skip = set() if skip is None else set(skip)
+    todo = [i for i in keys if i not in skip and not cache.is_fresh(f"{fn}_{i}", keys[i], graph_store.graph_exists(f"{fn}_{i}"))]
+    if osm_extract is not None and len(todo) > 0:
+        network = PathNetwork.load_or_build(osm_extract)
+        index = network.node_index(unary_union([geom for _, geom in items]).bounds)
+
+    for i,geom in tqdm(items):
+        if i in skip:
+            continue
+        if i not in todo:
             print(f"Graph found for {i}th geometry, continuing")
             continue
 
-        try:
-            G = ox.graph_from_polygon(geom,
-                           custom_filter='["highway"~"footway|cycleway|bridleway|path|track"]', 
-                           retain_all=True, simplify=False).to_undirected()
-        except ValueError:
-            G = nx.MultiGraph() #empty
-        
-        ox.save_graphml(G, f"{fn}_{i}.graphml")
+        with instrument.stage("download_graph", graph=fn, quadrat=i) as counts:
+            if osm_extract is not None:
+                G = network.graph_in_polygon(geom, index=index)
+            else:
+                try:
+                    G = ox.graph_from_polygon(geom,
+                                   custom_filter=f'["highway"~"{PATH_HIGHWAY_FILTER}"]', 
+                                   retain_all=True, simplify=False).to_undirected()
+                except ValueError:
+                    G = nx.MultiGraph() #empty
+            
+            graph_store.save_graph(G, f"{fn}_{i}")
+            counts.update(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+        if os.path.isfile(f"{fn}_{i}{EDGE_INDEX_EXT}"):
+            os.remove(f"{fn}_{i}{EDGE_INDEX_EXT}") # stale nearest-edge index of previous graph
+        cache.write_manifest(f"{fn}_{i}", "graph", keys[i], params, {"extract": extract_key})
 
     print("Done")
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""
+Stage manifests for caching pipeline outputs. Each stage output is recorded with a key hashing the stage name,
+its parameters and the keys of its inputs, so that an output is only reused if nothing upstream has changed.
+Keys of stage outputs are the input keys of downstream stages, so a change invalidates everything after it.
+External inputs without a manifest are keyed by file sizes and modification times.
+"""
+import os, json, hashlib
+from pathlib import Path
+
+MANIFEST_EXT = ".manifest.json" # suffix of stage manifest files, next to stage outputs
+
+def hash_key(*parts) -> str:
+    """Hash json-serialisable parts into a hex key"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+def file_key(path: str) -> str:
+    """Key of file or folder from sizes and modification times of its files, or None if it doesn't exist"""
+    path = Path(path)
+    if path.is_file():
+        stat = path.stat()
+        return hash_key(stat.st_size, stat.st_mtime_ns)
+    if path.is_dir():
+        return hash_key(sorted((str(f.relative_to(path)), f.stat().st_size, f.stat().st_mtime_ns) for f in path.rglob("*") if f.is_file()))
+    return None
+
+def read_manifest(fn: str) -> dict:
+    """Read manifest of stage output with filename prefix, or None if it doesn't exist"""
+    if not os.path.isfile(fn + MANIFEST_EXT):
+        return None
+    with open(fn + MANIFEST_EXT) as f:
+        return json.load(f)
+
+def output_key(fn: str, *paths) -> str:
+    """Key of data with filename prefix as an input to later stages: key in its manifest if it was written by a stage,
+    otherwise key of the first of paths that exists, or None.
+    """
+    manifest = read_manifest(fn)
+    if manifest is not None:
+        return manifest["key"]
+    for path in paths:
+        key = file_key(path)
+        if key is not None:
+            return key
+    return None
+
+def stage_key(stage: str, params: dict = None, inputs: dict = None) -> str:
+    """Key of stage output from stage name, parameters and keys of inputs"""
+    return hash_key(stage, params or {}, inputs or {})
+
+def is_fresh(fn: str, key: str, exists: bool = True) -> bool:
+    """Return whether stage output with filename prefix exists and was written with key"""
+    manifest = read_manifest(fn)
+    return exists and manifest is not None and manifest["key"] == key
+
+def write_manifest(fn: str, stage: str, key: str, params: dict = None, inputs: dict = None, **info) -> None:
+    """Record stage output with filename prefix, after the output itself is complete. Manifest is
+    written to a temporary file and renamed, so that it is never read incomplete.
+
+    Args:
+        fn (str): filename prefix of stage output
+        stage (str): stage name
+        key (str): stage key, from stage_key(stage, params, inputs)
+        params (dict, optional): parameters, recorded for inspection. Defaults to None.
+        inputs (dict, optional): input keys, recorded for inspection. Defaults to None.
+        info: other json-serialisable values to record
+    """
+    os.makedirs(os.path.dirname(fn) or ".", exist_ok=True)
+    with open(fn + MANIFEST_EXT + ".tmp", "w") as f:
+        json.dump({"stage": stage, "key": key, "params": params or {}, "inputs": inputs or {}, **info}, f, indent=1, default=str)
+    os.replace(fn + MANIFEST_EXT + ".tmp", fn + MANIFEST_EXT)
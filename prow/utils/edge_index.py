@@ -0,0 +1,159 @@
+"""
+Reusable nearest-edge index for map-matching points to graph edges, which can be saved
+next to the graph it was built from.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from scipy.spatial import cKDTree
+
+from . import utils
+from .interpolate import resample_segments
+
+EDGE_INDEX_EXT = ".edgeindex.npz" # suffix of saved edge index files
+EDGE_QUERY_BATCH_SIZE = 1000000 # max number of points per nearest-edge query
+
+class EdgeMatcher(object):
+    """Nearest-edge index over points interpolated along edge geometries, as ox.nearest_edges
+    with `interpolate`. Points are projected to local equirectangular metres around the index centre
+    so that distances are returned in metres, with a k-d tree for queries. Build once per graph
+    and use for all map-matching on that graph.
+    """
+
+    def __init__(self, u: np.ndarray, v: np.ndarray, key: np.ndarray, x: np.ndarray, y: np.ndarray, vertex_edge: np.ndarray, interpolate: float):
+        """
+        Args:
+            u (np.ndarray): start node of each edge
+            v (np.ndarray): end node of each edge
+            key (np.ndarray): key of each edge
+            x (np.ndarray): longitude of each interpolated vertex
+            y (np.ndarray): latitude of each interpolated vertex
+            vertex_edge (np.ndarray): position of edge of each interpolated vertex
+            interpolate (float): distance between interpolated vertices in degrees
+        """
+        self.u, self.v, self.key = u, v, key
+        self.x, self.y = x, y
+        self.vertex_edge = vertex_edge
+        self.interpolate = interpolate
+        self.edge_index = pd.MultiIndex.from_arrays([u, v, key], names=["u", "v", "key"])
+
+        self.lon0 = float(np.mean(x)) if len(x) > 0 else 0.
+        self.lat0 = float(np.mean(y)) if len(y) > 0 else 0.
+        self.tree = cKDTree(self._project(x, y))
+        self.last_dedup_ratio = 1.
+
+    def _project(self, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+        """Project lat/lons to local equirectangular coordinates in metres"""
+        return np.stack([(np.asarray(lons) - self.lon0) * np.cos(np.deg2rad(self.lat0)) * utils.EARTH_CONST,
+                         (np.asarray(lats) - self.lat0) * utils.EARTH_CONST], axis=1)
+
+    @classmethod
+    def from_edges(cls, graph_edges: gpd.GeoDataFrame, interpolate: float = utils.metres_to_dist(utils.INTERPOLATION_DIST_NEAREST_EDGE)):
+        """Build index from graph edges
+
+        Args:
+            graph_edges (gpd.GeoDataFrame): gdf of graph edges indexed by (u, v, key) with geometry column
+            interpolate (float, optional): distance between interpolated vertices in degrees.
+                Defaults to INTERPOLATION_DIST_NEAREST_EDGE in degrees.
+
+        Returns:
+            EdgeMatcher: index
+        """
+        geoms = graph_edges["geometry"].values
+        coords = shapely.get_coordinates(geoms)
+        x, y, vertex_edge = resample_segments(coords[:, 0], coords[:, 1], shapely.get_num_coordinates(geoms), interpolate)
+
+        u, v, key = [graph_edges.index.get_level_values(level).to_numpy() for level in ["u", "v", "key"]]
+        return cls(u, v, key, x, y, vertex_edge, interpolate)
+
+    def save(self, fn: str) -> None:
+        """Save index to fn + EDGE_INDEX_EXT, through a temporary file"""
+        np.savez(fn + ".tmp" + EDGE_INDEX_EXT, u=self.u, v=self.v, key=self.key, x=self.x, y=self.y,
+                 vertex_edge=self.vertex_edge, interpolate=self.interpolate)
+        os.replace(fn + ".tmp" + EDGE_INDEX_EXT, fn + EDGE_INDEX_EXT)
+
+    @classmethod
+    def load(cls, fn: str):
+        """Load index saved at fn + EDGE_INDEX_EXT"""
+        with np.load(fn + EDGE_INDEX_EXT) as f:
+            return cls(f["u"], f["v"], f["key"], f["x"], f["y"], f["vertex_edge"], float(f["interpolate"]))
+
+    @classmethod
+    def load_or_build(cls, graph_edges: gpd.GeoDataFrame, fn: str, interpolate: float = utils.metres_to_dist(utils.INTERPOLATION_DIST_NEAREST_EDGE)):
+        """Load index saved for graph if it exists and was built from the same edges and interpolation distance,
+        otherwise build it from graph edges and save it.
+
+        Args:
+            graph_edges (gpd.GeoDataFrame): gdf of graph edges indexed by (u, v, key) with geometry column
+            fn (str): filename prefix of saved index, e.g. same as graph filename prefix
+            interpolate (float, optional): distance between interpolated vertices in degrees.
+                Defaults to INTERPOLATION_DIST_NEAREST_EDGE in degrees.
+
+        Returns:
+            EdgeMatcher: index
+        """
+        if os.path.isfile(fn + EDGE_INDEX_EXT):
+            matcher = cls.load(fn)
+            if matcher.interpolate == interpolate and matcher.edge_index.equals(graph_edges.index):
+                return matcher
+
+        matcher = cls.from_edges(graph_edges, interpolate=interpolate)
+        matcher.save(fn)
+        return matcher
+
+    def query(self, X: np.ndarray, Y: np.ndarray, snap: float = None, batch_size: int = EDGE_QUERY_BATCH_SIZE) -> tuple:
+        """Find nearest edge of each point in batches. Optionally deduplicate queries by snapping points to a grid,
+        searching once per occupied grid cell from its centre and scattering the result back to its points. 
+        Distances are always from each original point to its matched edge vertex. The ratio of points
+        to searched cells is stored in last_dedup_ratio.
+
+        Args:
+            X (np.ndarray): point longitudes
+            Y (np.ndarray): point latitudes
+            snap (float, optional): grid size in metres to deduplicate points, should be well below
+                THRESH_EDGE_MATCH_DIST. If None, search every point. Defaults to None.
+            batch_size (int, optional): max number of points per tree query. Defaults to EDGE_QUERY_BATCH_SIZE.
+
+        Returns:
+            tuple: (positions of nearest edges in graph edges, distances in metres)
+        """
+        X, Y = np.asarray(X, dtype=np.float64), np.asarray(Y, dtype=np.float64)
+        pos = np.empty(len(X), dtype=np.int64)
+        dists = np.empty(len(X), dtype=np.float64)
+        n_queries = 0
+        for start in range(0, len(X), batch_size):
+            end = start + batch_size
+            points = self._project(X[start:end], Y[start:end])
+            if snap is None:
+                dists[start:end], vertex = self.tree.query(points, k=1)
+                n_queries += len(points)
+            else:
+                cells = np.floor(points / snap).astype(np.int64)
+                cells -= cells.min(axis=0)
+                cell_ids = cells[:, 0] * (cells[:, 1].max() + 1) + cells[:, 1]
+                unique_ids, first, inverse = np.unique(cell_ids, return_index=True, return_inverse=True)
+                _, unique_vertex = self.tree.query((np.floor(points[first] / snap) + 0.5) * snap, k=1)
+                vertex = unique_vertex[inverse]
+                dists[start:end] = np.hypot(*(points - self.tree.data[vertex]).T)
+                n_queries += len(unique_ids)
+            pos[start:end] = self.vertex_edge[vertex]
+
+        self.last_dedup_ratio = len(X) / max(n_queries, 1)
+        return pos, dists
+
+    def nearest_edges(self, X: np.ndarray, Y: np.ndarray, snap: float = None) -> tuple:
+        """Find nearest edge of each point, as ox.nearest_edges with return_dist=True
+
+        Args:
+            X (np.ndarray): point longitudes
+            Y (np.ndarray): point latitudes
+            snap (float, optional): grid size in metres to deduplicate points, see query. Defaults to None.
+
+        Returns:
+            tuple: (array of (u, v, key) nearest edges, distances in metres)
+        """
+        pos, dists = self.query(X, Y, snap=snap)
+        return self.edge_index[pos].to_numpy(), dists
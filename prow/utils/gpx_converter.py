@@ -8,6 +8,84 @@ import pandas as pd
 import numpy as np
 import glob
 import os
+import xml.etree.ElementTree as ET
+
+STREAM_CHUNK_SIZE = 8192 # number of points parsed before flushing into numpy buffers
+
+
+class _GrowableArray(object):
+    """preallocated numpy buffer which doubles its capacity when full"""
+
+    def __init__(self, dtype, capacity=STREAM_CHUNK_SIZE):
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._data.dtype)
+        new_size = self._size + len(values)
+        if new_size > len(self._data):
+            grown = np.empty(max(new_size, 2 * len(self._data)), dtype=self._data.dtype)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:new_size] = values
+        self._size = new_size
+
+    def to_numpy(self):
+        return self._data[:self._size]
+
+
+def _local_name(tag):
+    return tag.rpartition("}")[2]
+
+
+def gpx_stream_to_arrays(source, i=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    stream track points of a gpx file into numpy arrays without building gpxpy object trees
+    source: path or binary file-like object of the gpx file
+    i: track id given to all points. If None, use index of track in file
+    chunk_size: number of points parsed before flushing into numpy buffers
+    returns dict of arrays "trackid" (int64), "time" (datetime64[ns], UTC), "latitude", "longitude", "altitude" (float64)
+    """
+    buffers = {"trackid": _GrowableArray(np.int64), "time": _GrowableArray("datetime64[ns]"),
+               "latitude": _GrowableArray(np.float64), "longitude": _GrowableArray(np.float64),
+               "altitude": _GrowableArray(np.float64)}
+    chunk = {k: [] for k in buffers}
+
+    def flush():
+        chunk["time"] = pd.to_datetime(chunk["time"], utc=True, errors="coerce", format="ISO8601").tz_localize(None)
+        for k, buffer in buffers.items():
+            buffer.extend(chunk[k])
+            chunk[k] = []
+
+    t = -1
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        name = _local_name(elem.tag)
+        if event == "start":
+            if name == "trk":
+                t += 1
+            continue
+
+        if name == "trkpt":
+            ele, time = np.nan, None
+            for child in elem:
+                child_name = _local_name(child.tag)
+                if child_name == "ele" and child.text:
+                    ele = float(child.text)
+                elif child_name == "time" and child.text:
+                    time = child.text.strip()
+            chunk["trackid"].append(t if i is None else i)
+            chunk["time"].append(time)
+            chunk["latitude"].append(float(elem.attrib["lat"]))
+            chunk["longitude"].append(float(elem.attrib["lon"]))
+            chunk["altitude"].append(ele)
+            elem.clear()
+            if len(chunk["trackid"]) >= chunk_size:
+                flush()
+        elif name in ("trkseg", "trk", "wpt", "rte"):
+            elem.clear()
+    flush()
+
+    return {k: buffer.to_numpy() for k, buffer in buffers.items()}
 
 
 class Converter(object):
@@ -28,7 +106,13 @@ class Converter(object):
             self.input_extension = os.path.splitext(input_file)[1].lower()
             # print(self.extension)
 
-    def _gpx_to_dict(self, lats_colname="latitude", longs_colname="longitude", times_colname="time", alts_colname="altitude", trackno_colname="trackid", i=None):
+    def _gpx_to_dict(self, lats_colname="latitude", longs_colname="longitude", times_colname="time", alts_colname="altitude", trackno_colname="trackid", i=None, engine="gpxpy"):
+        if engine == "stream":
+            return self._gpx_stream_to_dict(lats_colname=lats_colname, longs_colname=longs_colname, times_colname=times_colname,
+                                            alts_colname=alts_colname, trackno_colname=trackno_colname, i=i)
+        elif engine != "gpxpy":
+            raise ValueError("engine must be 'gpxpy' or 'stream'.")
+
         longs, lats, times, alts, ts = [], [], [], [], []
 
         with open(self.input_file, 'r') as gpxfile:
@@ -50,16 +134,34 @@ class Converter(object):
         else:
             return {trackno_colname: ts, lats_colname: lats, longs_colname: longs}
 
-    def gpx_to_dictionary(self, latitude_key="latitude", longitude_key="longitude", time_key="time", altitude_key="altitude", trackno_key="trackid"):
-        return self._gpx_to_dict(lats_colname=latitude_key, longs_colname=longitude_key, times_colname=time_key, alts_colname=altitude_key, trackno_colname=trackno_key)
-
-    def gpx_to_dataframe(self, lats_colname="latitude", longs_colname="longitude", times_colname="time", alts_colname="altitude", trackno_colname="trackid", i=None):
+    def _gpx_stream_to_dict(self, lats_colname="latitude", longs_colname="longitude", times_colname="time", alts_colname="altitude", trackno_colname="trackid", i=None):
+        arrays = gpx_stream_to_arrays(self.input_file, i=i)
+        times = pd.DatetimeIndex(arrays["time"]).tz_localize("UTC")
+        alts = arrays["altitude"]
+        has_times = bool(times.notna().any())
+        has_alts = bool(np.any(np.nan_to_num(alts) != 0))
+
+        out = {trackno_colname: arrays["trackid"]}
+        if has_times:
+            out[times_colname] = times
+        out[lats_colname] = arrays["latitude"]
+        out[longs_colname] = arrays["longitude"]
+        if has_alts:
+            out[alts_colname] = alts
+        return out
+
+    def gpx_to_dictionary(self, latitude_key="latitude", longitude_key="longitude", time_key="time", altitude_key="altitude", trackno_key="trackid", engine="gpxpy"):
+        return self._gpx_to_dict(lats_colname=latitude_key, longs_colname=longitude_key, times_colname=time_key, alts_colname=altitude_key, trackno_colname=trackno_key, engine=engine)
+
+    def gpx_to_dataframe(self, lats_colname="latitude", longs_colname="longitude", times_colname="time", alts_colname="altitude", trackno_colname="trackid", i=None, engine="gpxpy"):
         """
         convert gpx file to a pandas dataframe
         lats_colname: name of the latitudes column
         longs_colname: name of the longitudes column
         times_colname: name of the times column
         alts_colname: name of the altitude column
+        i: track id given to all points. If None, use index of track in file
+        engine: "gpxpy" to parse full gpxpy object tree, or "stream" to stream points straight into numpy arrays
         """
         if self.input_extension != ".gpx":
             raise TypeError(f"input file must be a GPX file")
@@ -72,7 +174,8 @@ class Converter(object):
                                                       times_colname=times_colname,
                                                       alts_colname=alts_colname,
                                                       trackno_colname=trackno_colname,
-                                                      i=i))
+                                                      i=i,
+                                                      engine=engine))
         return df
 
     def gpx_to_numpy_array(self):
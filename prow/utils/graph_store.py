@@ -0,0 +1,270 @@
+"""
+Binary storage backend for graphs, replacing GraphML. A graph is stored in a folder containing
+nodes as parquet, edges as GeoParquet with WKB geometry, and graph attributes as json.
+Functions take filename prefixes without extension, and load legacy .graphml files if no store exists.
+A partitioned store (see GraphOutputWriter) instead contains a folder of part stores, merged on load.
+"""
+import os, json, shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import networkx as nx
+import osmnx as ox
+
+GRAPH_FORMAT = "parquet" # format for saving graphs: "parquet" or "graphml"
+GRAPH_STORE_EXT = ".graph" # suffix of parquet graph store folder
+GRAPH_META = "graph.json" # graph attributes and column metadata filename in store folder
+GRAPH_PARTS = "parts" # folder of part graph stores in partitioned store folder
+
+def _read_meta(store_fn: str) -> dict:
+    with open(os.path.join(store_fn, GRAPH_META)) as f:
+        return json.load(f)
+
+def _is_partitioned(store_fn: str) -> bool:
+    return _read_meta(store_fn).get("partitioned", False)
+
+def graph_exists(fn: str) -> bool:
+    """Return whether graph exists for filename prefix, in either format"""
+    return os.path.isfile(os.path.join(fn + GRAPH_STORE_EXT, GRAPH_META)) or os.path.isfile(fn + ".graphml")
+
+def _sanitise_columns(df: pd.DataFrame) -> tuple:
+    """Make object columns storable in parquet: columns of lists or mixed types become json strings, so that
+    e.g. booleans aren't loaded back as strings. Values json can't encode are stored as strings.
+
+    Returns:
+        tuple: (sanitised df, list of json-encoded column names)
+    """
+    df = df.copy()
+    json_columns = []
+    for c in df.columns:
+        if df[c].dtype != object or c == "geometry":
+            continue
+        values = df[c].where(df[c].notna(), None)
+        types = set(type(v) for v in values if v is not None)
+        if list in types or len(types) > 1:
+            df[c] = [json.dumps(v, default=str) if v is not None else None for v in values]
+            json_columns.append(c)
+        else:
+            df[c] = values
+    return df, json_columns
+
+def _json_attrs(attrs: dict) -> dict:
+    """Make graph attributes storable in json metadata, keeping json types and storing other values as strings"""
+    return json.loads(json.dumps(attrs, default=str))
+
+def _restore_columns(df: pd.DataFrame, json_columns: list) -> pd.DataFrame:
+    for c in json_columns:
+        df[c] = [json.loads(v) if v is not None else None for v in df[c]]
+    return df
+
+def save_graph(G: nx.MultiGraph, fn: str, graph_format: str = None) -> None:
+    """Save graph to filename prefix. Graph is written to a temporary file or folder and renamed,
+    so that the graph on disk is always complete.
+
+    Args:
+        G (nx.MultiGraph): graph to save
+        fn (str): filename prefix
+        graph_format (str, optional): "parquet" or "graphml". If None, use GRAPH_FORMAT. Defaults to None.
+    """
+    graph_format = GRAPH_FORMAT if graph_format is None else graph_format
+    if graph_format == "graphml":
+        ox.save_graphml(G, fn + ".graphml.tmp")
+        os.replace(fn + ".graphml.tmp", fn + ".graphml")
+        return
+    elif graph_format != "parquet":
+        raise ValueError("graph_format must be 'parquet' or 'graphml'.")
+
+    store_fn = fn + GRAPH_STORE_EXT
+    tmp_fn = store_fn + ".tmp"
+    if os.path.isdir(tmp_fn):
+        shutil.rmtree(tmp_fn)
+    os.makedirs(tmp_fn)
+
+    nodes = pd.DataFrame.from_dict(dict(G.nodes(data=True)), orient="index")
+    nodes.index.name = "osmid"
+    nodes, node_json_columns = _sanitise_columns(nodes)
+    nodes.to_parquet(os.path.join(tmp_fn, "nodes.parquet"))
+
+    edge_json_columns = []
+    if G.number_of_edges() > 0:
+        edges = ox.graph_to_gdfs(G, nodes=False, edges=True)
+        edges, edge_json_columns = _sanitise_columns(edges)
+        edges.to_parquet(os.path.join(tmp_fn, "edges.parquet"))
+
+    meta = {"graph": _json_attrs(G.graph),
+            "directed": G.is_directed(),
+            "node_json_columns": node_json_columns,
+            "edge_json_columns": edge_json_columns}
+    with open(os.path.join(tmp_fn, GRAPH_META), "w") as f:
+        json.dump(meta, f)
+
+    if os.path.isdir(store_fn):
+        shutil.rmtree(store_fn)
+    os.replace(tmp_fn, store_fn)
+
+def _read_frames(store_fn: str, edge_dtypes: dict = None) -> tuple:
+    """Read nodes dataframe, edges geodataframe (None if graph has no edges) and metadata from store folder"""
+    meta = _read_meta(store_fn)
+    nodes = _restore_columns(pd.read_parquet(os.path.join(store_fn, "nodes.parquet")), meta["node_json_columns"])
+    edges = None
+    if os.path.isfile(os.path.join(store_fn, "edges.parquet")):
+        edges = _restore_columns(gpd.read_parquet(os.path.join(store_fn, "edges.parquet")), meta["edge_json_columns"])
+        if edge_dtypes is not None:
+            edges = edges.astype({c: t for c, t in edge_dtypes.items() if c in edges.columns})
+    return nodes, edges, meta
+
+def _read_parts(store_fn: str, edge_dtypes: dict = None) -> tuple:
+    """Read and concatenate nodes and edges of all parts in a partitioned store. Nodes shared between parts
+    are deduplicated by id and edges by undirected (u, v, key), keeping the last part's attributes as nx.compose_all does.
+    """
+    all_nodes, all_edges = [], []
+    for part_fn in sorted(Path(store_fn, GRAPH_PARTS).glob("*" + GRAPH_STORE_EXT)):
+        nodes, edges, _ = _read_frames(str(part_fn), edge_dtypes=edge_dtypes)
+        all_nodes.append(nodes)
+        if edges is not None: all_edges.append(edges)
+
+    nodes = pd.concat(all_nodes) if len(all_nodes) > 0 else pd.DataFrame()
+    nodes = nodes[~nodes.index.duplicated(keep="last")]
+    if len(all_edges) == 0:
+        return nodes, None
+
+    edges = pd.concat(all_edges)
+    u, v, key = (edges.index.get_level_values(l).to_numpy() for l in range(3))
+    undirected = pd.MultiIndex.from_arrays([np.minimum(u, v), np.maximum(u, v), key])
+    return nodes, edges[~undirected.duplicated(keep="last")]
+
+def load_graph(fn: str, edge_dtypes: dict = None) -> nx.MultiGraph:
+    """Load graph from filename prefix, from parquet store if it exists, otherwise from .graphml.
+
+    Args:
+        fn (str): filename prefix
+        edge_dtypes (dict, optional): dtypes to convert edge attributes to, as in ox.load_graphml. Defaults to None.
+
+    Returns:
+        nx.MultiGraph: loaded graph, undirected if saved undirected
+    """
+    store_fn = fn + GRAPH_STORE_EXT
+    if not os.path.isfile(os.path.join(store_fn, GRAPH_META)):
+        return ox.load_graphml(fn + ".graphml", edge_dtypes=edge_dtypes)
+
+    if _is_partitioned(store_fn):
+        nodes, edges = _read_parts(store_fn, edge_dtypes=edge_dtypes)
+        meta = _read_meta(store_fn)
+    else:
+        nodes, edges, meta = _read_frames(store_fn, edge_dtypes=edge_dtypes)
+
+    return _build_graph(nodes, edges, meta["graph"], meta["directed"])
+
+def _build_graph(nodes: pd.DataFrame, edges: gpd.GeoDataFrame, graph_attrs: dict, directed: bool) -> nx.MultiGraph:
+    """Build graph from nodes and edges (None if graph has no edges) as ox.graph_from_gdfs, leaving out null
+    attributes. An undirected graph is built directly, with nodes and edges in the same order as
+    ox.graph_from_gdfs(...).to_undirected(), without its deep copy of every edge's attributes and geometry.
+    """
+    G = nx.MultiDiGraph(**graph_attrs) if directed else nx.MultiGraph(**graph_attrs)
+    if edges is not None and len(edges) > 0:
+        index = edges.index.to_list()
+        order = np.arange(len(edges))
+        if not directed:
+            # to_undirected adds nodes in the order they first appear in edges, then edges grouped by first node
+            codes, uniques = pd.factorize(np.column_stack([edges.index.get_level_values(l).to_numpy() for l in range(2)]).ravel())
+            G.add_nodes_from(uniques.tolist())
+            order = np.argsort(codes[0::2], kind="stable")
+        names, values, present = edges.columns.to_list(), edges.to_numpy(), edges.notna().to_numpy()
+        G.add_edges_from((*index[j], {c: x for c, x, ok in zip(names, values[j], present[j]) if ok}) for j in order)
+    G.add_nodes_from(set(nodes.index) - set(G.nodes))
+    for c in nodes.columns:
+        nx.set_node_attributes(G, values=nodes[c].dropna().to_dict(), name=c)
+    return G
+
+class GraphOutputWriter:
+    """Partitioned graph store written one part at a time, so that analysis outputs of each subregion are
+    appended to the authority's graph as soon as they are finished, without holding earlier subregions in memory.
+    Parts are ordinary graph stores in the store's parts folder, written atomically, so that separate processes
+    can write different parts and an interrupted run can resume from the parts already on disk. The graph
+    only exists (see graph_exists) once finalise is called. Loading deduplicates nodes and edges shared between parts.
+    """
+    def __init__(self, fn: str):
+        """
+        Args:
+            fn (str): filename prefix of output graph
+        """
+        self.fn = fn
+        self.store_fn = fn + GRAPH_STORE_EXT
+
+    def part_fn(self, i: int) -> str:
+        """Filename prefix of ith part"""
+        return os.path.join(self.store_fn, GRAPH_PARTS, f"{i:06d}")
+
+    def has_part(self, i: int) -> bool:
+        """Return whether ith part has been written"""
+        return graph_exists(self.part_fn(i))
+
+    def write(self, i: int, G: nx.MultiGraph) -> None:
+        """Write graph as ith part, replacing any existing ith part"""
+        os.makedirs(os.path.join(self.store_fn, GRAPH_PARTS), exist_ok=True)
+        save_graph(G, self.part_fn(i), graph_format="parquet")
+
+    def link_part(self, i: int, fn: str) -> None:
+        """Write graph store at filename prefix (e.g. a part of another output graph) as ith part, replacing any
+        existing ith part. Files are hard-linked rather than copied where the filesystem allows it."""
+        def link_or_copy(src, dst):
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+        part_fn = self.part_fn(i) + GRAPH_STORE_EXT
+        if os.path.isdir(part_fn + ".tmp"):
+            shutil.rmtree(part_fn + ".tmp")
+        shutil.copytree(fn + GRAPH_STORE_EXT, part_fn + ".tmp", copy_function=link_or_copy)
+        self.remove_part(i)
+        os.replace(part_fn + ".tmp", part_fn)
+
+    def part_indices(self) -> list:
+        """Return indices of parts written"""
+        return sorted(int(p.name[:-len(GRAPH_STORE_EXT)]) for p in Path(self.store_fn, GRAPH_PARTS).glob("*" + GRAPH_STORE_EXT))
+
+    def remove_part(self, i: int) -> None:
+        """Remove ith part if it exists"""
+        part_fn = self.part_fn(i) + GRAPH_STORE_EXT
+        if os.path.isdir(part_fn):
+            shutil.rmtree(part_fn)
+
+    def finalise(self, graph_attrs: dict = None, directed: bool = False) -> None:
+        """Mark graph complete by writing store metadata, so that it can be loaded with load_graph.
+
+        Args:
+            graph_attrs (dict, optional): graph attributes. If None, use those of the first part. Defaults to None.
+            directed (bool, optional): whether graph is directed. Defaults to False.
+        """
+        os.makedirs(os.path.join(self.store_fn, GRAPH_PARTS), exist_ok=True)
+        if graph_attrs is None:
+            parts = sorted(Path(self.store_fn, GRAPH_PARTS).glob("*" + GRAPH_STORE_EXT))
+            graph_attrs = _read_meta(str(parts[0]))["graph"] if len(parts) > 0 else {}
+        meta = {"graph": _json_attrs(graph_attrs),
+                "directed": directed,
+                "partitioned": True}
+        with open(os.path.join(self.store_fn, GRAPH_META + ".tmp"), "w") as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(self.store_fn, GRAPH_META + ".tmp"), os.path.join(self.store_fn, GRAPH_META))
+
+def convert_graphml_tree(folder: str, edge_dtypes: dict = None, delete: bool = False) -> list:
+    """One-off conversion of all .graphml files under folder to parquet graph stores.
+
+    Args:
+        folder (str): folder to search recursively
+        edge_dtypes (dict, optional): dtypes to convert edge attributes to when loading. Defaults to None.
+        delete (bool, optional): whether to delete .graphml files after conversion. Defaults to False.
+
+    Returns:
+        list: filename prefixes converted
+    """
+    converted = []
+    for path in sorted(Path(folder).rglob("*.graphml")):
+        fn = str(path)[:-len(".graphml")]
+        save_graph(ox.load_graphml(path, edge_dtypes=edge_dtypes), fn, graph_format="parquet")
+        if delete:
+            os.remove(path)
+        converted.append(fn)
+    return converted
@@ -0,0 +1,142 @@
+"""
+Functions to convert dumps of many GPX files into tabular point data, in parallel batches
+written to columnar shards on disk, optionally sized to fit a memory budget.
+"""
+import io, os, tarfile
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from tqdm import tqdm
+
+from .gpx_converter import Converter, gpx_stream_to_arrays
+
+GPX_BATCH_SIZE = 256 # number of GPX files converted per worker task
+GPX_MEMORY_FACTOR = 3 # estimated peak memory of converting a batch of GPX files relative to their size in bytes
+
+def convert_gpx_file(source, idx: int, engine="stream") -> pd.DataFrame:
+    """Convert one GPX file to points, giving all points the same track id and removing null points.
+
+    Args:
+        source: path to GPX file, or bytes of GPX file (e.g. an archive member) if using "stream" engine
+        idx (int): track id given to all points in file
+        engine (str, optional): Converter parsing engine. Defaults to "stream".
+
+    Returns:
+        pd.DataFrame: df with latitude, longitude and trackid columns
+    """
+    if isinstance(source, bytes):
+        if engine != "stream":
+            raise ValueError("GPX bytes can only be converted with the 'stream' engine.")
+        df = pd.DataFrame(gpx_stream_to_arrays(io.BytesIO(source), i=idx))
+    else:
+        df = Converter(input_file=source).gpx_to_dataframe(i=idx, engine=engine)
+    df = df[["latitude", "longitude", "trackid"]]
+    return df.loc[(df[["latitude", "longitude"]] != 0).all(axis=1), :]
+
+def batched(iterable, n: int):
+    """Yield successive lists of length n from iterable, the last possibly shorter."""
+    it = iter(iterable)
+    while batch := list(islice(it, n)):
+        yield batch
+
+def batched_by_size(iterable, n: int, max_bytes: int, size):
+    """Yield successive lists of at most n items from iterable, also ending a list before its total size would
+    exceed max_bytes. A single item larger than max_bytes is yielded in a list of its own.
+
+    Args:
+        iterable: items
+        n (int): max number of items per list
+        max_bytes (int): max total size of items per list
+        size: function returning size of an item in bytes
+    """
+    batch, batch_bytes = [], 0
+    for item in iterable:
+        item_bytes = size(item)
+        if len(batch) > 0 and (len(batch) == n or batch_bytes + item_bytes > max_bytes):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(item)
+        batch_bytes += item_bytes
+    if len(batch) > 0:
+        yield batch
+
+def gpx_size(item) -> int:
+    """Size in bytes of (track id, GPX path or bytes) pair"""
+    _, source = item
+    return len(source) if isinstance(source, bytes) else os.path.getsize(source)
+
+def convert_batch_to_shard(batch_idx: int, batch: list, shard_dir: str, engine="stream") -> str:
+    """Convert batch of GPX files and write their points to one parquet shard. The shard is written
+    to a temporary file first and renamed, so that a shard on disk is always complete.
+
+    Args:
+        batch_idx (int): index of batch, used to name shard
+        batch (list): list of (track id, GPX path or bytes) pairs
+        shard_dir (str): folder to write shard to
+        engine (str, optional): Converter parsing engine. Defaults to "stream".
+
+    Returns:
+        str: shard filename
+    """
+    frames = [convert_gpx_file(source, idx, engine=engine) for idx, source in batch]
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 0 else pd.DataFrame(columns=["latitude", "longitude", "trackid"])
+
+    fn = os.path.join(shard_dir, f"shard_{batch_idx:06d}.parquet")
+    df.to_parquet(fn + ".tmp", index=False)
+    os.replace(fn + ".tmp", fn)
+    return fn
+
+def iter_gpx_archive(archive_fn: str):
+    """Stream GPX members of a (compressed) tar archive in archive order, without extracting to disk.
+
+    Args:
+        archive_fn (str): path to archive, e.g. .tar.xz
+
+    Yields:
+        bytes: contents of each GPX member
+    """
+    with tarfile.open(archive_fn, mode="r|*") as tar:
+        for member in tar:
+            if member.isfile() and member.name.lower().endswith(".gpx"):
+                yield tar.extractfile(member).read()
+
+def convert_gpx_to_shards(sources, shard_dir: str, workers: int = 1, batch_size: int = GPX_BATCH_SIZE, engine="stream", memory_mb: float = None) -> list:
+    """Convert GPX files to parquet shards of points, in a process pool. Track ids are the index of each
+    file in sources, so output is identical whatever the number of workers. Sources are consumed lazily
+    with a bounded number of batches in flight, so they may be a stream of GPX bytes from an archive.
+
+    Args:
+        sources: iterable of GPX file paths or GPX bytes
+        shard_dir (str): folder to write shards to
+        workers (int, optional): number of worker processes. If 1, convert in this process. Defaults to 1.
+        batch_size (int, optional): number of files per shard. Defaults to GPX_BATCH_SIZE.
+        engine (str, optional): Converter parsing engine. Defaults to "stream".
+        memory_mb (float, optional): memory budget in MB for converting the batches in flight. If given, batches
+            are also cut by total size of their GPX files, so that large files don't make batches exceed it
+            (see GPX_MEMORY_FACTOR). Defaults to None.
+
+    Returns:
+        list: shard filenames, in track id order
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    if memory_mb is None:
+        batches = tqdm(enumerate(batched(enumerate(sources), batch_size)))
+    else:
+        in_flight = 1 if workers == 1 else 2 * workers
+        max_bytes = int(memory_mb * 1e6 / (GPX_MEMORY_FACTOR * in_flight))
+        batches = tqdm(enumerate(batched_by_size(enumerate(sources), batch_size, max_bytes, gpx_size)))
+
+    if workers == 1:
+        return [convert_batch_to_shard(b, batch, shard_dir, engine=engine) for b, batch in batches]
+
+    shards = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for b, batch in batches:
+            pending.append(executor.submit(convert_batch_to_shard, b, batch, shard_dir, engine))
+            if len(pending) >= 2 * workers:
+                shards.append(pending.popleft().result())
+        shards += [future.result() for future in pending]
+    return shards
@@ -0,0 +1,153 @@
+"""
+Lightweight instrumentation of named pipeline stages. Each stage records its wall time, CPU time, peak RSS
+and item counts (e.g. points in, points matched, edges out, tracks) as one JSON line, with the context of the
+stages it runs in (e.g. authority and quadrat), and can optionally be profiled with cProfile or pyinstrument.
+Instrumentation is configured through an environment variable, so that worker processes record to the same
+file, and when it is disabled a stage only costs an environment lookup.
+
+Example:
+    instrument.enable("output/stages.jsonl", profile_stages=["match"])
+    with instrument.stage("match", quadrat=i) as counts:
+        ...
+        counts["points_matched"] = n
+    instrument.summarise("output/stages.jsonl")
+"""
+import os, sys, json, time, resource, contextlib
+
+import pandas as pd
+
+INSTRUMENT_ENV = "PROW_INSTRUMENT" # environment variable of json instrumentation config, inherited by worker processes
+INSTRUMENT_PROFILERS = ["cprofile", "pyinstrument"]
+
+_context = [] # stack of (stage name, context) of stages running in this process
+_profiling = [False] # whether a stage in this process is being profiled, as profilers can't be nested
+_config_cache = {}
+
+def enable(fn: str, profiler: str = "cprofile", profile_stages: list = None) -> None:
+    """Enable instrumentation in this process and worker processes started after it
+
+    Args:
+        fn (str): JSON lines filename to append stage records to
+        profiler (str, optional): "cprofile" or "pyinstrument" profiler for profiled stages. Defaults to "cprofile".
+        profile_stages (list, optional): names of stages to profile. Profiles are saved in folder f"{fn}_profiles",
+            as .prof files for cProfile or .html files for pyinstrument. Defaults to None.
+    """
+    if profiler not in INSTRUMENT_PROFILERS:
+        raise ValueError(f"profiler must be one of {INSTRUMENT_PROFILERS}.")
+    if profiler == "pyinstrument" and profile_stages:
+        import pyinstrument # raise now if not installed, instead of in a stage
+    os.makedirs(os.path.dirname(fn) or ".", exist_ok=True)
+    os.environ[INSTRUMENT_ENV] = json.dumps({"fn": fn, "profiler": profiler, "profile_stages": list(profile_stages or [])})
+
+def disable() -> None:
+    """Disable instrumentation in this process and worker processes started after it"""
+    os.environ.pop(INSTRUMENT_ENV, None)
+
+def config() -> dict:
+    """Return instrumentation config, or None if disabled"""
+    env = os.environ.get(INSTRUMENT_ENV)
+    if not env:
+        return None
+    if env not in _config_cache:
+        _config_cache[env] = json.loads(env)
+    return _config_cache[env]
+
+def peak_rss_mb() -> float:
+    """Return peak resident set size of this process so far in MB"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 ** 2 if sys.platform == "darwin" else 1024) # bytes on macOS, KB on Linux
+
+def _json_default(o):
+    return o.item() if hasattr(o, "item") else str(o)
+
+def _start_profiler(name: str, cfg: dict):
+    if name not in cfg["profile_stages"] or _profiling[0]:
+        return None
+    if cfg["profiler"] == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    _profiling[0] = True
+    return profiler
+
+def _save_profile(profiler, name: str, context: dict, cfg: dict) -> None:
+    folder = cfg["fn"] + "_profiles"
+    os.makedirs(folder, exist_ok=True)
+    label = "_".join([name] + [f"{k}-{os.path.basename(str(v))}" for k, v in context.items()] + [str(os.getpid()), str(time.time_ns())])
+    if cfg["profiler"] == "pyinstrument":
+        profiler.stop()
+        with open(os.path.join(folder, label + ".html"), "w") as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(folder, label + ".prof"))
+    _profiling[0] = False
+
+@contextlib.contextmanager
+def stage(name: str, **context):
+    """Context manager recording a stage of the pipeline, if instrumentation is enabled. Yields a dict that
+    the block can fill with item counts, recorded with the stage. Records include the context of enclosing
+    stages, so that e.g. the quadrat of a stage in the authority of an enclosing stage is recorded with both.
+    Stages that raise are recorded with the error and the error is raised.
+
+    Args:
+        name (str): stage name
+        **context: json-serialisable values identifying what the stage runs on, e.g. authority or quadrat
+
+    Yields:
+        dict: item counts of stage
+    """
+    cfg = config()
+    if cfg is None:
+        yield {}
+        return
+
+    context = {**(_context[-1][1] if len(_context) > 0 else {}), **context}
+    record = {"stage": name, "parent": _context[-1][0] if len(_context) > 0 else None, **context}
+    counts, error = {}, None
+    _context.append((name, context))
+    profiler = _start_profiler(name, cfg)
+    rss_start = peak_rss_mb()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield counts
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record.update(wall=time.perf_counter() - wall_start, cpu=time.process_time() - cpu_start,
+                      peak_rss_mb=peak_rss_mb(), rss_growth_mb=peak_rss_mb() - rss_start, pid=os.getpid(), time=time.time(), counts=counts)
+        if error is not None:
+            record["error"] = error
+        if profiler is not None:
+            _save_profile(profiler, name, context, cfg)
+        _context.pop()
+        # A single write of one line in append mode, so that lines from concurrent processes don't interleave
+        with open(cfg["fn"], "a") as f:
+            f.write(json.dumps(record, default=_json_default) + "\n")
+
+def read_records(fn: str) -> pd.DataFrame:
+    """Read stage records from JSON lines file, one row per stage run, with item counts in "counts." columns"""
+    with open(fn) as f:
+        return pd.json_normalize([json.loads(line) for line in f if line.strip()])
+
+def summarise(fn: str, by: list = ["stage"]) -> pd.DataFrame:
+    """Summarise stage records, e.g. to find which stages of which authorities take longest
+
+    Args:
+        fn (str): JSON lines filename of records
+        by (list, optional): record fields to group by, e.g. ["authority", "stage"]. Defaults to ["stage"].
+
+    Returns:
+        pd.DataFrame: number of runs, total wall and CPU time, and max peak RSS per group, and totals of item
+        counts, sorted by total wall time
+    """
+    records = read_records(fn)
+    counts = [c for c in records.columns if c.startswith("counts.")]
+    summary = records.groupby(by, dropna=False).agg(runs=("wall", "size"), wall=("wall", "sum"), cpu=("cpu", "sum"),
+                                                    peak_rss_mb=("peak_rss_mb", "max"), **{c[len("counts."):]: (c, "sum") for c in counts})
+    return summary.sort_values("wall", ascending=False)
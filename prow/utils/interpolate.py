@@ -8,7 +8,7 @@ from tqdm import tqdm
 from shapely.geometry import LineString
 from haversine import haversine_vector
 
-from . import utils
+from . import utils, instrument
 
 def split_dirty_track(df: pd.DataFrame, dist_func="euclidean", thresh: float = utils.THRESH_INTERPOLATION_JUMP_DIST) -> list:
     """For a given track of points in input, split into multiple paths where there is
@@ -35,8 +35,8 @@ def split_dirty_track(df: pd.DataFrame, dist_func="euclidean", thresh: float = u
     else:
         raise ValueError("dist_func must be 'euclidean' or 'haversine'.")
     
-    split_indices = np.where(dists > thresh)[0]
-    return np.split(df, split_indices + 1)
+    split_indices = np.concatenate([[0], np.where(dists > thresh)[0] + 1, [len(df)]])
+    return [df.iloc[start:end] for start, end in zip(split_indices[:-1], split_indices[1:])]
     
 
 def geo_interpolate_df(df: pd.DataFrame, lat_colname="latitude", lon_colname="longitude", trackno_colname="trackid", dist_m: float = 20, track_points_thresh: float = utils.THRESH_SPURIOUS_GPS_POINT_COUNT, segmentation=True) -> pd.DataFrame:
@@ -82,7 +82,101 @@ def geo_interpolate_df(df: pd.DataFrame, lat_colname="latitude", lon_colname="lo
     ret_df[trackno_colname] = df[trackno_colname].iloc[0]
     return ret_df
 
-def batch_geo_interpolate_df(raw_df: pd.DataFrame, lat_colname="latitude", lon_colname="longitude", trackno_colname="trackid", dist_m: float = 20, segmentation=True) -> pd.DataFrame:
+def resample_segments(x: np.ndarray, y: np.ndarray, seg_lengths: np.ndarray, dist: float) -> tuple:
+    """Resample many polylines at once to evenly spaced points, as ox.utils_geo.interpolate_points does
+    for each LineString: each polyline of length L gets max(round(L / dist), 1) + 1 points evenly spaced
+    along its cumulative arc length, including both ends. Polylines are stored consecutively in flat arrays.
+
+    Args:
+        x (np.ndarray): flat array of first coordinate of all polyline vertices
+        y (np.ndarray): flat array of second coordinate of all polyline vertices
+        seg_lengths (np.ndarray): number of vertices in each polyline, each at least 2
+        dist (float): desired distance between resampled points, in coordinate units
+
+    Returns:
+        tuple: (x, y, index of polyline for each resampled point)
+    """
+    seg_lengths = np.asarray(seg_lengths, dtype=np.int64)
+    if len(seg_lengths) == 0:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+    starts = np.cumsum(seg_lengths) - seg_lengths
+    ends = starts + seg_lengths
+
+    # Cumulative arc length over all vertices, not counting steps between consecutive polylines
+    seg_id = np.repeat(np.arange(len(seg_lengths)), seg_lengths)
+    steps = np.hypot(np.diff(x), np.diff(y)) * (seg_id[1:] == seg_id[:-1])
+    cum = np.concatenate([[0.], np.cumsum(steps)])
+    lengths = cum[ends - 1] - cum[starts]
+
+    # Target arc lengths of resampled points
+    num_vert = np.maximum(np.round(lengths / dist), 1).astype(np.int64)
+    out_seg = np.repeat(np.arange(len(seg_lengths)), num_vert + 1)
+    k = np.arange(len(out_seg)) - np.repeat(np.cumsum(num_vert + 1) - (num_vert + 1), num_vert + 1)
+    t = cum[starts][out_seg] + lengths[out_seg] * k / num_vert[out_seg]
+
+    # Locate vertex step containing each target, kept within its own polyline
+    j = np.searchsorted(cum, t, side="right") - 1
+    j = np.clip(j, starts[out_seg], ends[out_seg] - 2)
+    step = cum[j + 1] - cum[j]
+    w = np.clip(np.divide(t - cum[j], step, out=np.zeros_like(t), where=step > 0), 0, 1)
+
+    return x[j] + w * (x[j + 1] - x[j]), y[j] + w * (y[j + 1] - y[j]), out_seg
+
+def vectorised_batch_geo_interpolate_df(raw_df: pd.DataFrame, lat_colname="latitude", lon_colname="longitude", trackno_colname="trackid", dist_m: float = 20, track_points_thresh: float = utils.THRESH_SPURIOUS_GPS_POINT_COUNT, segmentation=True, thresh: float = utils.THRESH_INTERPOLATION_JUMP_DIST) -> pd.DataFrame:
+    """Perform interpolation of several tracks contained in one dataframe, distinguished by track id, on flat arrays
+    without a Python loop per track. Gives the same output as segmenting each track with split_dirty_track and
+    interpolating each segment with geo_interpolate_df.
+
+    Args:
+        raw_df (pd.DataFrame): input dataframe with rows as points.
+        lat_colname (str, optional): latitude column name. Defaults to "latitude".
+        lon_colname (str, optional): longitude column name. Defaults to "longitude".
+        trackno_colname (str, optional): track id column name. Defaults to "trackid".
+        dist_m (float, optional): desired interpolation distance between points. Defaults to 20.
+        track_points_thresh (float, optional): min number of points in track segment, otherwise delete. 
+            Defaults to utils.THRESH_SPURIOUS_GPS_POINT_COUNT.
+        segmentation (bool, optional): whether to segment tracks. Defaults to True.
+        thresh (float, optional): distance between consecutive points above which to segment track.
+            Defaults to utils.THRESH_INTERPOLATION_JUMP_DIST.
+
+    Returns:
+        pd.DataFrame: concatenated interpolated tracks, or None if no track segments are long enough
+    """
+    trackids = raw_df[trackno_colname].to_numpy()
+    order = np.argsort(trackids, kind="stable")
+    trackids = trackids[order]
+    lat = raw_df[lat_colname].to_numpy(dtype=np.float64)[order]
+    lon = raw_df[lon_colname].to_numpy(dtype=np.float64)[order]
+    if len(lat) == 0:
+        return None
+
+    # Segment tracks where consecutive points jump too far (same squared euclidean distance as split_dirty_track)
+    new_track = np.concatenate([[True], trackids[1:] != trackids[:-1]])
+    jump = np.zeros(len(lat), dtype=bool)
+    if segmentation:
+        dists = ((lat[1:] - lat[:-1])**2 + (lon[1:] - lon[:-1])**2) * utils.EARTH_CONST_SQUARED
+        jump[1:] = dists > thresh * thresh
+    seg = np.cumsum(new_track | jump) - 1
+    track_first_seg = seg[new_track]
+    tracksegid = seg - track_first_seg[np.cumsum(new_track) - 1]
+
+    # Remove short segments
+    seg_lengths = np.bincount(seg)
+    keep_seg = seg_lengths > track_points_thresh if segmentation else seg_lengths > 1
+    keep = keep_seg[seg]
+    if not keep.any():
+        return None
+    seg_starts = np.flatnonzero(np.concatenate([[True], seg[1:] != seg[:-1]]))
+    seg_starts = seg_starts[keep_seg]
+
+    out_lat, out_lon, out_seg = resample_segments(lat[keep], lon[keep], seg_lengths[keep_seg], utils.metres_to_dist(dist_m))
+
+    return pd.DataFrame({lat_colname: out_lat,
+                         lon_colname: out_lon,
+                         "tracksegid": tracksegid[seg_starts][out_seg],
+                         trackno_colname: trackids[seg_starts][out_seg]})
+
+def batch_geo_interpolate_df(raw_df: pd.DataFrame, lat_colname="latitude", lon_colname="longitude", trackno_colname="trackid", dist_m: float = 20, segmentation=True, engine="vectorised") -> pd.DataFrame:
     """Perform interpolation of several tracks contained in one dataframe, distinguished by track id.
 
     Args:
@@ -92,15 +186,27 @@ def batch_geo_interpolate_df(raw_df: pd.DataFrame, lat_colname="latitude", lon_c
         trackno_colname (str, optional): track id column name. Defaults to "trackid".
         dist_m (float, optional): desired interpolation distance between points. Defaults to 20.
         segmentation (bool, optional): whether to segment tracks. Defaults to True.
+        engine (str, optional): "vectorised" to interpolate all tracks at once on flat arrays, or "per_track"
+            to interpolate each track with geo_interpolate_df. Defaults to "vectorised".
 
     Returns:
         pd.DataFrame: concatenated interpolated tracks
     """
-    interpolated_tracks_dfs = [geo_interpolate_df(y, lat_colname=lat_colname, lon_colname=lon_colname, trackno_colname=trackno_colname, dist_m=dist_m, segmentation=segmentation) \
-                               for x, y in tqdm(raw_df.groupby(trackno_colname, as_index=False))]
-    try:
-        out = pd.concat(interpolated_tracks_dfs, ignore_index=True)
-    except ValueError:
-        out = None
-        
-    return out
\ No newline at end of file
+    if engine not in ["vectorised", "per_track"]:
+        raise ValueError("engine must be 'vectorised' or 'per_track'.")
+
+    with instrument.stage("interpolate") as counts:
+        if engine == "vectorised":
+            out = vectorised_batch_geo_interpolate_df(raw_df, lat_colname=lat_colname, lon_colname=lon_colname, trackno_colname=trackno_colname, dist_m=dist_m, segmentation=segmentation)
+        else:
+            interpolated_tracks_dfs = [geo_interpolate_df(y, lat_colname=lat_colname, lon_colname=lon_colname, trackno_colname=trackno_colname, dist_m=dist_m, segmentation=segmentation) \
+                                       for x, y in tqdm(raw_df.groupby(trackno_colname, as_index=False))]
+            try:
+                out = pd.concat(interpolated_tracks_dfs, ignore_index=True)
+            except ValueError:
+                out = None
+        # Points are in track order, so count tracks from changes of track id
+        counts.update(points_in=len(raw_df), points_out=0 if out is None else len(out),
+                      tracks=int(np.count_nonzero(np.diff(raw_df[trackno_colname].to_numpy())) + 1) if len(raw_df) > 0 else 0)
+
+    return out
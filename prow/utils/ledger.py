@@ -0,0 +1,123 @@
+"""
+Persistent per-edge activity ledger of a subregion, so that new batches of public GPS data (e.g. a newer dump,
+or another source) can be added without interpolating and matching the batches already added. The ledger
+holds one part per batch of rows (u, v, key, trackid, count): the number of points of each track matched to
+each edge. Track ids of each batch are offset past those of earlier batches, so that tracks from different
+batches stay distinct. Point counts and distinct tracks per edge, from which activity is derived, are sums
+over all parts. Parts and the manifest listing them are written to temporary files and renamed, and a batch
+is only part of the ledger once the manifest lists it.
+"""
+import os, shutil
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from . import cache
+
+LEDGER_EXT = ".ledger" # suffix of ledger folder
+
+class ActivityLedger(object):
+    """Activity ledger of one subregion, stored in a folder with a cache manifest recording its key,
+    the batches added, the next free track id, and the RoW edges of the subregion
+    """
+    def __init__(self, fn: str, key: str):
+        """Open ledger with filename prefix, emptying it if it was built with a different key, e.g. after the
+        subregion's graph or the interpolation or matching parameters changed
+
+        Args:
+            fn (str): filename prefix of ledger
+            key (str): key of everything batches are matched with, from cache.stage_key
+        """
+        self.fn = fn
+        self.folder = fn + LEDGER_EXT
+        self.key = key
+        manifest = cache.read_manifest(fn)
+        if manifest is not None and manifest["key"] == key:
+            self.batches, self.next_trackid, self.row = manifest["batches"], manifest["next_trackid"], manifest["row"]
+        else:
+            if os.path.isdir(self.folder):
+                shutil.rmtree(self.folder)
+            self.batches, self.next_trackid, self.row = {}, 0, None
+
+    def has_batch(self, name: str, key: str) -> bool:
+        """Return whether batch with name was added with key, i.e. its data hasn't changed since"""
+        return name in self.batches and self.batches[name]["key"] == key
+
+    def add_batch(self, name: str, key: str, edges: pd.MultiIndex, trackids: np.ndarray, n_points: int = None) -> int:
+        """Add matched points of a batch, replacing the batch if it was added before with a different key
+
+        Args:
+            name (str): batch name, e.g. filename prefix of its data
+            key (str): key of batch data
+            edges (pd.MultiIndex): (u, v, key) edge matched to each point
+            trackids (np.ndarray): track id of each point
+            n_points (int, optional): number of points of batch in subregion, including those not matched.
+                If None, number of matched points. Defaults to None.
+
+        Returns:
+            int: number of (edge, track) rows added
+        """
+        self.remove_batch(name)
+        track_codes, track_uniques = pd.factorize(np.asarray(trackids))
+        part = pd.DataFrame({"u": edges.get_level_values(0).to_numpy(np.int64), "v": edges.get_level_values(1).to_numpy(np.int64),
+                             "key": edges.get_level_values(2).to_numpy(np.int64), "trackid": self.next_trackid + track_codes.astype(np.int64)})
+        part = part.groupby(["u", "v", "key", "trackid"], sort=False).size().astype(np.int32).rename("count").reset_index()
+
+        os.makedirs(self.folder, exist_ok=True)
+        part_fn = os.path.join(self.folder, f"{cache.hash_key(name, key)}.parquet")
+        part.to_parquet(part_fn + ".tmp", index=False)
+        os.replace(part_fn + ".tmp", part_fn)
+        self.batches[name] = {"key": key, "part": os.path.basename(part_fn), "points": len(track_codes) if n_points is None else int(n_points), "tracks": len(track_uniques)}
+        self.next_trackid += len(track_uniques)
+        self.save()
+        return len(part)
+
+    def remove_batch(self, name: str) -> None:
+        """Remove batch from ledger if it was added"""
+        if name not in self.batches:
+            return
+        part_fn = os.path.join(self.folder, self.batches.pop(name)["part"])
+        self.save()
+        if os.path.isfile(part_fn):
+            os.remove(part_fn)
+
+    def set_row_edges(self, key: str, edges: pd.MultiIndex) -> None:
+        """Save (u, v, key) RoW edges of subregion, matched from RoW data with key"""
+        os.makedirs(self.folder, exist_ok=True)
+        row_fn = os.path.join(self.folder, "row.parquet")
+        edges.to_frame(index=False).astype(np.int64).to_parquet(row_fn + ".tmp", index=False)
+        os.replace(row_fn + ".tmp", row_fn)
+        self.row = key
+        self.save()
+
+    def row_edges(self, key: str) -> pd.MultiIndex:
+        """Return RoW edges of subregion if they were matched from RoW data with key, otherwise None"""
+        if self.row != key:
+            return None
+        return pd.MultiIndex.from_frame(pd.read_parquet(os.path.join(self.folder, "row.parquet")))
+
+    def n_points(self) -> int:
+        """Return total number of points of all batches in subregion"""
+        return sum(batch["points"] for batch in self.batches.values())
+
+    def save(self) -> None:
+        cache.write_manifest(self.fn, "ledger", self.key, batches=self.batches, next_trackid=self.next_trackid, row=self.row)
+
+    def edge_activity(self, graph_edges: gpd.GeoDataFrame) -> tuple:
+        """Sum point counts and distinct tracks per edge over all batches
+
+        Args:
+            graph_edges (gpd.GeoDataFrame): graph edges indexed by (u, v, key)
+
+        Returns:
+            tuple: (point counts, distinct tracks) arrays aligned with graph_edges
+        """
+        counts, tracks = np.zeros(len(graph_edges), dtype=np.int64), np.zeros(len(graph_edges), dtype=np.int64)
+        for batch in self.batches.values():
+            part = pd.read_parquet(os.path.join(self.folder, batch["part"]))
+            pos = graph_edges.index.get_indexer(pd.MultiIndex.from_arrays([part["u"], part["v"], part["key"]]))
+            found = pos >= 0
+            counts += np.bincount(pos[found], weights=part["count"].to_numpy()[found], minlength=len(graph_edges)).astype(np.int64)
+            tracks += np.bincount(pos[found], minlength=len(graph_edges))
+        return counts, tracks
@@ -0,0 +1,121 @@
+"""
+Fixed national tiling of Great Britain into British National Grid squares, used as the unit of work for
+downloads and analysis instead of squares cut from each authority's own polygon, so that areas shared by
+neighbouring authorities are only downloaded and map-matched once. Tiles are identified by integer ids
+from their grid column and row, and a TileIndex records which authorities each tile intersects.
+"""
+import os, json
+
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+from shapely.geometry.base import BaseGeometry
+from pyproj import Transformer
+
+from . import utils
+
+BNG_CRS = "EPSG:27700" # British National Grid
+BNG_WIDTH = 700000 # easting extent of British National Grid in metres
+TILE_SEGMENT_LENGTH = 1000 # max distance between vertices on tile edges in metres, so tiles follow grid lines in lat/lon
+TILE_MIN_OVERLAP = 1e-4 # min fraction of tile area overlapping a geometry to count as intersecting, above projection rounding
+TILE_INDEX_EXT = ".tiles.json" # suffix of saved tile index
+
+_TO_BNG = Transformer.from_crs("EPSG:4326", BNG_CRS, always_xy=True)
+_FROM_BNG = Transformer.from_crs(BNG_CRS, "EPSG:4326", always_xy=True)
+
+def _transform(geometry: BaseGeometry, transformer: Transformer) -> BaseGeometry:
+    return shapely.transform(geometry, lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])))
+
+def tile_columns(length: float = utils.NATIONAL_TILE_LENGTH) -> int:
+    """Return number of tile columns across the grid"""
+    return int(np.ceil(BNG_WIDTH / length))
+
+def tiles_intersecting(geometry: BaseGeometry, length: float = utils.NATIONAL_TILE_LENGTH) -> np.ndarray:
+    """Get ids of all national tiles that overlap geometry by more than TILE_MIN_OVERLAP of their area, so that
+    tiles only touching it, up to rounding of projections, are left out
+
+    Args:
+        geometry (BaseGeometry): shapely geometry in lon/lat
+        length (float, optional): tile side length in metres. Defaults to NATIONAL_TILE_LENGTH.
+
+    Returns:
+        np.ndarray: int64 tile ids, in ascending order
+    """
+    bng = _transform(geometry, _TO_BNG)
+    west, south, east, north = bng.bounds
+    cols, rows = [a.ravel() for a in np.meshgrid(np.arange(np.floor(west / length), np.floor(east / length) + 1),
+                                                 np.arange(np.floor(south / length), np.floor(north / length) + 1))]
+    boxes = shapely.box(cols * length, rows * length, (cols + 1) * length, (rows + 1) * length)
+    shapely.prepare(bng)
+    hit = shapely.intersects(bng, boxes)
+    hit[hit] = shapely.area(shapely.intersection(bng, boxes[hit])) > TILE_MIN_OVERLAP * length ** 2
+    return np.sort((rows[hit] * tile_columns(length) + cols[hit]).astype(np.int64))
+
+def tile_polygon(tile: int, length: float = utils.NATIONAL_TILE_LENGTH) -> Polygon:
+    """Get polygon of national tile in lon/lat. Neighbouring tiles share edge vertices exactly.
+
+    Args:
+        tile (int): tile id
+        length (float, optional): tile side length in metres. Defaults to NATIONAL_TILE_LENGTH.
+
+    Returns:
+        Polygon: tile polygon
+    """
+    col, row = tile % tile_columns(length), tile // tile_columns(length)
+    square = shapely.segmentize(shapely.box(col * length, row * length, (col + 1) * length, (row + 1) * length), TILE_SEGMENT_LENGTH)
+    return _transform(square, _FROM_BNG)
+
+class TileIndex(object):
+    """Index between authorities and the national tiles they intersect. Tiles intersecting the same set of
+    authorities need the same RoW data, so are grouped to be analysed together.
+    """
+    def __init__(self, authority_tiles: dict, length: float = utils.NATIONAL_TILE_LENGTH):
+        """
+        Args:
+            authority_tiles (dict): authority codes to lists of tile ids
+            length (float, optional): tile side length in metres. Defaults to NATIONAL_TILE_LENGTH.
+        """
+        self.length = length
+        self.authority_tiles = {a: sorted(int(t) for t in tiles) for a, tiles in authority_tiles.items()}
+        self.tile_authorities = {}
+        for a, tiles in self.authority_tiles.items():
+            for t in tiles:
+                self.tile_authorities.setdefault(t, []).append(a)
+
+    @classmethod
+    def from_boundaries(cls, boundaries: dict, length: float = utils.NATIONAL_TILE_LENGTH):
+        """Build index from authority codes to boundary geometries in lon/lat"""
+        return cls({a: tiles_intersecting(geom, length=length) for a, geom in boundaries.items()}, length=length)
+
+    def tiles(self, authority: str) -> list:
+        """Return ids of tiles intersecting authority"""
+        return self.authority_tiles[authority]
+
+    def authorities(self, tile: int) -> list:
+        """Return codes of authorities intersecting tile"""
+        return self.tile_authorities[tile]
+
+    def groups(self) -> dict:
+        """Group tiles by the authorities they intersect
+
+        Returns:
+            dict: tuples of authority codes to lists of tile ids
+        """
+        groups = {}
+        for t in sorted(self.tile_authorities):
+            groups.setdefault(tuple(self.tile_authorities[t]), []).append(t)
+        return groups
+
+    def save(self, fn: str) -> None:
+        """Save index to filename prefix, written to a temporary file and renamed"""
+        os.makedirs(os.path.dirname(fn) or ".", exist_ok=True)
+        with open(fn + TILE_INDEX_EXT + ".tmp", "w") as f:
+            json.dump({"length": self.length, "authority_tiles": self.authority_tiles}, f)
+        os.replace(fn + TILE_INDEX_EXT + ".tmp", fn + TILE_INDEX_EXT)
+
+    @classmethod
+    def load(cls, fn: str):
+        """Load index saved at filename prefix"""
+        with open(fn + TILE_INDEX_EXT) as f:
+            index = json.load(f)
+        return cls(index["authority_tiles"], length=index["length"])
@@ -0,0 +1,272 @@
+"""
+Offline builder of OSM path networks from a local .osm.pbf or .osm XML extract, as an alternative
+graph source to one Overpass query per subregion. The extract is read once into node and edge arrays,
+which are saved next to it, and cut into one graph per subregion with a grid bucketing index.
+"""
+import os, re, bz2, gzip
+from array import array
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import networkx as nx
+import osmnx as ox
+from shapely.geometry.base import BaseGeometry
+
+from . import utils, cache
+from .spatial_index import GridBucketIndex
+
+PATH_NETWORK_EXT = ".pathnet.npz" # suffix of saved path network arrays, next to the extract
+OSM_NODE_CHUNK_SIZE = 1000000 # number of extract nodes read before filtering to path network nodes
+WAY_TAGS = [t for t in ox.settings.useful_tags_way if t != "oneway"] # way tags kept as edge attributes, as osmnx
+ONEWAY_VALUES = {"yes", "true", "1", "-1", "reverse", "T", "F"} # oneway tag values osmnx treats as oneway
+REVERSED_VALUES = {"-1", "reverse", "T"} # oneway tag values osmnx treats as oneway against way direction
+
+def _open_xml(fn: str):
+    """Open OSM XML extract, decompressing .bz2 and .gz"""
+    if fn.endswith(".bz2"): return bz2.open(fn, "rb")
+    if fn.endswith(".gz"): return gzip.open(fn, "rb")
+    return open(fn, "rb")
+
+def _iter_elements(fn: str, names: set):
+    """Stream top-level elements of OSM XML extract with given names, clearing each once used"""
+    with _open_xml(fn) as f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event == "end" and elem.tag in ("node", "way", "relation"):
+                if elem.tag in names:
+                    yield elem
+                root.clear()
+
+def read_osm_xml(fn: str, highway_filter: str = utils.PATH_HIGHWAY_FILTER) -> dict:
+    """Read ways with highway tag matching filter, and coordinates of their nodes, from OSM XML extract.
+    The extract is read twice, once for ways and once for nodes, so that only nodes of path ways are kept.
+
+    Args:
+        fn (str): filename of .osm extract, optionally .bz2 or .gz compressed
+        highway_filter (str, optional): regex matched against highway tags. Defaults to PATH_HIGHWAY_FILTER.
+
+    Returns:
+        dict: ways as in PathNetwork.from_ways
+    """
+    pattern = re.compile(highway_filter)
+    ways = {"way_ids": array("q"), "lengths": array("q"), "refs": array("q"), "tags": {t: [] for t in WAY_TAGS + ["oneway"]}}
+    for elem in _iter_elements(fn, {"way"}):
+        tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+        if not pattern.search(tags.get("highway", "")):
+            continue
+        refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+        ways["way_ids"].append(int(elem.get("id")))
+        ways["lengths"].append(len(refs))
+        ways["refs"].extend(refs)
+        for t, values in ways["tags"].items():
+            values.append(tags.get(t, ""))
+
+    refs = np.array(ways["refs"], dtype=np.int64)
+    needed = np.unique(refs)
+    node_ids, lats, lons = [np.empty(0, dtype=np.int64)], [np.empty(0)], [np.empty(0)]
+    chunk = (array("q"), array("d"), array("d"))
+
+    def flush():
+        ids = np.array(chunk[0], dtype=np.int64)
+        pos = np.minimum(np.searchsorted(needed, ids), max(len(needed) - 1, 0))
+        keep = needed[pos] == ids if len(needed) > 0 else np.zeros(len(ids), dtype=bool)
+        node_ids.append(ids[keep])
+        lats.append(np.array(chunk[1], dtype=np.float64)[keep])
+        lons.append(np.array(chunk[2], dtype=np.float64)[keep])
+        for a in chunk: del a[:]
+
+    for elem in _iter_elements(fn, {"node"}):
+        chunk[0].append(int(elem.get("id")))
+        chunk[1].append(float(elem.get("lat")))
+        chunk[2].append(float(elem.get("lon")))
+        if len(chunk[0]) >= OSM_NODE_CHUNK_SIZE:
+            flush()
+    flush()
+
+    node_ids, lats, lons = np.concatenate(node_ids), np.concatenate(lats), np.concatenate(lons)
+    order = np.argsort(node_ids)
+    node_ids, lats, lons = node_ids[order], lats[order], lons[order]
+    pos = np.minimum(np.searchsorted(node_ids, refs), max(len(node_ids) - 1, 0))
+    found = node_ids[pos] == refs if len(node_ids) > 0 else np.zeros(len(refs), dtype=bool)
+
+    ways["ref_lats"] = np.where(found, lats[pos] if len(lats) > 0 else np.nan, np.nan)
+    ways["ref_lons"] = np.where(found, lons[pos] if len(lons) > 0 else np.nan, np.nan)
+    return ways
+
+def read_osm_pbf(fn: str, highway_filter: str = utils.PATH_HIGHWAY_FILTER) -> dict:
+    """Read ways with highway tag matching filter, and coordinates of their nodes, from .osm.pbf extract
+    with pyosmium, which resolves node locations while reading ways.
+
+    Args:
+        fn (str): filename of .osm.pbf extract
+        highway_filter (str, optional): regex matched against highway tags. Defaults to PATH_HIGHWAY_FILTER.
+
+    Returns:
+        dict: ways as in PathNetwork.from_ways
+    """
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("Reading .osm.pbf extracts requires pyosmium, install with pip install osmium")
+
+    pattern = re.compile(highway_filter)
+    ways = {"way_ids": array("q"), "lengths": array("q"), "refs": array("q"), "ref_lats": array("d"), "ref_lons": array("d"),
+            "tags": {t: [] for t in WAY_TAGS + ["oneway"]}}
+
+    class PathWayHandler(osmium.SimpleHandler):
+        def way(self, w):
+            if not pattern.search(w.tags.get("highway", "")):
+                return
+            ways["way_ids"].append(w.id)
+            ways["lengths"].append(len(w.nodes))
+            for n in w.nodes:
+                valid = n.location.valid()
+                ways["refs"].append(n.ref)
+                ways["ref_lats"].append(n.location.lat if valid else np.nan)
+                ways["ref_lons"].append(n.location.lon if valid else np.nan)
+            for t, values in ways["tags"].items():
+                values.append(w.tags.get(t, ""))
+
+    PathWayHandler().apply_file(fn, locations=True)
+    ways["ref_lats"] = np.array(ways["ref_lats"], dtype=np.float64)
+    ways["ref_lons"] = np.array(ways["ref_lons"], dtype=np.float64)
+    return ways
+
+class PathNetwork(object):
+    """Node and edge arrays of all OSM path ways in an extract. Edges join consecutive nodes of each way,
+    with way tags as attributes, so that graphs cut from the network match ox.graph_from_polygon with
+    simplify=False and retain_all=True, made undirected.
+    """
+
+    def __init__(self, node_ids: np.ndarray, lats: np.ndarray, lons: np.ndarray, u: np.ndarray, v: np.ndarray, edge_way: np.ndarray,
+                 way_ids: np.ndarray, way_tags: dict, oneway: np.ndarray, highway_filter: str = utils.PATH_HIGHWAY_FILTER, extract_key: str = ""):
+        """
+        Args:
+            node_ids (np.ndarray): sorted OSM ids of nodes
+            lats (np.ndarray): latitude of each node
+            lons (np.ndarray): longitude of each node
+            u (np.ndarray): position of start node of each edge
+            v (np.ndarray): position of end node of each edge
+            edge_way (np.ndarray): position of way of each edge
+            way_ids (np.ndarray): OSM id of each way
+            way_tags (dict): tag names to array of tag value of each way, "" if missing
+            oneway (np.ndarray): whether each way is oneway
+            highway_filter (str, optional): regex ways were filtered with. Defaults to PATH_HIGHWAY_FILTER.
+            extract_key (str, optional): cache.file_key of extract network was built from. Defaults to "".
+        """
+        self.node_ids, self.lats, self.lons = node_ids, lats, lons
+        self.u, self.v, self.edge_way = u, v, edge_way
+        self.way_ids, self.way_tags, self.oneway = way_ids, way_tags, oneway
+        self.highway_filter = highway_filter
+        self.extract_key = extract_key
+
+        self.length = ox.distance.great_circle(lats[u], lons[u], lats[v], lons[v])
+        pairs = np.unique(np.stack([np.minimum(u, v), np.maximum(u, v)], axis=1), axis=0).reshape(-1, 2)
+        self.street_count = np.bincount(pairs.ravel(), minlength=len(node_ids))
+
+    @classmethod
+    def from_ways(cls, way_ids, lengths, refs, ref_lats, ref_lons, tags: dict, highway_filter: str = utils.PATH_HIGHWAY_FILTER):
+        """Build network from ways with flattened node refs and coordinates, as returned by read_osm_xml and read_osm_pbf.
+        Nodes missing from the extract have nan coordinates and are dropped with their edges.
+        """
+        way_ids = np.asarray(way_ids, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        refs = np.asarray(refs, dtype=np.int64)
+        way_tags = {t: np.array(values, dtype=str) for t, values in tags.items() if t != "oneway"}
+        oneway = np.isin(tags["oneway"], list(ONEWAY_VALUES)) | (way_tags["junction"] == "roundabout")
+        reverse = np.isin(tags["oneway"], list(REVERSED_VALUES))
+
+        # Nodes with coordinates, and positions of refs in nodes
+        valid = ~np.isnan(ref_lats)
+        node_ids, first = np.unique(refs[valid], return_index=True)
+        lats, lons = np.asarray(ref_lats)[valid][first], np.asarray(ref_lons)[valid][first]
+        ref_pos = np.searchsorted(node_ids, refs)
+
+        # Edges between consecutive refs of the same way, both with coordinates
+        ref_way = np.repeat(np.arange(len(way_ids)), lengths)
+        consecutive = (ref_way[:-1] == ref_way[1:]) & valid[:-1] & valid[1:]
+        u, v, edge_way = ref_pos[:-1][consecutive], ref_pos[1:][consecutive], ref_way[:-1][consecutive]
+        u, v = np.where(reverse[edge_way], v, u), np.where(reverse[edge_way], u, v)
+
+        return cls(node_ids, lats, lons, u, v, edge_way, way_ids, way_tags, oneway, highway_filter=highway_filter)
+
+    @classmethod
+    def from_extract(cls, fn: str, highway_filter: str = utils.PATH_HIGHWAY_FILTER):
+        """Build network from .osm.pbf extract with pyosmium, or from .osm XML extract
+
+        Args:
+            fn (str): filename of extract
+            highway_filter (str, optional): regex matched against highway tags. Defaults to PATH_HIGHWAY_FILTER.
+
+        Returns:
+            PathNetwork: network
+        """
+        read = read_osm_pbf if fn.endswith(".pbf") else read_osm_xml
+        ways = read(fn, highway_filter=highway_filter)
+        network = cls.from_ways(ways["way_ids"], ways["lengths"], ways["refs"], ways["ref_lats"], ways["ref_lons"], ways["tags"], highway_filter=highway_filter)
+        network.extract_key = cache.file_key(fn)
+        return network
+
+    def save(self, fn: str) -> None:
+        """Save network to fn + PATH_NETWORK_EXT, through a temporary file"""
+        np.savez(fn + ".tmp" + PATH_NETWORK_EXT, node_ids=self.node_ids, lats=self.lats, lons=self.lons, u=self.u, v=self.v,
+                 edge_way=self.edge_way, way_ids=self.way_ids, oneway=self.oneway, highway_filter=self.highway_filter, extract_key=self.extract_key,
+                 **{f"tag_{t}": values for t, values in self.way_tags.items()})
+        os.replace(fn + ".tmp" + PATH_NETWORK_EXT, fn + PATH_NETWORK_EXT)
+
+    @classmethod
+    def load(cls, fn: str):
+        """Load network saved at fn + PATH_NETWORK_EXT"""
+        with np.load(fn + PATH_NETWORK_EXT) as data:
+            way_tags = {k[len("tag_"):]: data[k] for k in data.files if k.startswith("tag_")}
+            return cls(data["node_ids"], data["lats"], data["lons"], data["u"], data["v"], data["edge_way"],
+                       data["way_ids"], way_tags, data["oneway"], highway_filter=str(data["highway_filter"]),
+                       extract_key=str(data["extract_key"]) if "extract_key" in data.files else "")
+
+    @classmethod
+    def load_or_build(cls, extract_fn: str, highway_filter: str = utils.PATH_HIGHWAY_FILTER):
+        """Load network saved next to extract if built from the same extract file with the same filter, otherwise build and save it"""
+        fn = re.sub(r"(\.osm)?(\.pbf|\.bz2|\.gz)?$", "", extract_fn)
+        if os.path.isfile(fn + PATH_NETWORK_EXT):
+            network = cls.load(fn)
+            if network.highway_filter == highway_filter and network.extract_key == cache.file_key(extract_fn):
+                return network
+        print(f"Building path network from {extract_fn}...")
+        network = cls.from_extract(extract_fn, highway_filter=highway_filter)
+        network.save(fn)
+        return network
+
+    def node_index(self, bounds: tuple) -> GridBucketIndex:
+        """Bucket nodes into grid within bounds (west, south, east, north), to cut many subregions quickly"""
+        return GridBucketIndex(self.lats, self.lons, bounds)
+
+    def graph_in_polygon(self, geometry: BaseGeometry, index: GridBucketIndex = None) -> nx.MultiGraph:
+        """Cut undirected graph of nodes inside polygon and edges between them, as ox.graph_from_polygon
+        truncates the network to the polygon.
+
+        Args:
+            geometry (BaseGeometry): polygon or multipolygon
+            index (GridBucketIndex, optional): node index covering geometry. If None, build one. Defaults to None.
+
+        Returns:
+            nx.MultiGraph: graph, empty if no nodes inside polygon
+        """
+        index = self.node_index(geometry.bounds) if index is None else index
+        inside = np.zeros(len(self.node_ids), dtype=bool)
+        inside[index.query(geometry)] = True
+        nodes = np.flatnonzero(inside)
+        if len(nodes) == 0:
+            return nx.MultiGraph()
+
+        G = nx.MultiGraph(crs="epsg:4326")
+        G.add_nodes_from((int(self.node_ids[n]), {"y": float(self.lats[n]), "x": float(self.lons[n]), "street_count": int(self.street_count[n])}) for n in nodes)
+
+        edges = np.flatnonzero(inside[self.u] & inside[self.v])
+        for e in edges:
+            w = self.edge_way[e]
+            attrs = {"osmid": int(self.way_ids[w])}
+            attrs.update((t, str(values[w])) for t, values in self.way_tags.items() if values[w] != "")
+            attrs.update(oneway=bool(self.oneway[w]), reversed=False, length=float(self.length[e]))
+            G.add_edge(int(self.node_ids[self.u[e]]), int(self.node_ids[self.v[e]]), **attrs)
+        return G
@@ -0,0 +1,68 @@
+"""
+Density-adaptive quadtree partitioning of a region into subregions of even work, as an alternative to
+cutting a fixed grid of squares. Work is counted from histograms of public GPS points and optionally
+path network nodes, queried in constant time per box with summed-area tables.
+"""
+import numpy as np
+import shapely
+from shapely.geometry import box
+from shapely.geometry.base import BaseGeometry
+
+from . import utils
+
+def summed_area_table(counts: np.ndarray) -> np.ndarray:
+    """Return (ny + 1, nx + 1) table of sums of counts below and left of each cell corner"""
+    sat = np.zeros((counts.shape[0] + 1, counts.shape[1] + 1), dtype=np.int64)
+    sat[1:, 1:] = counts.cumsum(axis=0).cumsum(axis=1)
+    return sat
+
+def box_sum(sat: np.ndarray, x0: int, y0: int, size: int) -> int:
+    """Return sum of counts in square of cells from (x0, y0) with side size, from summed-area table"""
+    x1, y1 = x0 + size, y0 + size
+    return int(sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0])
+
+def quadtree_partition(geometry: BaseGeometry, lats: np.ndarray, lons: np.ndarray, max_points: int = utils.QUADTREE_MAX_POINTS,
+                       node_lats: np.ndarray = None, node_lons: np.ndarray = None, max_nodes: int = utils.QUADTREE_MAX_NODES,
+                       min_length: float = utils.QUADTREE_MIN_BOX_LENGTH, max_length: float = utils.QUADTREE_MAX_BOX_LENGTH) -> list:
+    """Recursively split a square covering the region into quarters until each square has at most max_points points
+    and max_nodes path network nodes, or reaches the minimum side length. Squares are also split while longer than
+    the maximum side length. Squares are then clipped to the region, and squares cut into several parts by a
+    concave or multi-part region are split into one subregion per part, dropping empty or non-areal parts.
+
+    Args:
+        geometry (BaseGeometry): region polygon or multipolygon
+        lats (np.ndarray): latitudes of public GPS points
+        lons (np.ndarray): longitudes of public GPS points
+        max_points (int, optional): max points per subregion. Defaults to QUADTREE_MAX_POINTS.
+        node_lats (np.ndarray, optional): latitudes of path network nodes. If None, don't balance network size. Defaults to None.
+        node_lons (np.ndarray, optional): longitudes of path network nodes. Defaults to None.
+        max_nodes (int, optional): max path network nodes per subregion. Defaults to QUADTREE_MAX_NODES.
+        min_length (float, optional): min side length of subregions in metres. Defaults to QUADTREE_MIN_BOX_LENGTH.
+        max_length (float, optional): max side length of subregions in metres. Defaults to QUADTREE_MAX_BOX_LENGTH.
+
+    Returns:
+        list: list of shapely.geometry.Polygon geometries representing subregions, as from a fixed grid
+    """
+    cell_size = utils.metres_to_dist(min_length)
+    west, south, east, north = geometry.bounds
+    n = 2 ** int(np.ceil(np.log2(max(east - west, north - south, cell_size) / cell_size)))
+    extent = [[south, south + n * cell_size], [west, west + n * cell_size]]
+
+    point_sat = summed_area_table(np.histogram2d(lats, lons, bins=n, range=extent)[0].astype(np.int64))
+    node_sat = None
+    if node_lats is not None:
+        node_sat = summed_area_table(np.histogram2d(node_lats, node_lons, bins=n, range=extent)[0].astype(np.int64))
+    max_cells = max(int(utils.metres_to_dist(max_length) / cell_size), 1)
+
+    leaves, stack = [], [(0, 0, n)]
+    while len(stack) > 0:
+        x0, y0, size = stack.pop()
+        too_much = box_sum(point_sat, x0, y0, size) > max_points or (node_sat is not None and box_sum(node_sat, x0, y0, size) > max_nodes)
+        if size > 1 and (too_much or size > max_cells):
+            half = size // 2
+            stack.extend([(x0 + half, y0 + half, half), (x0, y0 + half, half), (x0 + half, y0, half), (x0, y0, half)])
+        else:
+            leaves.append(box(west + x0 * cell_size, south + y0 * cell_size, west + (x0 + size) * cell_size, south + (y0 + size) * cell_size))
+
+    parts = shapely.get_parts(shapely.intersection(np.array(leaves), geometry))
+    return [g for g in parts if g.geom_type == "Polygon" and g.area > 0]
@@ -0,0 +1,268 @@
+"""
+Columnar, spatially partitioned store of GPS points. Points are saved as a parquet dataset
+partitioned by square lat/lon tile, with coordinates as int32 microdegrees and int32 ids, so that
+readers only load the tiles intersecting a geometry. Chunks are written as they arrive, and each tile's
+chunk files are compacted into a single file when the store is complete, so that a store of many chunks
+doesn't leave many small files per tile. Each point also stores its int64 position
+in the written stream so that readers can restore the original point (i.e. track) order. Store metadata
+records the number of points in each tile, so that points in a geometry can be counted without reading them,
+e.g. to decide whether they fit in a memory budget.
+"""
+import os, json, shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+import shapely
+from shapely.geometry.base import BaseGeometry
+
+POINT_STORE_EXT = ".parquet" # suffix of point store folder
+POINT_STORE_TILE_SIZE = 0.05 # side length of store tiles in degrees
+POINT_STORE_META = "_store.json" # store metadata filename, ignored by parquet dataset discovery
+POINT_STORE_TILE_FILE = "points.parquet" # filename of compacted points of a tile, in its tile folder
+POINT_STORE_ROW_GROUP = 1000000 # maximum number of points per row group of compacted tile files
+MICRODEGREES = 1e6
+
+def store_exists(fn: str) -> bool:
+    """Return whether complete point store exists for given filename prefix"""
+    return os.path.isfile(os.path.join(fn + POINT_STORE_EXT, POINT_STORE_META))
+
+def tile_ids(lat: np.ndarray, lon: np.ndarray, tile_size: float = POINT_STORE_TILE_SIZE) -> np.ndarray:
+    """Get integer id of tile containing each point
+
+    Args:
+        lat (np.ndarray): point latitudes
+        lon (np.ndarray): point longitudes
+        tile_size (float, optional): tile side length in degrees. Defaults to POINT_STORE_TILE_SIZE.
+
+    Returns:
+        np.ndarray: int32 tile ids
+    """
+    nx = int(np.ceil(360 / tile_size))
+    tx = np.floor((np.asarray(lon) + 180) / tile_size).astype(np.int64)
+    ty = np.floor((np.asarray(lat) + 90) / tile_size).astype(np.int64)
+    return (ty * nx + tx).astype(np.int32)
+
+def tiles_intersecting(geometry: BaseGeometry, tile_size: float = POINT_STORE_TILE_SIZE) -> np.ndarray:
+    """Get ids of all tiles intersecting geometry
+
+    Args:
+        geometry (BaseGeometry): shapely geometry in lat/lon
+        tile_size (float, optional): tile side length in degrees. Defaults to POINT_STORE_TILE_SIZE.
+
+    Returns:
+        np.ndarray: int32 tile ids
+    """
+    nx = int(np.ceil(360 / tile_size))
+    west, south, east, north = geometry.bounds
+    txs = np.arange(np.floor((west + 180) / tile_size), np.floor((east + 180) / tile_size) + 1)
+    tys = np.arange(np.floor((south + 90) / tile_size), np.floor((north + 90) / tile_size) + 1)
+    tx, ty = [a.ravel() for a in np.meshgrid(txs, tys)]
+    boxes = shapely.box(tx * tile_size - 180, ty * tile_size - 90, (tx + 1) * tile_size - 180, (ty + 1) * tile_size - 90)
+    hit = shapely.intersects(geometry, boxes)
+    return (ty[hit] * nx + tx[hit]).astype(np.int32)
+
+def encode_points(df: pd.DataFrame, offset: int = 0, lat_colname="latitude", lon_colname="longitude", tile_size: float = POINT_STORE_TILE_SIZE) -> pa.Table:
+    """Convert dataframe of points to compact arrow table sorted by tile. Coordinates become int32 microdegrees,
+    other integer columns int32 and other float columns float32. Non-numeric columns are dropped.
+
+    Args:
+        df (pd.DataFrame): points with latitude and longitude columns
+        offset (int, optional): position of first point in written stream. Defaults to 0.
+        lat_colname (str, optional): latitude column name. Defaults to "latitude".
+        lon_colname (str, optional): longitude column name. Defaults to "longitude".
+        tile_size (float, optional): tile side length in degrees. Defaults to POINT_STORE_TILE_SIZE.
+
+    Returns:
+        pa.Table: encoded table with "tile" and "seq" columns
+    """
+    lat = df[lat_colname].to_numpy(dtype=np.float64)
+    lon = df[lon_colname].to_numpy(dtype=np.float64)
+    tile = tile_ids(lat, lon, tile_size=tile_size)
+    order = np.argsort(tile, kind="stable")
+
+    cols = {"tile": tile[order],
+            "seq": offset + order.astype(np.int64),
+            lat_colname: np.round(lat[order] * MICRODEGREES).astype(np.int32),
+            lon_colname: np.round(lon[order] * MICRODEGREES).astype(np.int32)}
+    for c in df.columns:
+        if c in (lat_colname, lon_colname, "index", "tile", "seq") or str(c).startswith("Unnamed"):
+            continue
+        if pd.api.types.is_integer_dtype(df[c]) or pd.api.types.is_bool_dtype(df[c]):
+            cols[c] = df[c].to_numpy()[order].astype(np.int32)
+        elif pd.api.types.is_float_dtype(df[c]):
+            cols[c] = df[c].to_numpy()[order].astype(np.float32)
+    return pa.table(cols)
+
+def decode_points(table: pa.Table, lat_colname="latitude", lon_colname="longitude") -> pd.DataFrame:
+    """Convert table read from store back to dataframe of float64 coordinates in original point order,
+    dropping tile and position columns"""
+    if "seq" in table.column_names:
+        table = table.take(pa.array(np.argsort(table["seq"].to_numpy(), kind="stable")))
+    df = table.drop_columns([c for c in ["tile", "seq"] if c in table.column_names]).to_pandas()
+    df[lat_colname] = df[lat_colname].to_numpy() / MICRODEGREES
+    df[lon_colname] = df[lon_colname].to_numpy() / MICRODEGREES
+    return df
+
+def compact_tile(folder: str, row_group_size: int = POINT_STORE_ROW_GROUP) -> None:
+    """Merge chunk files of one tile folder into a single file, in chunk order, reading at most about one row
+    group of points at a time
+
+    Args:
+        folder (str): tile folder of store
+        row_group_size (int, optional): maximum number of points per row group. Defaults to POINT_STORE_ROW_GROUP.
+    """
+    files = [os.path.join(folder, f) for f in sorted(os.listdir(folder))]
+    if len(files) <= 1:
+        return
+    out_fn = os.path.join(folder, POINT_STORE_TILE_FILE + ".tmp")
+    writer, buffer, n_buffered = None, [], 0
+    for f in files:
+        table = pq.ParquetFile(f).read()
+        writer = pq.ParquetWriter(out_fn, table.schema) if writer is None else writer
+        buffer.append(table)
+        n_buffered += len(table)
+        if n_buffered >= row_group_size:
+            writer.write_table(pa.concat_tables(buffer), row_group_size=row_group_size)
+            buffer, n_buffered = [], 0
+    if n_buffered > 0:
+        writer.write_table(pa.concat_tables(buffer), row_group_size=row_group_size)
+    writer.close()
+    for f in files:
+        os.remove(f)
+    os.replace(out_fn, os.path.join(folder, POINT_STORE_TILE_FILE))
+
+def write_point_store(frames, fn: str, tile_size: float = POINT_STORE_TILE_SIZE, lat_colname="latitude", lon_colname="longitude") -> int:
+    """Write chunks of points to a point store, one chunk at a time. Store is written to a temporary
+    folder, its tiles are compacted (see compact_tile), and it is renamed when complete.
+
+    Args:
+        frames: iterable of pd.DataFrame chunks of points with same columns
+        fn (str): filename prefix of store
+        tile_size (float, optional): tile side length in degrees. Defaults to POINT_STORE_TILE_SIZE.
+        lat_colname (str, optional): latitude column name. Defaults to "latitude".
+        lon_colname (str, optional): longitude column name. Defaults to "longitude".
+
+    Returns:
+        int: total number of points written
+    """
+    store_fn = fn + POINT_STORE_EXT
+    tmp_fn = store_fn + ".tmp"
+    if os.path.isdir(tmp_fn):
+        shutil.rmtree(tmp_fn)
+    os.makedirs(tmp_fn)
+
+    n_points, tile_counts, columns = 0, {}, None
+    for k, df in enumerate(frames):
+        if len(df) == 0:
+            continue
+        table = encode_points(df, offset=n_points, lat_colname=lat_colname, lon_colname=lon_colname, tile_size=tile_size)
+        pq.write_to_dataset(table, root_path=tmp_fn, partition_cols=["tile"], basename_template=f"part-{k:06d}-{{i}}.parquet",
+                            existing_data_behavior="overwrite_or_ignore")
+        tiles, counts = np.unique(table["tile"].to_numpy(), return_counts=True)
+        for t, n in zip(tiles.tolist(), counts.tolist()):
+            tile_counts[str(t)] = tile_counts.get(str(t), 0) + n
+        columns = [c for c in table.column_names if c != "tile"]
+        n_points += len(df)
+
+    for t in tile_counts:
+        compact_tile(os.path.join(tmp_fn, f"tile={t}"))
+    with open(os.path.join(tmp_fn, POINT_STORE_META), "w") as f:
+        json.dump({"tile_size": tile_size, "n_points": n_points, "columns": columns, "tiles": tile_counts}, f)
+
+    if os.path.isdir(store_fn):
+        shutil.rmtree(store_fn)
+    os.replace(tmp_fn, store_fn)
+    return n_points
+
+def read_point_store(fn: str, geometry: BaseGeometry = None, columns: list = None, lat_colname="latitude", lon_colname="longitude") -> pd.DataFrame:
+    """Read points from store, loading only tiles that intersect geometry. Note points are not
+    clipped to the geometry itself, only to its tiles.
+
+    Args:
+        fn (str): filename prefix of store
+        geometry (BaseGeometry, optional): shapely geometry to bound points. If None, read all points. Defaults to None.
+        columns (list, optional): columns to read, in addition to coordinates. If None, read all. Defaults to None.
+        lat_colname (str, optional): latitude column name. Defaults to "latitude".
+        lon_colname (str, optional): longitude column name. Defaults to "longitude".
+
+    Returns:
+        pd.DataFrame: points in tiles
+    """
+    store_fn = fn + POINT_STORE_EXT
+    meta = read_store_meta(fn)
+    if meta["n_points"] == 0:
+        return pd.DataFrame({c: [] for c in dict.fromkeys([lat_colname, lon_colname] + list(columns or []))})
+
+    if columns is not None:
+        columns = list(dict.fromkeys([lat_colname, lon_colname, "seq"] + list(columns)))
+    if geometry is None:
+        table = ds.dataset(store_fn, format="parquet", partitioning="hive").to_table(columns=columns)
+    elif "tiles" in meta:
+        # Only list the folders of tiles with points, instead of discovering every file of the store
+        tiles = [t for t in tiles_intersecting(geometry, tile_size=meta["tile_size"]).tolist() if str(t) in meta["tiles"]]
+        files = [os.path.join(store_fn, f"tile={t}", f) for t in tiles for f in sorted(os.listdir(os.path.join(store_fn, f"tile={t}")))]
+        if len(files) == 0:
+            return pd.DataFrame({c: [] for c in (columns or meta["columns"]) if c != "seq"})
+        table = ds.dataset(files, format="parquet").to_table(columns=columns)
+    else:
+        tiles = tiles_intersecting(geometry, tile_size=meta["tile_size"])
+        dataset = ds.dataset(store_fn, format="parquet", partitioning="hive")
+        table = dataset.to_table(columns=columns, filter=ds.field("tile").isin(pa.array(tiles, pa.int32())))
+    return decode_points(table, lat_colname=lat_colname, lon_colname=lon_colname)
+
+def read_store_meta(fn: str) -> dict:
+    """Read metadata of point store: tile size, number of points, and for stores written since they were
+    recorded, column names and number of points in each tile"""
+    with open(os.path.join(fn + POINT_STORE_EXT, POINT_STORE_META)) as f:
+        return json.load(f)
+
+def count_points(fn, geometry: BaseGeometry = None) -> int:
+    """Count points in tiles intersecting geometry from point store metadata, without reading any points.
+    For stores written without tile counts, count all points of store.
+
+    Args:
+        fn (str): filename prefix of data, or list of filename prefixes
+        geometry (BaseGeometry, optional): shapely geometry in lat/lon. If None, count all points. Defaults to None.
+
+    Returns:
+        int: number of points, or None if any data is a legacy csv, which can't be counted without reading it
+    """
+    if isinstance(fn, (list, tuple)):
+        counts = [count_points(f, geometry=geometry) for f in fn]
+        return None if None in counts else sum(counts)
+    if not store_exists(fn):
+        return None
+    meta = read_store_meta(fn)
+    if geometry is None or "tiles" not in meta:
+        return meta["n_points"]
+    return sum(meta["tiles"].get(str(t), 0) for t in tiles_intersecting(geometry, tile_size=meta["tile_size"]).tolist())
+
+def load_points(fn, geometry: BaseGeometry = None, columns: list = None) -> pd.DataFrame:
+    """Load points for filename prefix from point store if it exists, otherwise from legacy csv.
+    Points of several prefixes (e.g. RoW data of neighbouring authorities) are concatenated in order,
+    with track ids offset so that tracks from different sources stay distinct.
+
+    Args:
+        fn (str): filename prefix of data, or list of filename prefixes
+        geometry (BaseGeometry, optional): shapely geometry to bound points when reading from store. Defaults to None.
+        columns (list, optional): columns to read, in addition to coordinates. If None, read all. Defaults to None.
+
+    Returns:
+        pd.DataFrame: points
+    """
+    if isinstance(fn, (list, tuple)):
+        dfs, offset = [], 0
+        for f in fn:
+            df = load_points(f, geometry=geometry, columns=columns)
+            if "trackid" in df and len(df) > 0:
+                df["trackid"] = df["trackid"].to_numpy().astype(np.int64) + offset
+                offset = int(df["trackid"].max()) + 1
+            dfs.append(df)
+        return pd.concat(dfs, ignore_index=True)
+    if store_exists(fn):
+        return read_point_store(fn, geometry=geometry, columns=columns)
+    usecols = None if columns is None else list(dict.fromkeys(["latitude", "longitude"] + list(columns)))
+    return pd.read_csv(fn + ".csv", usecols=usecols)
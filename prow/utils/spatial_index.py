@@ -0,0 +1,109 @@
+"""
+Grid bucketing index to find points inside many polygons with one pass over the points.
+"""
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry.base import BaseGeometry
+
+from . import utils
+
+def concat_ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenate integer ranges [start, end) without a Python loop
+
+    Args:
+        starts (np.ndarray): range starts
+        ends (np.ndarray): range ends (exclusive)
+
+    Returns:
+        np.ndarray: concatenated ranges
+    """
+    lengths = ends - starts
+    total = lengths.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total)
+
+class GridBucketIndex(object):
+    """Index of points bucketed into regular grid cells by integer arithmetic. Querying a polygon takes all
+    points in cells inside the polygon without testing them, and only tests points in cells crossing
+    the polygon boundary exactly, with the same test as utils.points_in_polygon.
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, bounds: tuple, cell_size: float = utils.metres_to_dist(utils.BUCKET_CELL_LENGTH)):
+        """
+        Args:
+            lats (np.ndarray): point latitudes
+            lons (np.ndarray): point longitudes
+            bounds (tuple): (west, south, east, north) of grid. Points outside are never returned.
+            cell_size (float, optional): grid cell side length in degrees. Defaults to utils.BUCKET_CELL_LENGTH in degrees.
+        """
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.west, self.south, east, north = bounds
+        self.cell_size = cell_size
+        self.nx = max(int(np.ceil((east - self.west) / cell_size)), 1)
+        self.ny = max(int(np.ceil((north - self.south) / cell_size)), 1)
+
+        cx = np.floor((self.lons - self.west) / cell_size).astype(np.int64)
+        cy = np.floor((self.lats - self.south) / cell_size).astype(np.int64)
+        valid = (cx >= 0) & (cx < self.nx) & (cy >= 0) & (cy < self.ny)
+        cells = np.where(valid, cy * self.nx + cx, -1)
+
+        self._order = np.argsort(cells, kind="stable")
+        sorted_cells = cells[self._order]
+        self._starts = np.searchsorted(sorted_cells, np.arange(self.nx * self.ny + 1))
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame, bounds: tuple, cell_size: float = utils.metres_to_dist(utils.BUCKET_CELL_LENGTH), lat_colname="latitude", lon_colname="longitude"):
+        """Build index from dataframe of points with latitude and longitude columns"""
+        return cls(df[lat_colname].to_numpy(), df[lon_colname].to_numpy(), bounds, cell_size=cell_size)
+
+    def cell_counts(self) -> np.ndarray:
+        """Return number of points in each grid cell as (ny, nx) array"""
+        return np.diff(self._starts).reshape(self.ny, self.nx)
+
+    def query(self, geometry: BaseGeometry) -> np.ndarray:
+        """Return indices of points inside polygon, in ascending order
+
+        Args:
+            geometry (BaseGeometry): shapely polygon or multipolygon, possibly with holes
+
+        Returns:
+            np.ndarray: point indices
+        """
+        west, south, east, north = geometry.bounds
+        cx0, cx1 = [int(np.clip(np.floor((x - self.west) / self.cell_size), 0, self.nx - 1)) for x in (west, east)]
+        cy0, cy1 = [int(np.clip(np.floor((y - self.south) / self.cell_size), 0, self.ny - 1)) for y in (south, north)]
+        cx, cy = [a.ravel() for a in np.meshgrid(np.arange(cx0, cx1 + 1), np.arange(cy0, cy1 + 1))]
+
+        boxes = shapely.box(self.west + cx * self.cell_size, self.south + cy * self.cell_size,
+                            self.west + (cx + 1) * self.cell_size, self.south + (cy + 1) * self.cell_size)
+        shapely.prepare(geometry)
+        inside = shapely.contains_properly(geometry, boxes)
+        edge = ~inside & shapely.intersects(geometry, boxes)
+
+        cells = cy * self.nx + cx
+        inside_idx = self._order[concat_ranges(self._starts[cells[inside]], self._starts[cells[inside] + 1])]
+        edge_idx = self._order[concat_ranges(self._starts[cells[edge]], self._starts[cells[edge] + 1])]
+
+        # Exact test for points in cells on the polygon boundary
+        lats, lons = self.lats[edge_idx], self.lons[edge_idx]
+        edge_idx = edge_idx[utils.in_box(lats, lons, bbox=geometry.bounds)]
+        edge_idx = edge_idx[utils.contains_points(geometry, self.lats[edge_idx], self.lons[edge_idx])]
+
+        return np.sort(np.concatenate([inside_idx, edge_idx]))
+
+    def points_in_polygon(self, geometry: BaseGeometry, df: pd.DataFrame) -> pd.DataFrame:
+        """Return dataframe points inside polygon, as utils.points_in_polygon. df must be the dataframe
+        the index was built from.
+
+        Args:
+            geometry (BaseGeometry): shapely polygon or multipolygon
+            df (pd.DataFrame): input dataframe with rows representing points
+
+        Returns:
+            pd.DataFrame: points inside polygon
+        """
+        return df.iloc[self.query(geometry)].reset_index()
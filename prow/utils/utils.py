@@ -4,8 +4,10 @@ Miscellaneous helper functions and constants
 import pandas as pd
 import geopandas as gpd
 import numpy as np
-from matplotlib.path import Path
+import shapely
 from shapely.geometry import MultiPolygon
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 import osmnx as ox
 import networkx as nx
@@ -15,15 +17,26 @@ import networkx as nx
 #################
 
 ADDITIONAL_EDGE_DTYPES = {"row": bool, "activity": float}
+PATH_HIGHWAY_FILTER = "footway|cycleway|bridleway|path|track" # regex of OSM highway tags included in path network graphs
 
 SPLIT_POLYGON_BOX_LENGTH = 10000 # side length of square for subregion analysis in metres
+QUADTREE_MAX_POINTS = 2000000 # max public GPS points per subregion when partitioning by quadtree
+QUADTREE_MAX_NODES = 50000 # max path network nodes per subregion when partitioning by quadtree
+QUADTREE_MIN_BOX_LENGTH = 1250 # min side length of quadtree subregion in metres
+QUADTREE_MAX_BOX_LENGTH = 40000 # max side length of quadtree subregion in metres
+NATIONAL_TILE_LENGTH = 10000 # side length of British National Grid tiles shared between authorities in metres
+BUCKET_CELL_LENGTH = 1000 # side length of grid cells for bucketing points into subregions in metres
+POINT_MEMORY_BYTES = 64 # estimated memory per GPS point read for analysis in bytes, including its grid bucket
 THRESH_EDGE_MATCH_DIST = 20 # thresh to assign points to edges in map-matchin in metres
 THRESH_EDGE_MAX_POINT_SEPARATION_PUBLIC_GPS = 30 # max avg dist betweeen points in public track in metres, otherwise delete
 THRESH_EDGE_MAX_POINT_SEPARATION_ROW_GPS = 3000 # max avg dist betweeen points in RoW track in metres, otherwise delete
 THRESH_INTERPOLATION_JUMP_DIST = 200 # max inter-point dist to segment track into sub-tracks in metres
 THRESH_SPURIOUS_GPS_POINT_COUNT = 4 # min number of points in track
+MIN_QUADRAT_POINTS = THRESH_SPURIOUS_GPS_POINT_COUNT # min number of public GPS points in subregion, otherwise skip subregion
+MIN_QUADRAT_TRACKS = 1 # min number of public GPS tracks in subregion, otherwise skip subregion
 THRESH_LARGE_SUBGRAPH_LENGTH = 200 # min total subgraph edge distance for all separate subgraphs in output graph
 INTERPOLATION_DIST_NEAREST_EDGE = 5 # base map graph edge interpolation dist in metres during map-matching
+SNAP_DIST_NEAREST_EDGE = 1 # grid size in metres to deduplicate public GPS points before nearest-edge search
 INTERPOLATION_DIST_ROW_GPS = 5 # desired interpolation distance for all RoW tracks in metres
 INTERPOLATION_DIST_PUBLIC_GPS = 5 # desired interpolation distance for all public GPX tracks in metres
 
@@ -117,6 +130,59 @@ def match_nearest_edges(edges_df: gpd.GeoDataFrame, gps_df: pd.DataFrame, neares
     # Join on edge multi-index (u: start node, v: end node, key: index if >1 edge between same nodes)
     return pd.merge(edges_df, gps_counted, on=["u","v","key"], how="inner")
 
+def aggregate_edge_matches(edges_df: gpd.GeoDataFrame, edge_pos: np.ndarray, trackids: np.ndarray, tracksegids: np.ndarray = None) -> gpd.GeoDataFrame:
+    """Get dataset of graph edges which have been allocated to GPS points, with counts of points, unique tracks and
+    unique track segments per edge. Same as match_nearest_edges but computed in one vectorised pass over integer
+    edge positions, and joined back to edges by position.
+
+    Args:
+        edges_df (gpd.GeoDataFrame): base graph edges
+        edge_pos (np.ndarray): position in edges_df of the edge allocated to each GPS point
+        trackids (np.ndarray): track id of each GPS point
+        tracksegids (np.ndarray, optional): track segment id of each GPS point. If None, count each track
+            as one segment. Defaults to None.
+
+    Returns:
+        gpd.GeoDataFrame: matched graph edges, with "count", "tracks" and "segments" columns
+    """
+    n_edges = len(edges_df)
+    edge_pos = np.asarray(edge_pos, dtype=np.int64)
+    counts = np.bincount(edge_pos, minlength=n_edges)
+
+    # Count unique (edge, track) pairs per edge
+    track_codes, track_uniques = pd.factorize(np.asarray(trackids))
+    edge_tracks = np.unique(edge_pos * len(track_uniques) + track_codes)
+    tracks = np.bincount(edge_tracks // max(len(track_uniques), 1), minlength=n_edges)
+
+    # Count unique (edge, track, segment) triples per edge
+    if tracksegids is None:
+        segments = tracks
+    else:
+        seg_codes, seg_uniques = pd.factorize(track_codes.astype(np.int64) * (np.max(tracksegids, initial=0) + 1) + np.asarray(tracksegids, dtype=np.int64))
+        edge_segments = np.unique(edge_pos * len(seg_uniques) + seg_codes)
+        segments = np.bincount(edge_segments // max(len(seg_uniques), 1), minlength=n_edges)
+
+    matched = counts > 0
+    return edges_df.loc[matched].assign(count=counts[matched], tracks=tracks[matched], segments=segments[matched])
+
+def encode_edge_ids(*indexes) -> list:
+    """Encode (u, v, key) edge multi-indexes to single int64 edge ids, consistent across all given indexes.
+    Each level is factorised and levels are combined pairwise, refactorising after each combination
+    so that ids never overflow.
+
+    Args:
+        indexes: pd.MultiIndex of edges with levels u, v, key
+
+    Returns:
+        list: int64 array of edge ids for each index
+    """
+    lengths = [len(index) for index in indexes]
+    ids = np.zeros(sum(lengths), dtype=np.int64)
+    for level in ["u", "v", "key"]:
+        codes, uniques = pd.factorize(np.concatenate([index.get_level_values(level).to_numpy() for index in indexes]))
+        ids, _ = pd.factorize(ids * len(uniques) + codes)
+    return np.split(ids.astype(np.int64), np.cumsum(lengths)[:-1])
+
 def merge_on_edges(df1: gpd.GeoDataFrame, df2: gpd.GeoDataFrame, hows=["inner", "left_only"], keys=['u','v','key'], del_cols=[]) -> list:
     """Join geodataframes on multiindex.
 
@@ -173,9 +239,45 @@ def filter_large_subgraphs(nodes: gpd.GeoDataFrame, edges: gpd.GeoDataFrame, thr
 
     return ox.graph_to_gdfs(recon, nodes=False, edges=True)
 
+def contains_points(geometry: MultiPolygon, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Return mask of points inside polygon or multipolygon, excluding points in its holes"""
+    shapely.prepare(geometry)
+    return shapely.contains_xy(geometry, np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+
+def large_subgraphs_mask(edges: gpd.GeoDataFrame, thresh: float = THRESH_LARGE_SUBGRAPH_LENGTH) -> np.ndarray:
+    """Find edges in disconnected subgraphs that are big enough, working directly on the edge table:
+    label connected components with a sparse adjacency matrix and sum edge lengths per component.
+    Same selection as filter_large_subgraphs, without building graph objects or copying geometry. If no subgraph
+    is big enough, filter_large_subgraphs keeps the subgraph of the first node of its graph, which osmnx builds
+    from the edges first, so the subgraph of the first edge is kept.
+
+    Args:
+        edges (gpd.GeoDataFrame): graph edges indexed by (u, v, key) with "length" column
+        thresh (float, optional): min subgraph total edge length. Defaults to THRESH_LARGE_SUBGRAPH_LENGTH.
+
+    Returns:
+        np.ndarray: boolean mask over edges of those to keep
+    """
+    if len(edges) == 0:
+        return np.zeros(0, dtype=bool)
+
+    u = edges.index.get_level_values("u").to_numpy()
+    v = edges.index.get_level_values("v").to_numpy()
+    codes, node_ids = pd.factorize(np.concatenate([u, v]))
+    cu, cv = codes[:len(u)], codes[len(u):]
+
+    adjacency = coo_matrix((np.ones(len(cu), dtype=np.int8), (cu, cv)), shape=(len(node_ids), len(node_ids)))
+    n_components, labels = connected_components(adjacency, directed=False)
+    component_length = np.bincount(labels[cu], weights=edges["length"].to_numpy(dtype=np.float64), minlength=n_components)
+
+    mask = component_length[labels[cu]] > thresh
+    if not mask.any():
+        mask = labels[cu] == labels[cu[0]]
+    return mask
+
 def points_in_polygon(geometry: MultiPolygon, df: pd.DataFrame, lat_colname="latitude", lon_colname="longitude") -> pd.DataFrame:
     """Return dataframe points inside polygon. First bound using bounding box to remove most points,
-    then use more expensive matplotlib Path bounding.
+    then use more expensive exact point-in-polygon test.
 
     Args:
         geometry (shapely.geometry.MultiPolygon): polygon from graph boundary download
@@ -188,7 +290,12 @@ def points_in_polygon(geometry: MultiPolygon, df: pd.DataFrame, lat_colname="lat
     """
     df_in_bbox = df.loc[in_box(df[lat_colname], df[lon_colname], bbox=geometry.bounds)]
 
-    points = df_in_bbox[[lon_colname, lat_colname]].to_numpy()
-    inside = Path(geometry.boundary).contains_points(points)
+    inside = contains_points(geometry, df_in_bbox[lat_colname].to_numpy(), df_in_bbox[lon_colname].to_numpy())
+
+    return df_in_bbox[inside].reset_index()
 
-    return df_in_bbox[inside].reset_index()
\ No newline at end of file
+def boundary_items(graph_boundary) -> list:
+    """Return (index, geometry) pairs of subregions in graph boundary, given either as a list of geometries
+    or as a dict of indices to geometries (e.g. national tile ids to tiles, see national_grid)
+    """
+    return list(graph_boundary.items()) if isinstance(graph_boundary, dict) else list(enumerate(graph_boundary))
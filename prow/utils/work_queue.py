@@ -0,0 +1,253 @@
+"""
+Coordination-free work queue on a shared filesystem, so that worker processes on one or several machines
+can share one batch run without a broker. Tasks are json files. A task is claimed by exclusively creating
+a lease file (O_CREAT | O_EXCL, atomic on local filesystems and NFSv3+), which its worker keeps alive with
+heartbeats that update the lease's modification time. A lease not renewed within the lease timeout has
+expired, e.g. because its worker crashed, and the task is claimed again by exclusively creating the next
+generation of lease, so only one worker can take it over. Tasks may wait for other tasks to be done, e.g.
+a reducer that assembles an authority's outputs once all of its subregions are analysed.
+"""
+import os, json, time, socket, hashlib, threading, contextlib
+
+QUEUE_LEASE_TIMEOUT = 600 # seconds since last heartbeat after which a lease expires and its task can be claimed again
+QUEUE_HEARTBEAT_INTERVAL = 60 # seconds between heartbeats renewing the lease of a running task
+QUEUE_POLL_INTERVAL = 5 # seconds between polls when all remaining tasks are leased or waiting for other tasks
+
+def worker_id() -> str:
+    """Return id of this worker process from its host name and process id"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def _write_json(fn: str, obj: dict) -> None:
+    """Write json to a temporary file unique to this process and rename, so that readers never see it incomplete"""
+    tmp_fn = f"{fn}.{os.getpid()}.tmp"
+    with open(tmp_fn, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_fn, fn)
+
+class Lease(object):
+    """Claim of a task by a worker, as returned by WorkQueue.claim"""
+    def __init__(self, queue, task_id: str, generation: int, payload: dict, worker: str):
+        self.queue = queue
+        self.task_id = task_id
+        self.generation = generation
+        self.payload = payload
+        self.worker = worker
+        self.fn = queue.lease_fn(task_id, generation)
+
+    def renew(self) -> bool:
+        """Heartbeat: renew lease, returning False if it has been lost to another worker after expiring"""
+        if self.queue.generation(self.task_id) != self.generation:
+            return False
+        try:
+            os.utime(self.fn)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(self, result: dict = None) -> None:
+        """Mark task done with json-serialisable result. Leases are kept as a record of how often the task was claimed."""
+        _write_json(self.queue.done_fn(self.task_id), {"worker": self.worker, "time": time.time(), "result": result})
+
+    def release(self) -> None:
+        """Expire lease without completing task, so that it can be claimed again straight away. The lease file
+        is kept, so that generations keep increasing and an old holder can't mistake a new lease for its own."""
+        try:
+            os.utime(self.fn, (0, 0))
+        except FileNotFoundError:
+            pass
+
+class WorkQueue(object):
+    """Queue of tasks in a folder on a shared filesystem, with subfolders of task files, leases and done markers.
+    Tasks can be added by any worker at any time, and adding an existing task does nothing.
+    """
+    def __init__(self, root: str, lease_timeout: float = QUEUE_LEASE_TIMEOUT):
+        """
+        Args:
+            root (str): queue folder, shared by all workers
+            lease_timeout (float, optional): seconds since last heartbeat after which a lease expires.
+                Must be longer than the heartbeat interval plus clock differences between machines.
+                Defaults to QUEUE_LEASE_TIMEOUT.
+        """
+        self.root = root
+        self.lease_timeout = lease_timeout
+        for folder in ["tasks", "leases", "done"]:
+            os.makedirs(os.path.join(root, folder), exist_ok=True)
+
+    def task_fn(self, task_id: str) -> str:
+        return os.path.join(self.root, "tasks", f"{task_id}.json")
+
+    def done_fn(self, task_id: str) -> str:
+        return os.path.join(self.root, "done", f"{task_id}.json")
+
+    def lease_fn(self, task_id: str, generation: int) -> str:
+        return os.path.join(self.root, "leases", task_id, f"{generation:06d}.lease")
+
+    def add(self, task_id: str, payload: dict = None, after: list = None) -> bool:
+        """Add task if it doesn't exist
+
+        Args:
+            task_id (str): unique task id, usable as a filename
+            payload (dict, optional): json-serialisable task parameters. Defaults to None.
+            after (list, optional): ids of tasks that must be done before this task can be claimed. Defaults to None.
+
+        Returns:
+            bool: whether task was added
+        """
+        if os.path.isfile(self.task_fn(task_id)):
+            return False
+        _write_json(self.task_fn(task_id), {"payload": payload or {}, "after": list(after or [])})
+        return True
+
+    def task_ids(self) -> list:
+        """Return ids of all tasks, sorted"""
+        return sorted(f[:-len(".json")] for f in os.listdir(os.path.join(self.root, "tasks")) if f.endswith(".json"))
+
+    def task(self, task_id: str) -> dict:
+        """Return task dict with "payload" and "after" keys"""
+        with open(self.task_fn(task_id)) as f:
+            return json.load(f)
+
+    def is_done(self, task_id: str) -> bool:
+        return os.path.isfile(self.done_fn(task_id))
+
+    def result(self, task_id: str) -> dict:
+        """Return done marker of task with "worker", "time" and "result" keys"""
+        with open(self.done_fn(task_id)) as f:
+            return json.load(f)
+
+    def pending(self) -> list:
+        """Return ids of tasks not done"""
+        done = set(f[:-len(".json")] for f in os.listdir(os.path.join(self.root, "done")) if f.endswith(".json"))
+        return [t for t in self.task_ids() if t not in done]
+
+    def generation(self, task_id: str) -> int:
+        """Return generation of latest lease of task, or -1 if it has never been claimed"""
+        try:
+            leases = [f for f in os.listdir(os.path.join(self.root, "leases", task_id)) if f.endswith(".lease")]
+        except FileNotFoundError:
+            return -1
+        return max([int(f[:-len(".lease")]) for f in leases], default=-1)
+
+    def _is_live(self, task_id: str, generation: int) -> bool:
+        """Return whether given generation of lease of task exists and hasn't expired"""
+        if generation < 0:
+            return False
+        try:
+            return time.time() - os.path.getmtime(self.lease_fn(task_id, generation)) < self.lease_timeout
+        except FileNotFoundError:
+            return False
+
+    def is_leased(self, task_id: str) -> bool:
+        """Return whether task has a lease that hasn't expired"""
+        return self._is_live(task_id, self.generation(task_id))
+
+    def try_claim(self, task_id: str, worker: str = None) -> Lease:
+        """Claim task if it is not done, not leased and all tasks it waits for are done
+
+        Args:
+            task_id (str): task id
+            worker (str, optional): worker id recorded in lease. If None, use worker_id(). Defaults to None.
+
+        Returns:
+            Lease: lease of task, or None if it couldn't be claimed
+        """
+        worker = worker_id() if worker is None else worker
+        generation = self.generation(task_id)
+        if self.is_done(task_id) or self._is_live(task_id, generation):
+            return None
+        task = self.task(task_id)
+        if not all(self.is_done(t) for t in task["after"]):
+            return None
+
+        # Only one worker can create the next generation of lease after the one seen expired. Old generations
+        # are kept, so that a worker which saw an even older generation expire can't create one again.
+        generation += 1
+        os.makedirs(os.path.join(self.root, "leases", task_id), exist_ok=True)
+        try:
+            fd = os.open(self.lease_fn(task_id, generation), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, "w") as f:
+            json.dump({"worker": worker, "time": time.time()}, f)
+
+        lease = Lease(self, task_id, generation, task["payload"], worker)
+        if self.is_done(task_id): # completed by previous holder since checking
+            lease.release()
+            return None
+        return lease
+
+    def claim(self, worker: str = None) -> Lease:
+        """Claim any claimable task. Each worker starts looking at a different task, to avoid contention.
+
+        Args:
+            worker (str, optional): worker id recorded in lease. If None, use worker_id(). Defaults to None.
+
+        Returns:
+            Lease: lease of task, or None if no task could be claimed
+        """
+        worker = worker_id() if worker is None else worker
+        pending = self.pending()
+        if len(pending) == 0:
+            return None
+        start = int(hashlib.md5(worker.encode()).hexdigest(), 16) % len(pending)
+        for task_id in pending[start:] + pending[:start]:
+            lease = self.try_claim(task_id, worker)
+            if lease is not None:
+                return lease
+        return None
+
+    def status(self) -> dict:
+        """Return numbers of tasks done, leased, and waiting to be claimed"""
+        pending = self.pending()
+        leased = sum(self.is_leased(t) for t in pending)
+        return {"done": len(self.task_ids()) - len(pending), "leased": leased, "waiting": len(pending) - leased}
+
+@contextlib.contextmanager
+def heartbeat(lease: Lease, interval: float = QUEUE_HEARTBEAT_INTERVAL):
+    """Context manager renewing lease every interval seconds in a background thread while the block runs"""
+    stop = threading.Event()
+    def beat():
+        while not stop.wait(interval):
+            if not lease.renew():
+                print(f"Lost lease of task {lease.task_id}")
+                return
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield lease
+    finally:
+        stop.set()
+        thread.join()
+
+def run_worker(queue: WorkQueue, handler, worker: str = None, heartbeat_interval: float = QUEUE_HEARTBEAT_INTERVAL, poll_interval: float = QUEUE_POLL_INTERVAL) -> int:
+    """Claim and run tasks until all tasks in queue are done, including tasks added by handlers while running.
+    If handler raises, the lease is released so that the task can be claimed again, and the error is raised.
+
+    Args:
+        queue (WorkQueue): queue to work on
+        handler: function taking Lease and returning json-serialisable result. It can add tasks to lease.queue.
+        worker (str, optional): worker id. If None, use worker_id(). Defaults to None.
+        heartbeat_interval (float, optional): seconds between heartbeats. Defaults to QUEUE_HEARTBEAT_INTERVAL.
+        poll_interval (float, optional): seconds between polls for claimable tasks. Defaults to QUEUE_POLL_INTERVAL.
+
+    Returns:
+        int: number of tasks done by this worker
+    """
+    worker = worker_id() if worker is None else worker
+    n_done = 0
+    while True:
+        lease = queue.claim(worker)
+        if lease is None:
+            if len(queue.pending()) == 0:
+                return n_done
+            time.sleep(poll_interval)
+            continue
+
+        try:
+            with heartbeat(lease, interval=heartbeat_interval):
+                result = handler(lease)
+        except BaseException:
+            lease.release()
+            raise
+        lease.complete(result)
+        n_done += 1
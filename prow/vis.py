@@ -9,6 +9,7 @@ from folium import Map
 
 from .utils.custom_plot_graph_folium import plot_graph_folium
 from .utils.utils import ADDITIONAL_EDGE_DTYPES
+from .utils.graph_store import load_graph
 
 def compose_graphs_plot_folium(
         fn_graphs: Iterable[str], 
@@ -21,7 +22,7 @@ def compose_graphs_plot_folium(
     """Load output graphs from analysis, merge together, plot in Folium and output file or HTML
 
     Args:
-        fn_graphs (list): list of graph filenames to compose
+        fn_graphs (list): list of graph filenames to compose, without extension
         fn_graph_prefix (str, optional): folder prefix for graphs. Defaults to "".
         fn_vis (str, optional): filename for output map. If "", don't save. Defaults to "".
         graph_edge_funcs (list, optional): list of functions to apply to graph edges 
@@ -32,7 +33,7 @@ def compose_graphs_plot_folium(
         folium.Map: returned folium map if return_map==True
     """
 
-    graphs = [ox.load_graphml(f"{fn_graph_prefix}/{fn}.graphml", edge_dtypes=ADDITIONAL_EDGE_DTYPES) for fn in fn_graphs]
+    graphs = [load_graph(f"{fn_graph_prefix}/{fn}", edge_dtypes=ADDITIONAL_EDGE_DTYPES) for fn in fn_graphs]
     
     if graph_edge_funcs is not None:
         for i,func in enumerate(graph_edge_funcs):
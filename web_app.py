@@ -4,6 +4,7 @@ from streamlit_folium import st_folium, folium_static
 
 from prow import compose_graphs_plot_folium
 from prow.utils import plot_graph_folium, ADDITIONAL_EDGE_DTYPES, conversions
+from prow.utils.graph_store import GRAPH_STORE_EXT
 
 st.set_page_config(page_title='prow web-app', page_icon=':world-map:')
 
@@ -13,7 +14,7 @@ st.set_page_config(page_title='prow web-app', page_icon=':world-map:')
 
 "Check out the [blog](https://andrewwango.github.io/prow_ml/) for why and how!"
 
-authority_codes = list(set([os.path.relpath(f, "output").split("_")[0] for f in glob.glob("output/*.graphml")]))
+authority_codes = list(set([os.path.relpath(f, "output").split("_")[0] for f in glob.glob("output/*.graphml") + glob.glob(f"output/*{GRAPH_STORE_EXT}")]))
 analysis_types = {
     "P" : "Paths that have activity but aren't RoW",
     "R" : "RoW that don't have activity",